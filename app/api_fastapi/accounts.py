@@ -6,6 +6,7 @@ from ..schemas_fastapi import AccountOut, AccountCreate, AccountUpdate
 from ..logger import log_info, log_success, log_error, log_warning
 from ..services.general_diary import create_general_diary_entry
 from ..services.auth_helper import get_username_from_request
+from ..services.report_cache import bump_data_version
 
 
 router = APIRouter(prefix="/accounts", tags=["accounts"])
@@ -45,6 +46,7 @@ def create_account(payload: AccountCreate, db: Session = Depends(get_db)):
         db.refresh(acc)
         
         log_success("CREATE_ACCOUNT", f"Tạo tài khoản thành công: {payload.ten_tk} (ID: {acc.id})")
+        bump_data_version()
         # Return AccountOut format để frontend có thể sử dụng trực tiếp
         return AccountOut.model_validate(acc)
     except Exception as e:
@@ -95,6 +97,7 @@ def update_account(account_id: int, payload: AccountUpdate, request: Request, db
         log_error("UPDATE_ACCOUNT_DIARY", f"Lỗi khi ghi vào General Diary: {str(diary_error)}", error=diary_error)
         db.commit()  # Vẫn commit việc update khách hàng
     
+    bump_data_version()
     return {"success": True}
 
 
@@ -130,6 +133,7 @@ def delete_account(account_id: int, request: Request, db: Session = Depends(get_
         log_error("DELETE_ACCOUNT_DIARY", f"Lỗi khi ghi vào General Diary: {str(diary_error)}", error=diary_error)
         db.commit()  # Vẫn commit việc xóa khách hàng
     
+    bump_data_version()
     return {"success": True}
 
 
@@ -1,159 +1,157 @@
 """
 Chatbot API for AI assistant reorder suggestions
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, desc
+from sqlalchemy import func, and_, true, false, insert
 from datetime import datetime, timedelta, date
-from ..database import get_db
-from ..models import Product, Warehouse, Order, OrderItem, Invoice, InvoiceItem
+import json
+import uuid
+from ..database import get_db, SessionLocal
+from ..models import Product, Warehouse, Order, OrderItem, Invoice, ReorderSnapshot
 from ..logger import log_info, log_error, log_success
+from ..services.orders import ORDER_STATUS_PENDING
+from ..services.reorder import (
+    load_reorder_table, load_sales_by_product, load_warehouse_stock,
+    refresh_reorder_snapshot, snapshot_suggestion, snapshot_age, get_snapshot_version, bump_snapshot_version, LOW_STOCK_THRESHOLD,
+)
+from ..services.report_cache import bump_data_version, cached_report
+from ..services.intent_router import (
+    route_intent, INTENT_REORDER, INTENT_LOW_STOCK, INTENT_BEST_SELLERS, INTENT_OVERVIEW, INTENT_REVENUE,
+)
 from typing import List, Optional
 
 router = APIRouter(prefix="/chatbot", tags=["chatbot"])
 
 
-def analyze_sales_trend(product_code: str, days: int, db: Session) -> dict:
-    """Phân tích xu hướng bán hàng của sản phẩm từ hóa đơn đã thanh toán"""
-    # Tính toán số lượng đã bán trong khoảng thời gian
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=days)
-    
-    # Tìm product_id từ product_code
-    product = db.query(Product).filter(Product.ma_sp == product_code).first()
-    if not product:
-        return {
-            "total_sold": 0,
-            "sales_rate": 0,
-            "period_days": days
-        }
-    
-    # Lấy tất cả invoice items của sản phẩm đã thanh toán trong khoảng thời gian
-    total_sold = db.query(func.sum(InvoiceItem.so_luong)).join(
-        Invoice, InvoiceItem.invoice_id == Invoice.id
-    ).filter(
-        and_(
-            Invoice.ngay_hd >= start_date,
-            Invoice.ngay_hd <= end_date,
-            Invoice.trang_thai.ilike('%đã thanh toán%'),
-            InvoiceItem.product_code == product_code
-        )
-    ).scalar() or 0
+@router.post("/analyze")
+def analyze_and_suggest(message: dict, db: Session = Depends(get_db)):
+    """Phân tích yêu cầu và đưa ra đề xuất"""
+    user_message = message.get("message", "").lower()
     
-    # Tính tốc độ bán trung bình mỗi ngày
-    sales_rate = total_sold / days if days > 0 else 0
+    log_info("CHATBOT", f"Received message: {user_message}")
     
-    return {
-        "total_sold": int(total_sold),
-        "sales_rate": round(sales_rate, 2),
-        "period_days": days
-    }
+    return _answer(route_intent(user_message), db)
 
 
-def calculate_reorder_suggestion(product: Product, warehouse: Optional[Warehouse], db: Session) -> dict:
-    """Tính toán đề xuất đặt hàng"""
-    # Phân tích xu hướng bán hàng trong 30 ngày
-    trend_30 = analyze_sales_trend(product.ma_sp, 30, db)
-    trend_7 = analyze_sales_trend(product.ma_sp, 7, db)
+@router.get("/analyze/stream")
+def analyze_and_suggest_stream(message: str = Query("", description="Câu hỏi cho chatbot")):
+    """Phiên bản server-sent events của /analyze (dùng được với EventSource)
     
-    # Lấy số lượng tồn kho hiện tại
-    current_stock = warehouse.so_luong if warehouse else product.so_luong
+    Các event lần lượt: intent (gửi ngay), summary (nội dung trả lời), suggestion (mỗi đề xuất một event),
+    done; lỗi được gửi bằng event error.
     
-    # Tính tốc độ bán trung bình (ưu tiên 7 ngày gần nhất)
-    sales_rate = trend_7["sales_rate"] if trend_7["sales_rate"] > 0 else trend_30["sales_rate"]
-    
-    # Tính số ngày dự kiến hết hàng
-    days_until_out = int(current_stock / sales_rate) if sales_rate > 0 else 999
-    
-    # Tính số lượng đề xuất đặt hàng (đủ cho 30 ngày + buffer 20%)
-    if sales_rate > 0:
-        recommended_quantity = int(sales_rate * 30 * 1.2)
-    else:
-        # Nếu chưa có dữ liệu bán hàng, đề xuất bằng số lượng hiện tại
-        recommended_quantity = max(current_stock, 50)
-    
-    # Xác định mức độ ưu tiên
-    priority = "high" if days_until_out <= 7 or current_stock <= 10 else "normal"
+    Chỉ event intent được gửi trước khi truy vấn database. Câu trả lời được tính trọn (hoặc lấy từ cache)
+    trước event summary vì summary chứa số đề xuất, rồi summary và các suggestion được phát lại liền nhau;
+    thời gian tới byte đầu tiên vì vậy chỉ tính cho event intent, không phải cho từng đề xuất.
+    """
+    return _event_stream(message)
+
+
+@router.post("/analyze/stream")
+def analyze_and_suggest_stream_post(message: dict):
+    """Như GET /analyze/stream nhưng nhận {"message": ...} trong body"""
+    return _event_stream(message.get("message", ""))
+
+
+def _answer(intent: str, db: Session) -> dict:
+    """Câu trả lời cho intent, kèm tuổi snapshot nếu câu trả lời đọc từ snapshot"""
+    # Câu trả lời chỉ phụ thuộc intent và dữ liệu: cache theo intent, phiên bản dữ liệu và phiên bản snapshot,
+    # các câu hỏi cùng intent (kể cả gõ khác nhau) dùng chung một lần tính
+    result = cached_report(f"chatbot.{intent}", {"snapshot": get_snapshot_version()}, lambda: _analyze_intent(intent, db))
     
-    return {
-        "ma_sp": product.ma_sp,
-        "product_name": product.ten_sp,
-        "current_stock": current_stock,
-        "sales_rate": round(sales_rate, 2),
-        "days_until_out": days_until_out if days_until_out < 999 else "N/A",
-        "recommended_quantity": recommended_quantity,
-        "priority": priority,
-        "gia_nhap": warehouse.gia_nhap if warehouse else product.gia_von or 0
-    }
+    # Tuổi snapshot tính lại mỗi lần trả lời, không lấy từ cache
+    refreshed_at = result.get("refreshed_at")
+    if refreshed_at is None:
+        return result
+    response = {key: value for key, value in result.items() if key != "refreshed_at"}
+    response["response"] = result["response"] + _snapshot_note(refreshed_at)
+    response["snapshot"] = snapshot_age(refreshed_at)
+    return response
 
 
-@router.post("/analyze")
-def analyze_and_suggest(message: dict, db: Session = Depends(get_db)):
-    """Phân tích yêu cầu và đưa ra đề xuất"""
-    user_message = message.get("message", "").lower()
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _event_stream(message: str) -> StreamingResponse:
+    user_message = (message or "").lower()
+    log_info("CHATBOT", f"Received stream message: {user_message}")
     
-    log_info("CHATBOT", f"Received message: {user_message}")
+    def events():
+        # Intent được xác định không cần database: gửi ngay để client nhận byte đầu tiên sớm
+        intent = route_intent(user_message)
+        yield _sse("intent", {"intent": intent})
+        
+        # Session riêng vì generator chạy sau khi endpoint đã trả về
+        db = SessionLocal()
+        try:
+            # Tính trọn câu trả lời (dùng chung cache với /analyze) rồi mới phát summary và các đề xuất
+            result = _answer(intent, db)
+            suggestions = result.get("suggestions") or []
+            yield _sse("summary", {
+                **{key: value for key, value in result.items() if key != "suggestions"},
+                "suggestion_count": len(suggestions),
+            })
+            for index, suggestion in enumerate(suggestions):
+                yield _sse("suggestion", {"index": index, **suggestion})
+            yield _sse("done", {"suggestion_count": len(suggestions)})
+        except HTTPException as e:
+            yield _sse("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            log_error("CHATBOT", f"Error streaming analysis: {str(e)}", error=e)
+            yield _sse("error", {"status_code": 500, "detail": "Lỗi khi phân tích yêu cầu"})
+        finally:
+            db.close()
     
-    # Phân tích intent từ message
-    if any(keyword in user_message for keyword in ["đề xuất", "đặt hàng", "reorder", "suggest"]):
-        # Lấy tất cả sản phẩm có trong kho
-        products = db.query(Product).all()
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _read_snapshot(db: Session, condition, order_by, limit: int = 5):
+    """Đọc các dòng snapshot thỏa điều kiện cùng tổng số dòng (window count) trong một truy vấn.
+
+    Trả về (rows, total, refreshed_at). Snapshot trống (job chưa chạy lần nào) thì làm mới ngay.
+    """
+    result = db.query(ReorderSnapshot, func.count().over().label("total")).filter(
+        condition
+    ).order_by(order_by).limit(limit).all()
+    if result:
+        return [r[0] for r in result], result[0].total, result[0][0].refreshed_at
+
+    refreshed_at = db.query(ReorderSnapshot.refreshed_at).limit(1).scalar()
+    if refreshed_at is not None:
+        return [], 0, refreshed_at
+    info = refresh_reorder_snapshot(db)
+    db.commit()
+    bump_snapshot_version()
+    if info["products"] == 0:
+        return [], 0, info["refreshed_at"]
+    return _read_snapshot(db, condition, order_by, limit)
+
+
+def _snapshot_note(refreshed_at: datetime) -> str:
+    minutes = snapshot_age(refreshed_at)["age_seconds"] // 60
+    age = f"{minutes} phút trước" if minutes else "vừa xong"
+    return f"\n\n🕒 Dữ liệu tồn kho cập nhật lúc {refreshed_at.strftime('%H:%M %d/%m/%Y')} ({age})."
+
+
+def _analyze_intent(intent: str, db: Session) -> dict:
+    if intent == INTENT_REORDER:
+        # Đọc từ reorder_snapshots (được job định kỳ tính lại): sản phẩm sắp hết hàng (≤ 30 ngày),
+        # bán chạy mà tồn kho thấp (≤ 50) hoặc đã hết hàng, theo thứ tự ưu tiên. Giới hạn 5 đề xuất đầu tiên.
+        rows, _, refreshed_at = _read_snapshot(
+            db, ReorderSnapshot.candidate_rank.isnot(None), ReorderSnapshot.candidate_rank
+        )
         suggestions = []
-        
-        # Lấy danh sách sản phẩm bán chạy để ưu tiên
-        end_date = date.today()
-        start_date = end_date - timedelta(days=30)
-        
-        best_sellers = db.query(
-            InvoiceItem.product_code,
-            func.sum(InvoiceItem.so_luong).label('total_sold')
-        ).join(
-            Invoice, InvoiceItem.invoice_id == Invoice.id
-        ).filter(
-            and_(
-                Invoice.ngay_hd >= start_date,
-                Invoice.ngay_hd <= end_date,
-                Invoice.trang_thai.ilike('%đã thanh toán%')
-            )
-        ).group_by(
-            InvoiceItem.product_code
-        ).order_by(
-            desc('total_sold')
-        ).limit(20).all()
-        
-        best_seller_codes = {seller.product_code for seller in best_sellers}
-        
-        for product in products:
-            # Tìm warehouse của sản phẩm
-            warehouse = db.query(Warehouse).filter(
-                Warehouse.ma_sp == product.ma_sp
-            ).first()
-            
-            suggestion = calculate_reorder_suggestion(product, warehouse, db)
-            
-            # Ưu tiên sản phẩm bán chạy đang dần hết hàng
-            is_best_seller = product.ma_sp in best_seller_codes
-            current_stock = warehouse.so_luong if warehouse else product.so_luong
-            
-            # Đề xuất nếu:
-            # 1. Sắp hết hàng (days_until_out <= 30)
-            # 2. Hoặc là sản phẩm bán chạy và tồn kho thấp (<= 50)
-            # 3. Hoặc đã hết hàng
-            if (suggestion["days_until_out"] != "N/A" and suggestion["days_until_out"] <= 30) or \
-               (is_best_seller and current_stock <= 50) or \
-               current_stock <= 0:
-                suggestion["is_best_seller"] = is_best_seller
-                suggestions.append(suggestion)
-        
-        # Sắp xếp: ưu tiên sản phẩm bán chạy và sắp hết hàng
-        suggestions.sort(key=lambda x: (
-            0 if x.get("is_best_seller", False) and x["priority"] == "high" else 1,  # Best seller + high priority first
-            0 if x["priority"] == "high" else 1,  # High priority
-            x["days_until_out"] if isinstance(x["days_until_out"], int) else 999  # Days until out
-        ))
-        
-        # Giới hạn 5 đề xuất đầu tiên
-        suggestions = suggestions[:5]
+        for row in rows:
+            item = snapshot_suggestion(row)
+            item["is_best_seller"] = row.is_best_seller
+            suggestions.append(item)
         
         if suggestions:
             best_seller_count = sum(1 for s in suggestions if s.get("is_best_seller", False))
@@ -163,87 +161,58 @@ def analyze_and_suggest(message: dict, db: Session = Depends(get_db)):
             response_text += "Dựa trên tốc độ bán hàng và số lượng tồn kho hiện tại, bạn nên xem xét đặt hàng các sản phẩm sau:"
         else:
             response_text = "Hiện tại không có sản phẩm nào cần đặt hàng khẩn cấp. Tất cả sản phẩm đều có đủ tồn kho."
-            suggestions = []
         
         return {
             "response": response_text,
-            "suggestions": suggestions
+            "suggestions": suggestions,
+            "refreshed_at": refreshed_at
         }
     
-    elif any(keyword in user_message for keyword in ["tồn kho", "inventory", "stock", "sắp hết", "hết hàng"]):
-        # Tìm sản phẩm sắp hết hàng
-        products = db.query(Product).all()
-        low_stock_products = []
-        
-        for product in products:
-            warehouse = db.query(Warehouse).filter(
-                Warehouse.ma_sp == product.ma_sp
-            ).first()
-            
-            current_stock = warehouse.so_luong if warehouse else product.so_luong
-            
-            if current_stock <= 20:  # Ngưỡng cảnh báo
-                suggestion = calculate_reorder_suggestion(product, warehouse, db)
-                low_stock_products.append(suggestion)
+    elif intent == INTENT_LOW_STOCK:
+        # Tìm sản phẩm sắp hết hàng (tồn kho ≤ ngưỡng cảnh báo) từ snapshot
+        rows, low_stock_count, refreshed_at = _read_snapshot(
+            db, ReorderSnapshot.is_low_stock == true(), ReorderSnapshot.vi_tri
+        )
+        low_stock_products = [snapshot_suggestion(row) for row in rows]
         
         if low_stock_products:
-            response_text = f"Tôi đã kiểm tra và tìm thấy {len(low_stock_products)} sản phẩm có tồn kho thấp:\n\n"
+            response_text = f"Tôi đã kiểm tra và tìm thấy {low_stock_count} sản phẩm có tồn kho thấp:\n\n"
             response_text += "Các sản phẩm này cần được theo dõi và đặt hàng sớm:"
         else:
             response_text = "Tất cả sản phẩm đều có đủ tồn kho. Không có sản phẩm nào sắp hết hàng."
-            low_stock_products = []
         
         return {
             "response": response_text,
-            "suggestions": low_stock_products[:5]  # Giới hạn 5 sản phẩm
+            "suggestions": low_stock_products,  # Tối đa 5 sản phẩm
+            "refreshed_at": refreshed_at
         }
     
-    elif any(keyword in user_message for keyword in ["bán chạy", "best selling", "top", "nhiều nhất"]):
-        # Phân tích sản phẩm bán chạy từ hóa đơn đã thanh toán
-        end_date = date.today()
-        start_date = end_date - timedelta(days=30)
-        
-        # Lấy dữ liệu từ invoice items đã thanh toán
-        best_sellers = db.query(
-            InvoiceItem.product_code,
-            InvoiceItem.product_name,
-            func.sum(InvoiceItem.so_luong).label('total_sold'),
-            func.sum(InvoiceItem.total_price).label('total_revenue')
-        ).join(
-            Invoice, InvoiceItem.invoice_id == Invoice.id
-        ).filter(
-            and_(
-                Invoice.ngay_hd >= start_date,
-                Invoice.ngay_hd <= end_date,
-                Invoice.trang_thai.ilike('%đã thanh toán%')
-            )
-        ).group_by(
-            InvoiceItem.product_code,
-            InvoiceItem.product_name
-        ).order_by(
-            desc('total_sold')
-        ).limit(10).all()
+    elif intent == INTENT_BEST_SELLERS:
+        # Phân tích sản phẩm bán chạy từ hóa đơn đã thanh toán (daily_sales, 30 ngày qua)
+        sales = load_sales_by_product(db)
+        warehouses = load_warehouse_stock(db)
+        table = load_reorder_table(db, sales=sales, warehouses=warehouses)
+        best_sellers = sorted((r for r in sales if r.sold_30 > 0), key=lambda r: r.sold_30, reverse=True)[:10]
         
         if best_sellers:
             response_text = f"🔥 Top {len(best_sellers)} sản phẩm bán chạy trong 30 ngày qua:\n\n"
             
             suggestions = []
             for idx, seller in enumerate(best_sellers, 1):
-                product = db.query(Product).filter(Product.ma_sp == seller.product_code).first()
-                warehouse = db.query(Warehouse).filter(Warehouse.ma_sp == seller.product_code).first()
+                i = table.index.get(seller.ma_sp)
+                if i is not None:
+                    current_stock = int(table.stock[i])
+                else:
+                    current_stock = (warehouses.get(seller.ma_sp) or (0, 0))[0] or 0
                 
-                current_stock = warehouse.so_luong if warehouse else (product.so_luong if product else 0)
-                
-                response_text += f"{idx}. {seller.product_name} ({seller.product_code})\n"
-                response_text += f"   • Đã bán: {int(seller.total_sold)} sản phẩm\n"
-                response_text += f"   • Doanh thu: {float(seller.total_revenue):,.0f} VNĐ\n"
+                response_text += f"{idx}. {seller.ten_sp} ({seller.ma_sp})\n"
+                response_text += f"   • Đã bán: {int(seller.sold_30)} sản phẩm\n"
+                response_text += f"   • Doanh thu: {float(seller.revenue_30):,.0f} VNĐ\n"
                 response_text += f"   • Tồn kho hiện tại: {current_stock}\n\n"
                 
                 # Nếu tồn kho thấp, thêm vào suggestions
-                if current_stock <= 50:
-                    suggestion = calculate_reorder_suggestion(product, warehouse, db) if product else None
-                    if suggestion:
-                        suggestions.append(suggestion)
+                if current_stock <= 50 and i is not None:
+                    suggestions.append(table.suggestion(i))
             
             if suggestions:
                 response_text += "\n⚠️ Một số sản phẩm bán chạy đang có tồn kho thấp và cần đặt hàng ngay!"
@@ -256,40 +225,41 @@ def analyze_and_suggest(message: dict, db: Session = Depends(get_db)):
             "suggestions": suggestions[:5]  # Giới hạn 5 đề xuất
         }
     
-    elif any(keyword in user_message for keyword in ["phân tích", "analysis", "thống kê", "statistics"]):
+    elif intent == INTENT_OVERVIEW:
         # Phân tích tổng quan
         total_products = db.query(Product).count()
         total_warehouse_items = db.query(Warehouse).count()
         
-        # Đếm sản phẩm sắp hết
-        low_stock_count = 0
-        products = db.query(Product).all()
-        for product in products:
-            warehouse = db.query(Warehouse).filter(
-                Warehouse.ma_sp == product.ma_sp
-            ).first()
-            current_stock = warehouse.so_luong if warehouse else product.so_luong
-            if current_stock <= 20:
-                low_stock_count += 1
+        # Đếm sản phẩm sắp hết từ snapshot
+        low_stock_count, refreshed_at = db.query(
+            func.count(ReorderSnapshot.id).filter(ReorderSnapshot.is_low_stock == true()),
+            func.max(ReorderSnapshot.refreshed_at),
+        ).one()
+        if refreshed_at is None:
+            info = refresh_reorder_snapshot(db)
+            db.commit()
+            bump_snapshot_version()
+            low_stock_count, refreshed_at = info["low_stock"], info["refreshed_at"]
         
         # Tính tổng doanh thu từ hóa đơn đã thanh toán
         total_revenue = db.query(func.sum(Invoice.tong_tien)).filter(
-            Invoice.trang_thai.ilike('%đã thanh toán%')
+            Invoice.da_thanh_toan == true()
         ).scalar() or 0
         
         response_text = f"📊 Báo cáo tổng quan:\n\n"
         response_text += f"• Tổng số sản phẩm: {total_products}\n"
         response_text += f"• Tổng số item trong kho: {total_warehouse_items}\n"
-        response_text += f"• Sản phẩm sắp hết (≤20): {low_stock_count}\n"
+        response_text += f"• Sản phẩm sắp hết (≤{LOW_STOCK_THRESHOLD}): {low_stock_count}\n"
         response_text += f"• Tổng doanh thu: {float(total_revenue):,.0f} VNĐ\n\n"
         response_text += "Bạn có muốn tôi đề xuất đặt hàng cho các sản phẩm sắp hết không?"
         
         return {
             "response": response_text,
-            "suggestions": []
+            "suggestions": [],
+            "refreshed_at": refreshed_at
         }
     
-    elif any(keyword in user_message for keyword in ["doanh thu", "revenue", "báo cáo", "report"]):
+    elif intent == INTENT_REVENUE:
         # Phân tích doanh thu
         end_date = date.today()
         start_date = end_date - timedelta(days=30)
@@ -299,7 +269,7 @@ def analyze_and_suggest(message: dict, db: Session = Depends(get_db)):
             and_(
                 Invoice.ngay_hd >= start_date,
                 Invoice.ngay_hd <= end_date,
-                Invoice.trang_thai.ilike('%đã thanh toán%')
+                Invoice.da_thanh_toan == true()
             )
         ).scalar() or 0
         
@@ -308,13 +278,13 @@ def analyze_and_suggest(message: dict, db: Session = Depends(get_db)):
             and_(
                 Invoice.ngay_hd >= start_date,
                 Invoice.ngay_hd <= end_date,
-                Invoice.trang_thai.ilike('%đã thanh toán%')
+                Invoice.da_thanh_toan == true()
             )
         ).scalar() or 0
         
         # Tính công nợ
         unpaid_invoices = db.query(Invoice).filter(
-            ~Invoice.trang_thai.ilike('%đã thanh toán%')
+            Invoice.da_thanh_toan == false()
         ).all()
         total_debt = sum(float(inv.tong_tien or 0) for inv in unpaid_invoices)
         
@@ -351,61 +321,139 @@ def analyze_and_suggest(message: dict, db: Session = Depends(get_db)):
         }
 
 
-@router.post("/create-order")
-def create_reorder(payload: dict, db: Session = Depends(get_db)):
-    """Tạo đơn đặt hàng tự động từ chatbot"""
-    product_code = payload.get("product_code")
-    quantity = payload.get("quantity")
-    
-    if not product_code or not quantity:
-        raise HTTPException(status_code=400, detail="Thiếu thông tin sản phẩm hoặc số lượng")
-    
-    # Tìm sản phẩm
-    product = db.query(Product).filter(Product.ma_sp == product_code).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Không tìm thấy sản phẩm")
+def _chatbot_order_code() -> str:
+    """Mã đơn đặt hàng từ chatbot: thời điểm tạo + hậu tố ngẫu nhiên để hai đơn tạo cùng giây không trùng mã"""
+    return f"CHATBOT-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
+
+
+def _create_purchase_order(db: Session, lines: list[dict]) -> dict:
+    """Tạo một đơn đặt hàng gồm nhiều sản phẩm trong một transaction.
+
+    `lines`: [{"product_code", "quantity"}]; sản phẩm trùng mã được cộng dồn số lượng.
+    Sản phẩm và kho được nạp bằng một truy vấn IN cho mỗi bảng, các dòng OrderItem được
+    thêm bằng một câu INSERT nhiều dòng.
+    """
+    quantities: dict = {}
+    for line in lines:
+        product_code = line.get("product_code")
+        quantity = line.get("quantity")
+        if not product_code or not quantity:
+            raise HTTPException(status_code=400, detail="Thiếu thông tin sản phẩm hoặc số lượng")
+        if isinstance(quantity, bool) or not isinstance(quantity, (int, float)) or quantity <= 0 or quantity != int(quantity):
+            raise HTTPException(status_code=400, detail=f"Số lượng không hợp lệ cho sản phẩm {product_code}")
+        quantities[product_code] = quantities.get(product_code, 0) + int(quantity)
     
-    # Tìm warehouse
-    warehouse = db.query(Warehouse).filter(Warehouse.ma_sp == product_code).first()
+    codes = list(quantities)
+    products = {p.ma_sp: p for p in db.query(Product).filter(Product.ma_sp.in_(codes))}
+    missing = [code for code in codes if code not in products]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy sản phẩm: {', '.join(missing)}")
+    gia_nhap = dict(db.query(Warehouse.ma_sp, Warehouse.gia_nhap).filter(Warehouse.ma_sp.in_(codes)).all())
     
-    # Tạo mã đơn hàng tự động
-    order_code = f"CHATBOT-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    items = []
+    for code, quantity in quantities.items():
+        product = products[code]
+        # Giá nhập lấy từ kho nếu sản phẩm có trong kho, ngược lại lấy giá vốn của sản phẩm
+        don_gia = (gia_nhap[code] if code in gia_nhap else product.gia_von) or 0
+        items.append({
+            "product_id": product.id,
+            "so_luong": quantity,
+            "don_gia": don_gia,
+            "total_price": quantity * don_gia,
+        })
     
+    order_code = _chatbot_order_code()
     try:
-        # Tạo đơn hàng
         order = Order(
             ma_don_hang=order_code,
             thong_tin_kh="Đơn đặt hàng tự động từ Thư ký ảo AI",
             ngay_tao=datetime.now().date(),
-            so_luong=quantity,
-            tong_tien=quantity * (warehouse.gia_nhap if warehouse else product.gia_von or 0),
-            trang_thai="Chờ xử lý"
+            so_luong=sum(item["so_luong"] for item in items),
+            tong_tien=sum(item["total_price"] for item in items),
+            trang_thai="Chờ xử lý",
+            ma_trang_thai=ORDER_STATUS_PENDING
         )
         db.add(order)
         db.flush()
         
-        # Tạo order item
-        order_item = OrderItem(
-            order_id=order.id,
-            product_id=product.id,
-            so_luong=quantity,
-            don_gia=warehouse.gia_nhap if warehouse else product.gia_von or 0,
-            total_price=quantity * (warehouse.gia_nhap if warehouse else product.gia_von or 0)
-        )
-        db.add(order_item)
+        db.execute(insert(OrderItem), [{**item, "order_id": order.id} for item in items])
         db.commit()
-        db.refresh(order)
-        
-        log_success("CHATBOT_ORDER", f"Created order {order_code} for product {product_code}, quantity {quantity}")
-        
-        return {
-            "success": True,
-            "order_code": order_code,
-            "order_id": order.id,
-            "message": f"Đã tạo đơn đặt hàng {order_code} cho {quantity} sản phẩm {product.ten_sp}"
-        }
     except Exception as e:
         db.rollback()
         log_error("CHATBOT_ORDER", f"Error creating order: {str(e)}", error=e)
         raise HTTPException(status_code=500, detail=f"Lỗi khi tạo đơn đặt hàng: {str(e)}")
+    
+    log_success("CHATBOT_ORDER", f"Created order {order_code} with {len(items)} products")
+    bump_data_version()
+    return {
+        "order": order,
+        "products": products,
+        "quantities": quantities,
+    }
+
+
+@router.post("/create-order")
+def create_reorder(payload: dict, db: Session = Depends(get_db)):
+    """Tạo đơn đặt hàng tự động từ chatbot"""
+    product_code = payload.get("product_code")
+    quantity = payload.get("quantity")
+    
+    created = _create_purchase_order(db, [{"product_code": product_code, "quantity": quantity}])
+    order = created["order"]
+    product = created["products"][product_code]
+    
+    return {
+        "success": True,
+        "order_code": order.ma_don_hang,
+        "order_id": order.id,
+        "message": f"Đã tạo đơn đặt hàng {order.ma_don_hang} cho {quantity} sản phẩm {product.ten_sp}"
+    }
+
+
+@router.post("/create-orders")
+def create_bulk_reorder(payload: dict, db: Session = Depends(get_db)):
+    """Tạo một đơn đặt hàng gồm tất cả đề xuất được chấp nhận từ chatbot
+    
+    payload: {"items": [{"product_code": "SP01", "quantity": 50}, ...]}
+    """
+    lines = payload.get("items")
+    if not isinstance(lines, list) or not lines:
+        raise HTTPException(status_code=400, detail="Danh sách sản phẩm đặt hàng trống")
+    if not all(isinstance(line, dict) for line in lines):
+        raise HTTPException(status_code=400, detail="Danh sách sản phẩm đặt hàng không hợp lệ")
+    
+    created = _create_purchase_order(db, lines)
+    order = created["order"]
+    
+    return {
+        "success": True,
+        "order_code": order.ma_don_hang,
+        "order_id": order.id,
+        "item_count": len(created["quantities"]),
+        "total_quantity": order.so_luong,
+        "tong_tien": order.tong_tien,
+        "message": f"Đã tạo đơn đặt hàng {order.ma_don_hang} gồm {len(created['quantities'])} sản phẩm"
+    }
+
+
+@router.post("/reorder-snapshot/refresh")
+def refresh_snapshot(db: Session = Depends(get_db)):
+    """Làm mới ngay snapshot đề xuất đặt hàng / tồn kho thấp (không chờ job định kỳ)"""
+    try:
+        info = refresh_reorder_snapshot(db)
+        db.commit()
+        bump_snapshot_version()
+    except Exception as e:
+        db.rollback()
+        log_error("CHATBOT_SNAPSHOT", f"Error refreshing reorder snapshot: {str(e)}", error=e)
+        raise HTTPException(status_code=500, detail=f"Lỗi khi làm mới dữ liệu đề xuất: {str(e)}")
+    
+    log_success("CHATBOT_SNAPSHOT", f"Refreshed reorder snapshot: {info['products']} products")
+    return {
+        "success": True,
+        "products": info["products"],
+        "candidates": info["candidates"],
+        "low_stock": info["low_stock"],
+        **snapshot_age(info["refreshed_at"]),
+    }
 
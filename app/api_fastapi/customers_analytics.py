@@ -1,21 +1,123 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func
 from sqlalchemy.orm import Session
+from typing import Optional
 from ..database import get_db
-from ..services.customers import calc_customer_tier, customer_aggregates, customer_leaderboard, customer_debts_from_invoices
+from ..models import CustomerSegment
+from ..services.customers import calc_customer_tier, customer_aggregates, TIER_LABELS, customer_leaderboard, customer_debts_from_invoices, link_customer_accounts
+from ..services.segmentation import refresh_customer_segments, SEGMENT_NAMES
+from ..services.report_cache import cached_report, bump_data_version
+from ..logger import log_success, log_error
 
 router = APIRouter(prefix="/customers-analytics", tags=["customers-analytics"])
 
 @router.get("/aggregates")
-def api_customer_aggregates(db: Session = Depends(get_db)):
-    return customer_aggregates(db)
+def api_customer_aggregates(
+    from_date: str = Query(None, description="Từ ngày đơn hàng (YYYY-MM-DD)"),
+    to_date: str = Query(None, description="Đến ngày đơn hàng (YYYY-MM-DD)"),
+    tier: Optional[int] = Query(None, ge=1, le=len(TIER_LABELS), description="Chỉ lấy khách hàng thuộc hạng này (1-5)"),
+    sort_by: str = Query('amount', description="Sắp xếp theo: amount, debt, order_count, quantity"),
+    order: str = Query('desc', description="Chiều sắp xếp: asc hoặc desc"),
+    skip: int = Query(0, ge=0, description="Bỏ qua N khách hàng đầu (phân trang)"),
+    limit: int = Query(50, ge=1, le=1000, description="Số khách hàng tối đa mỗi trang"),
+    top: Optional[int] = Query(None, ge=1, le=1000, description="Chỉ lấy N khách hàng đứng đầu theo sort_by"),
+    db: Session = Depends(get_db)
+):
+    """Tổng hợp theo khách hàng (số đơn, số lượng, tổng tiền, công nợ, hạng), phân trang trong database."""
+    params = dict(from_date=from_date, to_date=to_date, tier=tier, sort_by=sort_by, order=order, skip=skip, limit=limit, top=top)
+    return cached_report("customers.aggregates", params, lambda: customer_aggregates(db, **params))
 
 @router.get("/leaderboard")
 def api_customer_leaderboard(limit: int = 100, db: Session = Depends(get_db)):
-    return customer_leaderboard(db, limit=limit)
+    return cached_report("customers.leaderboard", {"limit": limit}, lambda: customer_leaderboard(db, limit=limit))
 
 @router.get("/debts")
 def api_customer_debts(db: Session = Depends(get_db)):
     """Lấy danh sách công nợ từ các hóa đơn chưa thanh toán, kèm thông tin khách hàng và hạn mức thành viên."""
-    return customer_debts_from_invoices(db)
+    return cached_report("customers.debts", {}, lambda: customer_debts_from_invoices(db))
 
+@router.post("/link-accounts")
+def api_link_customer_accounts(db: Session = Depends(get_db)):
+    """Gắn account_id cho đơn hàng / hóa đơn chưa có, theo tên hoặc mã khách hàng (đúng, chuẩn hóa).
 
+    Tên chỉ gần giống một tài khoản không được gắn tự động mà trả về trong "suggestions" để xác nhận.
+    """
+    result = link_customer_accounts(db, suggest=True)
+    db.commit()
+    log_success("CUSTOMER_LINK", f"Đã gắn tài khoản: {result['orders']['linked_rows']} đơn hàng, {result['invoices']['linked_rows']} hóa đơn")
+    bump_data_version()
+    return result
+
+@router.get("/segments")
+def api_customer_segments(
+    segment: Optional[str] = Query(None, description="Chỉ lấy khách hàng thuộc phân khúc này (vd. champions, at_risk)"),
+    skip: int = Query(0, ge=0, description="Bỏ qua N khách hàng đầu (phân trang)"),
+    limit: int = Query(100, ge=1, le=1000, description="Số khách hàng tối đa mỗi trang"),
+    db: Session = Depends(get_db)
+):
+    """Phân khúc RFM (tính bởi job phân khúc): tổng theo phân khúc và danh sách khách hàng, tổng tiền giảm dần."""
+    if segment is not None and segment not in SEGMENT_NAMES:
+        raise HTTPException(status_code=400, detail=f"Phân khúc không hợp lệ: {segment}")
+    
+    summary_rows = db.query(
+        CustomerSegment.segment,
+        func.count(CustomerSegment.id).label('customers'),
+        func.coalesce(func.sum(CustomerSegment.monetary), 0.0).label('monetary'),
+        func.avg(CustomerSegment.recency_days).label('avg_recency'),
+        func.avg(CustomerSegment.frequency).label('avg_frequency'),
+        func.max(CustomerSegment.computed_at).label('computed_at'),
+    ).group_by(CustomerSegment.segment).all()
+    summary = {row.segment: row for row in summary_rows}
+    
+    query = db.query(CustomerSegment)
+    if segment:
+        query = query.filter(CustomerSegment.segment == segment)
+        total = summary[segment].customers if segment in summary else 0
+    else:
+        total = sum(row.customers for row in summary_rows)
+    rows = query.order_by(CustomerSegment.monetary.desc(), CustomerSegment.id).offset(skip).limit(limit).all()
+    computed_at = max((row.computed_at for row in summary_rows), default=None)
+    
+    def segment_summary(code: str, name: str) -> dict:
+        row = summary.get(code)
+        return {
+            "segment": code,
+            "name": name,
+            "customers": int(row.customers) if row else 0,
+            "monetary": round(float(row.monetary), 2) if row else 0.0,
+            "avg_recency_days": round(float(row.avg_recency or 0), 1) if row else 0.0,
+            "avg_frequency": round(float(row.avg_frequency or 0), 2) if row else 0.0,
+        }
+    
+    return {
+        "computed_at": computed_at.isoformat() if computed_at else None,
+        "segments": [segment_summary(code, name) for code, name in SEGMENT_NAMES.items()],
+        "total": total,
+        "items": [
+            {
+                "customerName": r.nguoi_mua,
+                "customerId": r.account_id,
+                "lastPurchase": r.last_purchase.isoformat() if r.last_purchase else None,
+                "recencyDays": r.recency_days,
+                "frequency": r.frequency,
+                "monetary": r.monetary,
+                "rfmScore": r.rfm_score,
+                "segment": r.segment,
+                "segmentName": SEGMENT_NAMES.get(r.segment, r.segment),
+            }
+            for r in rows
+        ],
+    }
+
+@router.post("/segments/refresh")
+def api_refresh_customer_segments(db: Session = Depends(get_db)):
+    """Tính lại ngay phân khúc RFM cho toàn bộ khách hàng (không chờ job định kỳ)."""
+    try:
+        info = refresh_customer_segments(db)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        log_error("CUSTOMER_SEGMENTS", "Lỗi khi phân khúc khách hàng", error=e)
+        raise HTTPException(status_code=500, detail=f"Lỗi khi phân khúc khách hàng: {str(e)}")
+    log_success("CUSTOMER_SEGMENTS", f"Đã phân khúc {info['customers']} khách hàng")
+    return {**info, "computed_at": info["computed_at"].isoformat()}
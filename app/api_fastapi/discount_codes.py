@@ -35,16 +35,7 @@ def get_discount_codes(
     if discount_type:
         query = query.filter(DiscountCode.discount_type == discount_type)
     
-    # Update status based on dates
-    now = datetime.now()
-    expired_codes = query.filter(DiscountCode.end_date < now).all()
-    for code in expired_codes:
-        if code.status == 'active':
-            code.status = 'expired'
-            log_info("DISCOUNT_CODES", f"Auto-expired code: {code.code}")
-    
-    db.commit()
-    
+    # Chỉ đọc: trạng thái theo ngày do job discount_status cập nhật định kỳ
     codes = query.offset(skip).limit(limit).all()
     log_success("DISCOUNT_CODES", f"Retrieved {len(codes)} discount codes")
     
@@ -0,0 +1,200 @@
+"""
+Xuất dữ liệu dạng stream (CSV/XLSX) cho hóa đơn, doanh thu và công nợ
+
+Dữ liệu được đọc bằng server-side cursor (yield_per) và gửi dần từng khối qua
+StreamingResponse, nên bộ nhớ không tăng theo số dòng xuất ra.
+"""
+import csv
+import io
+import tempfile
+from datetime import datetime, date
+from typing import Iterable, Iterator, Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func, cast, Numeric, true, false
+from ..database import SessionLocal
+from ..models import Invoice, InvoiceItem, DailySales
+from ..logger import log_info, log_error, log_success
+from ..config import Config
+from .reports import debt_aging_label, OVERDUE_DAYS
+
+router = APIRouter(prefix="/exports", tags=["exports"])
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+XLSX_READ_CHUNK = 64 * 1024
+
+
+def _parse_date(value: Optional[str], field: str) -> Optional[date]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{field} không hợp lệ, định dạng YYYY-MM-DD")
+
+
+def _check_format(fmt: str):
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Định dạng không hỗ trợ: {fmt} (csv hoặc xlsx)")
+    if fmt == 'xlsx':
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Xuất XLSX cần cài thư viện openpyxl")
+
+
+def _iter_rows(stmt) -> Iterator[tuple]:
+    """Đọc kết quả theo từng khối bằng server-side cursor.
+
+    Dùng session riêng vì generator chạy sau khi endpoint đã trả về (session của get_db đã đóng).
+    """
+    db = SessionLocal()
+    try:
+        for row in db.execute(stmt.execution_options(yield_per=Config.EXPORT_CHUNK_ROWS)):
+            yield tuple(row)
+    finally:
+        db.close()
+
+
+def _csv_chunks(header: list[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')  # BOM để Excel đọc đúng tiếng Việt
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % Config.EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _xlsx_chunks(header: list[str], rows: Iterable[tuple], sheet_name: str) -> Iterator[bytes]:
+    """Ghi workbook chế độ write_only (các dòng được ghi thẳng ra file tạm) rồi gửi file theo khối."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as f:
+        wb.save(f)
+        f.seek(0)
+        while True:
+            chunk = f.read(XLSX_READ_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _export_response(name: str, fmt: str, header: list[str], rows: Iterable[tuple]) -> StreamingResponse:
+    def body():
+        try:
+            if fmt == 'xlsx':
+                yield from _xlsx_chunks(header, rows, name)
+            else:
+                yield from _csv_chunks(header, rows)
+            log_success("EXPORT", f"Đã xuất {name}.{fmt}")
+        except Exception as e:
+            log_error("EXPORT", f"Lỗi khi xuất {name}.{fmt}", error=e)
+            raise
+
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return StreamingResponse(
+        body(),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/invoices")
+def export_invoices(
+    format: str = Query('csv', description="Định dạng: csv hoặc xlsx"),
+    from_date: str = Query(None, description="Từ ngày (YYYY-MM-DD)"),
+    to_date: str = Query(None, description="Đến ngày (YYYY-MM-DD)"),
+    da_thanh_toan: Optional[bool] = Query(None, description="Chỉ lấy hóa đơn đã/chưa thanh toán"),
+):
+    """Xuất hóa đơn kèm chi tiết sản phẩm (mỗi dòng sản phẩm một dòng; hóa đơn không có sản phẩm một dòng)"""
+    _check_format(format)
+    start, end = _parse_date(from_date, 'from_date'), _parse_date(to_date, 'to_date')
+    log_info("EXPORT", f"Xuất hóa đơn {format}: {from_date or '...'} → {to_date or '...'}")
+
+    stmt = select(
+        Invoice.so_hd, Invoice.ngay_hd, Invoice.nguoi_mua, Invoice.trang_thai, Invoice.hinh_thuc_tt,
+        Invoice.tong_tien, InvoiceItem.product_code, InvoiceItem.product_name,
+        InvoiceItem.so_luong, InvoiceItem.don_gia, InvoiceItem.total_price,
+    ).outerjoin(InvoiceItem, InvoiceItem.invoice_id == Invoice.id)
+    if start:
+        stmt = stmt.where(Invoice.ngay_hd >= start)
+    if end:
+        stmt = stmt.where(Invoice.ngay_hd <= end)
+    if da_thanh_toan is not None:
+        stmt = stmt.where(Invoice.da_thanh_toan == (true() if da_thanh_toan else false()))
+    stmt = stmt.order_by(Invoice.ngay_hd, Invoice.id, InvoiceItem.id)
+
+    header = ['Số HĐ', 'Ngày HĐ', 'Người mua', 'Trạng thái', 'Hình thức TT', 'Tổng tiền HĐ',
+              'Mã SP', 'Tên SP', 'Số lượng', 'Đơn giá', 'Thành tiền']
+    return _export_response('hoa_don', format, header, _iter_rows(stmt))
+
+
+@router.get("/revenue")
+def export_revenue(
+    format: str = Query('csv', description="Định dạng: csv hoặc xlsx"),
+    from_date: str = Query(None, description="Từ ngày (YYYY-MM-DD)"),
+    to_date: str = Query(None, description="Đến ngày (YYYY-MM-DD)"),
+):
+    """Xuất doanh thu theo sản phẩm (hóa đơn đã thanh toán), cùng cách tính với /reports/revenue"""
+    _check_format(format)
+    start, end = _parse_date(from_date, 'from_date'), _parse_date(to_date, 'to_date')
+    log_info("EXPORT", f"Xuất doanh thu {format}: {from_date or '...'} → {to_date or '...'}")
+
+    doanh_thu = func.coalesce(func.sum(DailySales.doanh_thu), 0.0)
+    stmt = select(
+        DailySales.ma_sp,
+        func.max(DailySales.ten_sp),
+        func.coalesce(func.sum(DailySales.so_luong), 0),
+        func.coalesce(func.max(DailySales.don_gia), 0.0),
+        doanh_thu,
+        cast(func.coalesce(100.0 * doanh_thu / func.nullif(func.sum(doanh_thu).over(), 0), 0.0), Numeric(7, 2)),
+    )
+    if start:
+        stmt = stmt.where(DailySales.ngay >= start)
+    if end:
+        stmt = stmt.where(DailySales.ngay <= end)
+    stmt = stmt.group_by(DailySales.ma_sp).order_by(doanh_thu.desc(), DailySales.ma_sp)
+
+    header = ['Mã SP', 'Tên SP', 'Số lượng bán', 'Giá bán', 'Doanh thu', 'Tỷ lệ (%)']
+    return _export_response('doanh_thu', format, header, _iter_rows(stmt))
+
+
+@router.get("/debt")
+def export_debt(
+    format: str = Query('csv', description="Định dạng: csv hoặc xlsx"),
+    khach_hang: Optional[str] = Query(None, description="Chỉ lấy hóa đơn của khách hàng này"),
+):
+    """Xuất danh sách hóa đơn chưa thanh toán kèm tuổi nợ, nợ lâu nhất trước"""
+    _check_format(format)
+    log_info("EXPORT", f"Xuất công nợ {format}: {khach_hang or 'tất cả khách hàng'}")
+
+    stmt = select(Invoice.nguoi_mua, Invoice.so_hd, Invoice.ngay_hd, Invoice.tong_tien).where(
+        Invoice.da_thanh_toan == false()
+    )
+    if khach_hang:
+        stmt = stmt.where(Invoice.nguoi_mua == khach_hang)
+    stmt = stmt.order_by(Invoice.ngay_hd, Invoice.id)
+
+    today = date.today()
+
+    def rows():
+        for nguoi_mua, so_hd, ngay_hd, tong_tien in _iter_rows(stmt):
+            days = (today - ngay_hd).days if ngay_hd else 0
+            yield (nguoi_mua, so_hd, ngay_hd, tong_tien, days, debt_aging_label(days),
+                   'Quá hạn' if days > OVERDUE_DAYS else 'Trong hạn')
+
+    header = ['Khách hàng', 'Số HĐ', 'Ngày HĐ', 'Số tiền nợ', 'Số ngày nợ', 'Nhóm tuổi nợ', 'Tình trạng']
+    return _export_response('cong_no', format, header, rows())
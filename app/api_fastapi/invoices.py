@@ -1,13 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from ..database import get_db
-from ..models import Invoice, InvoiceItem, Product, Warehouse
+from ..models import Invoice, InvoiceItem
 from ..schemas_fastapi import InvoiceOut, InvoiceCreate, InvoiceUpdate, InvoiceItemOut
 from ..logger import log_info, log_success, log_error, log_warning
-from ..services.invoices import update_debt_for_customer
+from ..services.invoices import (
+    apply_customer_balance, apply_daily_sales, invoice_sales_lines,
+    is_paid_status, allocate_invoice_numbers, peek_next_invoice_number, format_invoice_number,
+    reserve_invoice_number,
+)
+from ..services.inventory import sum_quantities, decrement_stock
 from ..services.general_diary import create_general_diary_entry
 from ..services.auth_helper import get_username_from_request
-from datetime import datetime
+from ..services.report_cache import bump_data_version
+from ..services.customers import customer_account_id, apply_account_tier
+from datetime import datetime, date
 
 
 router = APIRouter(prefix="/invoices", tags=["invoices"])
@@ -21,27 +29,40 @@ def list_invoices(db: Session = Depends(get_db)):
 
 @router.post("/")
 def create_invoice(payload: InvoiceCreate, db: Session = Depends(get_db)):
-    """Tạo hóa đơn mới"""
-    log_info("CREATE_INVOICE", f"Tạo hóa đơn mới: {payload.so_hd} - Khách hàng: {payload.nguoi_mua} - Tổng tiền: {payload.tong_tien:,.0f} VND")
+    """Tạo hóa đơn mới
+
+    Không gửi so_hd thì cấp số tiếp theo theo ngày hóa đơn (ngay_hd) trong cùng transaction.
+    so_hd gửi kèm dạng HĐ-ddmmyy-XXX sẽ đẩy bộ đếm của ngày đó lên, để số tự cấp sau không bị trùng;
+    so_hd đã tồn tại trả về 409.
+    """
+    log_info("CREATE_INVOICE", f"Tạo hóa đơn mới: {payload.so_hd or '(tự cấp số)'} - Khách hàng: {payload.nguoi_mua} - Tổng tiền: {payload.tong_tien:,.0f} VND")
     
+    so_hd = payload.so_hd
     try:
+        if so_hd:
+            reserve_invoice_number(db, so_hd)
+        else:
+            number, _ = allocate_invoice_numbers(db, 1, payload.ngay_hd)
+            so_hd = format_invoice_number(payload.ngay_hd, number)
+        
         # Tạo hóa đơn mới
         inv = Invoice(
-            so_hd=payload.so_hd,
+            so_hd=so_hd,
             ngay_hd=payload.ngay_hd,
             nguoi_mua=payload.nguoi_mua,
             tong_tien=payload.tong_tien,
             trang_thai=payload.trang_thai,
+            da_thanh_toan=is_paid_status(payload.trang_thai),
             hinh_thuc_tt=payload.hinh_thuc_tt,
+            account_id=customer_account_id(db, payload.account_id, payload.nguoi_mua),
         )
         db.add(inv)
         db.flush()  # Flush để lấy ID
         
         # Xử lý các items và cập nhật số lượng sản phẩm
         if payload.items:
-            for item_data in payload.items:
-                # Tạo invoice item
-                invoice_item = InvoiceItem(
+            db.add_all([
+                InvoiceItem(
                     invoice_id=inv.id,
                     product_id=item_data.product_id,
                     product_code=item_data.product_code,
@@ -50,32 +71,24 @@ def create_invoice(payload: InvoiceCreate, db: Session = Depends(get_db)):
                     don_gia=item_data.don_gia,
                     total_price=item_data.total_price
                 )
-                db.add(invoice_item)
-                
-                # Cập nhật số lượng sản phẩm trong bảng products
-                product = db.query(Product).filter(Product.id == item_data.product_id).first()
-                if product:
-                    current_qty = product.so_luong or 0
-                    new_qty = max(0, current_qty - item_data.so_luong)
-                    product.so_luong = new_qty
-                    product.trang_thai = 'Còn hàng' if new_qty > 0 else 'Hết hàng'
-                    log_info("UPDATE_STOCK", f"Đã cập nhật số lượng sản phẩm {item_data.product_code}: {current_qty} -> {new_qty}")
-                
-                # Cập nhật số lượng trong warehouse (nếu có)
-                warehouse = db.query(Warehouse).filter(Warehouse.ma_sp == item_data.product_code).first()
-                if warehouse:
-                    current_wh_qty = warehouse.so_luong or 0
-                    new_wh_qty = max(0, current_wh_qty - item_data.so_luong)
-                    warehouse.so_luong = new_wh_qty
-                    warehouse.trang_thai = 'Còn hàng' if new_wh_qty > 0 else 'Hết hàng'
-                    log_info("UPDATE_WAREHOUSE_STOCK", f"Đã cập nhật số lượng kho {warehouse.ma_kho} - SP {item_data.product_code}: {current_wh_qty} -> {new_wh_qty}")
+                for item_data in payload.items
+            ])
+
+            # Trừ kho nguyên tử theo mã sản phẩm; báo lỗi nếu không đủ hàng
+            qty_by_code = sum_quantities((i.product_code, i.so_luong) for i in payload.items)
+            new_stock = decrement_stock(db, qty_by_code)
+            for code, new_qty in new_stock.items():
+                log_info("UPDATE_STOCK", f"Đã trừ {qty_by_code[code]} sản phẩm {code}, tồn kho còn: {new_qty}")
+        
+        # Cập nhật công nợ, daily_sales và hạng khách hàng theo chênh lệch, cùng transaction với hóa đơn
+        lines = [(i.product_code, i.product_name, i.so_luong, i.total_price, i.don_gia) for i in (payload.items or [])]
+        apply_customer_balance(db, inv.nguoi_mua, inv.tong_tien, inv.da_thanh_toan, paid_on=inv.ngay_hd)
+        apply_daily_sales(db, inv, lines=lines)
+        apply_account_tier(db, inv, lines=lines)
         
         db.commit()
         db.refresh(inv)
         
-        # Cập nhật bảng công nợ
-        update_debt_for_customer(payload.nguoi_mua, db)
-        
         # Tính tổng số lượng xuất từ các items
         total_quantity_out = sum(item.so_luong for item in payload.items) if payload.items else 0
         
@@ -84,7 +97,7 @@ def create_invoice(payload: InvoiceCreate, db: Session = Depends(get_db)):
         
         # Tự động ghi vào General Diary
         try:
-            description = f"{'Bán hàng' if source == 'Pos' else 'Hóa đơn'} {payload.so_hd} - Khách hàng: {payload.nguoi_mua} - Xuất {total_quantity_out} sản phẩm"
+            description = f"{'Bán hàng' if source == 'Pos' else 'Hóa đơn'} {so_hd} - Khách hàng: {payload.nguoi_mua} - Xuất {total_quantity_out} sản phẩm"
             create_general_diary_entry(
                 db=db,
                 source=source,
@@ -99,8 +112,19 @@ def create_invoice(payload: InvoiceCreate, db: Session = Depends(get_db)):
             log_error("CREATE_INVOICE_DIARY", f"Lỗi khi ghi vào General Diary: {str(diary_error)}", error=diary_error)
             # Không rollback vì invoice đã được tạo thành công
         
-        log_success("CREATE_INVOICE", f"Tạo hóa đơn thành công: {payload.so_hd} (ID: {inv.id})")
-        return {"success": True, "id": inv.id}
+        log_success("CREATE_INVOICE", f"Tạo hóa đơn thành công: {so_hd} (ID: {inv.id})")
+        bump_data_version()
+        return {"success": True, "id": inv.id, "so_hd": so_hd}
+    except HTTPException:
+        db.rollback()
+        raise
+    except IntegrityError as e:
+        db.rollback()
+        if so_hd and db.query(Invoice.id).filter(Invoice.so_hd == so_hd).first():
+            log_warning("CREATE_INVOICE", f"Số hóa đơn đã tồn tại: {so_hd}")
+            raise HTTPException(status_code=409, detail=f"Số hóa đơn {so_hd} đã tồn tại")
+        log_error("CREATE_INVOICE", f"Lỗi khi tạo hóa đơn {so_hd}", error=e)
+        raise HTTPException(status_code=500, detail=f"Lỗi tạo hóa đơn: {str(e)}")
     except Exception as e:
         log_error("CREATE_INVOICE", f"Lỗi khi tạo hóa đơn {payload.so_hd}", error=e)
         db.rollback()
@@ -117,17 +141,33 @@ def update_invoice(invoice_id: int, payload: InvoiceUpdate, request: Request, db
         # Lấy username từ token
         username = get_username_from_request(request)
         
-        # Lưu tên khách hàng cũ để cập nhật công nợ
-        old_customer_name = inv.nguoi_mua
+        # Gỡ đóng góp cũ của hóa đơn khỏi công nợ, daily_sales và hạng khách hàng trước khi cập nhật
+        was_paid = bool(inv.da_thanh_toan)
+        apply_customer_balance(db, inv.nguoi_mua, inv.tong_tien, was_paid, sign=-1, invoice_id=inv.id)
+        lines = invoice_sales_lines(db, inv.id)
+        apply_daily_sales(db, inv, sign=-1, lines=lines)
+        apply_account_tier(db, inv, sign=-1, lines=lines)
         
         # Cập nhật hóa đơn
-        if payload.so_hd is not None: setattr(inv, 'so_hd', payload.so_hd)
+        if payload.so_hd is not None:
+            setattr(inv, 'so_hd', payload.so_hd)
+            reserve_invoice_number(db, payload.so_hd)
         if payload.ngay_hd is not None: setattr(inv, 'ngay_hd', payload.ngay_hd)
         if payload.nguoi_mua is not None: setattr(inv, 'nguoi_mua', payload.nguoi_mua)
+        if payload.account_id is not None or payload.nguoi_mua is not None:
+            setattr(inv, 'account_id', customer_account_id(db, payload.account_id, inv.nguoi_mua))
         if payload.tong_tien is not None: setattr(inv, 'tong_tien', payload.tong_tien)
-        if payload.trang_thai is not None: setattr(inv, 'trang_thai', payload.trang_thai)
+        if payload.trang_thai is not None:
+            setattr(inv, 'trang_thai', payload.trang_thai)
+            setattr(inv, 'da_thanh_toan', is_paid_status(payload.trang_thai))
         if payload.hinh_thuc_tt is not None: setattr(inv, 'hinh_thuc_tt', payload.hinh_thuc_tt)
         
+        # Cộng đóng góp mới; nếu hóa đơn vừa chuyển sang đã thanh toán thì ngày thanh toán là hôm nay
+        paid_on = inv.ngay_hd if was_paid else date.today()
+        apply_customer_balance(db, inv.nguoi_mua, inv.tong_tien, inv.da_thanh_toan, paid_on=paid_on)
+        apply_daily_sales(db, inv, lines=lines)
+        apply_account_tier(db, inv, lines=lines)
+        
         db.flush()  # Flush để đảm bảo update được thực hiện
         
         # Ghi vào general_diary
@@ -147,16 +187,16 @@ def update_invoice(invoice_id: int, payload: InvoiceUpdate, request: Request, db
             log_error("UPDATE_INVOICE_DIARY", f"Lỗi khi ghi vào General Diary: {str(diary_error)}", error=diary_error)
             db.commit()  # Vẫn commit việc update hóa đơn
         
-        # Cập nhật công nợ cho khách hàng cũ (nếu có thay đổi)
-        if old_customer_name:
-            update_debt_for_customer(old_customer_name, db)
-        
-        # Cập nhật công nợ cho khách hàng mới
-        new_customer_name = payload.nguoi_mua if payload.nguoi_mua is not None else old_customer_name
-        if new_customer_name and new_customer_name != old_customer_name:
-            update_debt_for_customer(new_customer_name, db)
-        
+        bump_data_version()
         return {"success": True}
+    except HTTPException:
+        db.rollback()
+        raise
+    except IntegrityError as e:
+        db.rollback()
+        if payload.so_hd and db.query(Invoice.id).filter(Invoice.so_hd == payload.so_hd, Invoice.id != invoice_id).first():
+            raise HTTPException(status_code=409, detail=f"Số hóa đơn {payload.so_hd} đã tồn tại")
+        raise HTTPException(status_code=500, detail=f"Lỗi cập nhật hóa đơn: {str(e)}")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Lỗi cập nhật hóa đơn: {str(e)}")
@@ -205,7 +245,8 @@ def get_invoice_details(invoice_id: int, db: Session = Depends(get_db)):
                 "ngay_hd": ngay_hd,
                 "nguoi_mua": inv.nguoi_mua,
                 "tong_tien": float(inv.tong_tien) if inv.tong_tien else 0.0,
-                "trang_thai": inv.trang_thai
+                "trang_thai": inv.trang_thai,
+                "da_thanh_toan": bool(inv.da_thanh_toan)
             },
             "items": [
                 {
@@ -242,7 +283,12 @@ def delete_invoice(invoice_id: int, request: Request, db: Session = Depends(get_
         
         # Lưu thông tin hóa đơn trước khi xóa
         invoice_info = f"{inv.so_hd} - Khách hàng: {inv.nguoi_mua}"
-        customer_name = inv.nguoi_mua
+        
+        # Gỡ đóng góp của hóa đơn khỏi công nợ khách hàng, daily_sales và hạng khách hàng
+        apply_customer_balance(db, inv.nguoi_mua, inv.tong_tien, inv.da_thanh_toan, sign=-1, invoice_id=inv.id)
+        lines = invoice_sales_lines(db, inv.id) if inv.da_thanh_toan else []
+        apply_daily_sales(db, inv, sign=-1, lines=lines)
+        apply_account_tier(db, inv, sign=-1, lines=lines)
         
         # Xóa hóa đơn
         db.delete(inv)
@@ -265,10 +311,7 @@ def delete_invoice(invoice_id: int, request: Request, db: Session = Depends(get_
             log_error("DELETE_INVOICE_DIARY", f"Lỗi khi ghi vào General Diary: {str(diary_error)}", error=diary_error)
             db.commit()  # Vẫn commit việc xóa hóa đơn
         
-        # Cập nhật công nợ cho khách hàng
-        if customer_name:
-            update_debt_for_customer(customer_name, db)
-        
+        bump_data_version()
         return {"success": True}
     except Exception as e:
         db.rollback()
@@ -276,52 +319,48 @@ def delete_invoice(invoice_id: int, request: Request, db: Session = Depends(get_
 
 
 @router.get("/next-number")
-def next_invoice_number(db: Session = Depends(get_db)):
-    """Tạo số thứ tự hóa đơn tiếp theo theo format: HĐ-ddmmyy-XXX (001-999)"""
-    from datetime import date
-    
-    today = date.today()
-    date_str = today.strftime("%d%m%y")  # Format: ddmmyy (ví dụ: 061125)
-    
-    # Tìm tất cả hóa đơn có mã bắt đầu bằng HĐ-{date_str}-
-    pattern = f"HĐ-{date_str}-"
-    
-    # Lấy tất cả hóa đơn có mã chứa pattern này
-    invoices_today = db.query(Invoice).filter(Invoice.so_hd.like(f"{pattern}%")).all()
-    
-    if not invoices_today:
-        # Nếu chưa có hóa đơn nào trong ngày, bắt đầu từ 001
-        return {
-            "next_number": 1,
-            "date_str": date_str,
-            "full_invoice_number": f"HĐ-{date_str}-001"
-        }
-    
-    # Tìm số thứ tự cao nhất trong ngày
-    max_number = 0
-    for inv in invoices_today:
-        so_hd_value = getattr(inv, "so_hd", None)
-        if so_hd_value and so_hd_value.startswith(pattern):
-            try:
-                # Extract số thứ tự từ cuối mã (sau dấu -)
-                number_part = so_hd_value.replace(pattern, "")
-                if number_part.isdigit():
-                    num = int(number_part)
-                    if num > max_number:
-                        max_number = num
-            except (ValueError, AttributeError):
-                continue
-    
-    # Tăng lên 1, giới hạn tối đa 999
-    next_number = min(max_number + 1, 999)
-    
-    # Format số thứ tự với 3 chữ số (001, 002, ..., 999)
-    next_number_str = f"{next_number:03d}"
+def next_invoice_number(
+    ngay: date | None = Query(None, description="Ngày hóa đơn (YYYY-MM-DD), mặc định hôm nay"),
+    db: Session = Depends(get_db)
+):
+    """Xem trước số hóa đơn tiếp theo theo format: HĐ-ddmmyy-XXX (bộ đếm theo ngày hóa đơn, không giới hạn 999)
+
+    Chỉ đọc, không giữ chỗ: hai máy xem trước cùng lúc nhận cùng một số, máy gửi sau sẽ nhận 409.
+    Để được cấp số chắc chắn, tạo hóa đơn không gửi so_hd hoặc dùng POST /number-block.
+    """
+    day = ngay or date.today()
+    next_number = peek_next_invoice_number(db, day)
     
     return {
         "next_number": next_number,
-        "date_str": date_str,
-        "full_invoice_number": f"HĐ-{date_str}-{next_number_str}"
+        "date_str": day.strftime("%d%m%y"),
+        "full_invoice_number": format_invoice_number(day, next_number)
+    }
+
+
+@router.post("/number-block")
+def reserve_invoice_number_block(
+    count: int = Query(50, ge=1, le=1000, description="Số lượng số hóa đơn cần cấp"),
+    terminal: str | None = Query(None, description="Mã máy POS nhận block (để ghi log)"),
+    ngay: date | None = Query(None, description="Ngày hóa đơn (YYYY-MM-DD), mặc định hôm nay"),
+    db: Session = Depends(get_db)
+):
+    """Cấp trước một dải số hóa đơn liên tiếp của một ngày hóa đơn cho máy POS dùng khi offline"""
+    day = ngay or date.today()
+    try:
+        first, last = allocate_invoice_numbers(db, count, day)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        log_error("INVOICE_NUMBER_BLOCK", "Lỗi khi cấp dải số hóa đơn", error=e)
+        raise HTTPException(status_code=500, detail=f"Lỗi khi cấp dải số hóa đơn: {str(e)}")
+    
+    log_info("INVOICE_NUMBER_BLOCK", f"Đã cấp số {first}-{last} ngày {day.isoformat()} cho máy {terminal or 'N/A'}")
+    return {
+        "date_str": day.strftime("%d%m%y"),
+        "first_number": first,
+        "last_number": last,
+        "numbers": [format_invoice_number(day, n) for n in range(first, last + 1)]
     }
 
 
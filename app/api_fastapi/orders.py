@@ -1,19 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 from ..database import get_db
-from ..models import Order, OrderItem, Product, Account, Warehouse
-from sqlalchemy import or_
+from ..models import Order, OrderItem, Product
+from sqlalchemy import or_, case, func
 from ..schemas_fastapi import OrderOut, OrderCreate, OrderUpdate
 from ..logger import log_info, log_success, log_error, log_warning
 from fastapi import Body
-from ..services.orders import create_order_service
+from ..services.orders import create_order_service, normalize_order_status, ORDER_STATUS_COMPLETED, ORDER_STATUS_CANCELLED
+from ..services.inventory import decrement_stock, increment_stock, adjust_stock
 from ..services.general_diary import create_general_diary_entry
 from ..services.auth_helper import get_username_from_request
+from ..services.report_cache import bump_data_version
+from ..services.customers import customer_account_id
 
 
-def is_cancelled(status: str | None) -> bool:
-    s = (status or '').strip().lower()
-    return s in ('đã hủy', 'da huy', 'hủy', 'huy', 'canceled', 'cancelled')
+def is_cancelled(status_code: str | None) -> bool:
+    return status_code == ORDER_STATUS_CANCELLED
 
 
 router = APIRouter(prefix="/orders", tags=["orders"])
@@ -35,10 +37,32 @@ def list_orders(db: Session = Depends(get_db)):
 
 
 @router.get("/search")
-def search_orders(customer_id: int | None = None, customer_name: str | None = None, q: str | None = None, db: Session = Depends(get_db)):
-    query = db.query(Order)
+def search_orders(
+    customer_id: int | None = None,
+    customer_name: str | None = None,
+    q: str | None = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    # Phân loại sp_banggia bằng một outer join với products thay vì một query cho mỗi đơn hàng
+    loai_suy_luan = case(
+        (func.coalesce(Order.sp_banggia, '') == '', 'Khác'),
+        (Product.id.isnot(None), 'Sản phẩm'),
+        else_='Hành động (Bảng giá)',
+    ).label('loai_suy_luan')
+    query = db.query(
+        Order.id,
+        Order.ma_don_hang,
+        Order.tong_tien,
+        Order.trang_thai,
+        Order.ma_trang_thai,
+        Order.sp_banggia,
+        loai_suy_luan,
+        func.count().over().label('total'),  # Tổng số đơn khớp bộ lọc (trước phân trang)
+    ).outerjoin(Product, Product.ma_sp == Order.sp_banggia)
     
-    log_info("SEARCH_ORDERS", f"Search params: customer_id={customer_id}, customer_name={customer_name}, q={q}")
+    log_info("SEARCH_ORDERS", f"Search params: customer_id={customer_id}, customer_name={customer_name}, q={q}, skip={skip}, limit={limit}")
     
     # Tìm theo customer_id hoặc customer_name
     customer_filters = []
@@ -50,25 +74,10 @@ def search_orders(customer_id: int | None = None, customer_name: str | None = No
             customer_filters.append(Order.thong_tin_kh.ilike(f"%{customer_name_clean}%"))
             log_info("SEARCH_ORDERS", f"Added customer_name filter: {customer_name_clean}")
     
-    # Nếu có customer_id, map id -> thông tin tài khoản và lọc theo thong_tin_kh
+    # Nếu có customer_id, lọc theo Order.account_id (có index, gán khi ghi đơn và bởi job gắn tài khoản)
     if customer_id is not None:
-        acc = None
-        try:
-            acc = db.query(Account).get(int(customer_id))
-        except Exception:
-            acc = None
-        if acc:
-            name = (acc.ten_tk or '').strip()
-            ma_kh = (acc.ma_khach_hang or '').strip()
-            log_info("SEARCH_ORDERS", f"Found account: id={acc.id}, ten_tk={name}, ma_khach_hang={ma_kh}")
-            if name:
-                customer_filters.append(Order.thong_tin_kh.ilike(f"%{name}%"))
-                log_info("SEARCH_ORDERS", f"Added account name filter: {name}")
-            if ma_kh:
-                customer_filters.append(Order.thong_tin_kh.ilike(f"%{ma_kh}%"))
-                log_info("SEARCH_ORDERS", f"Added account code filter: {ma_kh}")
-        else:
-            log_warning("SEARCH_ORDERS", f"Account not found for customer_id={customer_id}")
+        customer_filters.append(Order.account_id == customer_id)
+        log_info("SEARCH_ORDERS", f"Added account filter: account_id={customer_id}")
     
     # Áp dụng filter khách hàng (OR logic - tìm theo bất kỳ điều kiện nào khớp)
     if customer_filters:
@@ -82,36 +91,21 @@ def search_orders(customer_id: int | None = None, customer_name: str | None = No
         ql = f"%{q}%"
         query = query.filter((Order.ma_don_hang.ilike(ql)) | (Order.trang_thai.ilike(ql)))
     
-    # Chỉ trả về đơn hàng Hoàn thành (hỗ trợ nhiều format: hoan_thanh, Hoàn thành, HOÀN THÀNH)
-    # Trong database, trạng thái được lưu là 'hoan_thanh' (chữ thường, không dấu)
-    query = query.filter(
-        or_(
-            Order.trang_thai.ilike('%hoan_thanh%'),
-            Order.trang_thai.ilike('%Hoàn thành%'),
-            Order.trang_thai.ilike('%HOÀN THÀNH%'),
-            Order.trang_thai.ilike('%hoàn thành%'),
-            Order.trang_thai.ilike('%hoan thanh%')
-        )
-    )
+    # Chỉ trả về đơn hàng Hoàn thành (lọc theo mã trạng thái chuẩn đã đánh index)
+    query = query.filter(Order.ma_trang_thai == ORDER_STATUS_COMPLETED)
     
-    results = query.order_by(Order.id.desc()).all()
-    log_info("SEARCH_ORDERS", f"Found {len(results)} completed orders")
-    out = []
-    for o in results:
-        # xác định loại SP dựa trên sp_banggia và bảng products
-        loai = 'Khác'
-        if o.sp_banggia:
-            p = db.query(Product).filter(Product.ma_sp == o.sp_banggia).first()
-            loai = 'Sản phẩm' if p is not None else 'Hành động (Bảng giá)'
-        out.append({
-            'id': o.id,
-            'ma_don_hang': o.ma_don_hang,
-            'tong_tien': o.tong_tien,
-            'trang_thai': o.trang_thai,
-            'sp_banggia': o.sp_banggia,
-            'loai_suy_luan': loai,
-        })
-    return out
+    results = query.order_by(Order.id.desc()).offset(skip).limit(limit).all()
+    if results:
+        total = int(results[0].total)
+    else:
+        total = query.count() if skip else 0
+    log_info("SEARCH_ORDERS", f"Found {total} completed orders, returning {len(results)}")
+    items = []
+    for r in results:
+        item = dict(r._mapping)
+        item.pop('total')
+        items.append(item)
+    return {"total": total, "items": items}
 
 
 @router.get("/{order_id}", response_model=OrderOut)
@@ -159,29 +153,19 @@ def create_order(payload: OrderCreate, db: Session = Depends(get_db)):
             so_luong=payload.so_luong or 1,
             tong_tien=computed_total,
             trang_thai=payload.trang_thai or 'cho_xu_ly',
+            ma_trang_thai=normalize_order_status(payload.trang_thai or 'cho_xu_ly'),
+            account_id=customer_account_id(db, payload.account_id, payload.thong_tin_kh),
         )
         db.add(o)
-        db.commit()
-        db.refresh(o)
-        # Trừ kho nếu là sản phẩm
+        db.flush()
+        # Trừ kho nguyên tử nếu là sản phẩm (báo lỗi nếu không đủ hàng)
         quantity_out = 0
         if is_product and product and payload.so_luong:
-            current_qty = int(getattr(product, 'so_luong', 0) or 0)
             quantity_out = int(payload.so_luong or 0)
-            new_qty = max(current_qty - quantity_out, 0)
-            setattr(product, 'so_luong', new_qty)
-            setattr(product, 'trang_thai', 'Còn hàng' if new_qty > 0 else 'Hết hàng')
-            
-            # Cập nhật warehouse nếu có
-            warehouse = db.query(Warehouse).filter(Warehouse.ma_sp == payload.sp_banggia).first()
-            if warehouse:
-                current_wh_qty = warehouse.so_luong or 0
-                new_wh_qty = max(0, current_wh_qty - quantity_out)
-                warehouse.so_luong = new_wh_qty
-                warehouse.trang_thai = 'Còn hàng' if new_wh_qty > 0 else 'Hết hàng'
-            
-            db.commit()
-            log_success("CREATE_ORDER", f"Đã trừ số lượng sản phẩm {payload.sp_banggia}: {new_qty} còn lại")
+            new_stock = decrement_stock(db, {payload.sp_banggia: quantity_out})
+            log_success("CREATE_ORDER", f"Đã trừ số lượng sản phẩm {payload.sp_banggia}: {new_stock.get(payload.sp_banggia, 0)} còn lại")
+        db.commit()
+        db.refresh(o)
         
         # Tự động ghi vào General Diary
         try:
@@ -202,8 +186,10 @@ def create_order(payload: OrderCreate, db: Session = Depends(get_db)):
             # Không rollback vì order đã được tạo thành công
         
         log_success("CREATE_ORDER", f"Tạo đơn hàng thành công: {payload.ma_don_hang} - Tổng tiền: {computed_total:,.0f} VND")
+        bump_data_version()
         return {"success": True, "id": o.id}
     except HTTPException:
+        db.rollback()
         raise
     except Exception as e:
         import traceback
@@ -220,9 +206,14 @@ def update_order(order_id: int, payload: OrderUpdate, request: Request, db: Sess
     if not o:
         raise HTTPException(status_code=404, detail="Không tìm thấy đơn hàng")
     
-    # Trạng thái cũ/mới
-    old_status = o.trang_thai
-    new_status = payload.trang_thai if payload.trang_thai is not None else old_status
+    # Khách hàng mới (kiểm tra trước khi thay đổi tồn kho)
+    new_account_id = o.account_id
+    if payload.account_id is not None or payload.thong_tin_kh is not None:
+        new_account_id = customer_account_id(db, payload.account_id, payload.thong_tin_kh if payload.thong_tin_kh is not None else o.thong_tin_kh)
+    
+    # Mã trạng thái cũ/mới
+    old_status = o.ma_trang_thai or normalize_order_status(o.trang_thai)
+    new_status = normalize_order_status(payload.trang_thai) if payload.trang_thai is not None else old_status
     
     # Lưu thông tin cũ để tính toán
     old_quantity = o.so_luong or 0
@@ -231,7 +222,6 @@ def update_order(order_id: int, payload: OrderUpdate, request: Request, db: Sess
     # Phân biệt sản phẩm cũ và mới
     old_product = None
     new_product = None
-    old_price_item = None
     new_price_item = None
     old_is_product = False
     new_is_product = False
@@ -247,7 +237,9 @@ def update_order(order_id: int, payload: OrderUpdate, request: Request, db: Sess
             old_is_action = True
     
     # Kiểm tra loại mới
+    new_sp_banggia = old_sp_banggia
     if payload.sp_banggia is not None:
+        new_sp_banggia = payload.sp_banggia
         if payload.sp_banggia:
             new_product = db.query(Product).filter(Product.ma_sp == payload.sp_banggia).first()
             if new_product:
@@ -263,27 +255,29 @@ def update_order(order_id: int, payload: OrderUpdate, request: Request, db: Sess
     # Số lượng mới
     new_quantity = payload.so_luong if payload.so_luong is not None else old_quantity
     
-    # CHỈ kiểm tra kho nếu là SẢN PHẨM và đơn mới không bị hủy
-    if new_is_product and new_product and new_quantity is not None and not is_cancelled(new_status):
-        current_qty = int(new_product.so_luong or 0 or 0)
-        if old_is_product and old_product and new_product.id or None == old_product.id or None:
-            # Cùng sản phẩm, tính chênh lệch
-            quantity_diff = int(new_quantity or 0) - int(old_quantity or 0)
-            if quantity_diff > 0 and current_qty < quantity_diff:
-                raise HTTPException(status_code=400, detail=f"Số lượng sản phẩm không đủ. Hiện có: {current_qty}, cần thêm: {quantity_diff}")
-        else:
-            # Sản phẩm khác hoặc từ hành động chuyển sang sản phẩm
-            if current_qty < int(new_quantity or 0):
-                raise HTTPException(status_code=400, detail=f"Số lượng sản phẩm không đủ. Hiện có: {current_qty}, yêu cầu: {new_quantity}")
+    # Chênh lệch tồn kho (CHỈ CHO SẢN PHẨM): đơn chưa hủy đang giữ so_luong của sản phẩm.
+    # Hoàn trả phần đơn cũ đang giữ, trừ phần đơn mới cần giữ; cùng sản phẩm thì chỉ áp dụng chênh lệch.
+    stock_deltas = {}
+    if old_is_product and old_product and not is_cancelled(old_status):
+        stock_deltas[old_sp_banggia] = stock_deltas.get(old_sp_banggia, 0) - int(old_quantity or 0)
+    if new_is_product and new_product and not is_cancelled(new_status):
+        stock_deltas[new_sp_banggia] = stock_deltas.get(new_sp_banggia, 0) + int(new_quantity or 0)
+    try:
+        adjust_stock(db, stock_deltas)
+    except HTTPException:
+        db.rollback()
+        raise
     
     # Cập nhật dữ liệu cơ bản
     if payload.ma_don_hang is not None: o.ma_don_hang = payload.ma_don_hang
     if payload.thong_tin_kh is not None: o.thong_tin_kh = payload.thong_tin_kh
+    o.account_id = new_account_id
     if payload.sp_banggia is not None: o.sp_banggia = payload.sp_banggia
     if payload.ngay_tao is not None: o.ngay_tao = payload.ngay_tao
     if payload.ma_co_quan_thue is not None: o.ma_co_quan_thue = payload.ma_co_quan_thue
     if payload.so_luong is not None: o.so_luong = payload.so_luong
     if payload.trang_thai is not None: o.trang_thai = payload.trang_thai
+    o.ma_trang_thai = new_status
     
     # Tính lại tổng tiền - ưu tiên tong_tien từ payload nếu có và > 0
     if payload.tong_tien is not None and payload.tong_tien > 0:
@@ -309,51 +303,7 @@ def update_order(order_id: int, payload: OrderUpdate, request: Request, db: Sess
                     unit_price = float(o.tong_tien or 0) / max(int(new_quantity or 1), 1)
             o.tong_tien = unit_price * int(new_quantity or 0)
     
-    db.commit()
-    
-    # Điều chỉnh kho theo thay đổi trạng thái/sản phẩm/số lượng
-    # 1) Nếu chuyển sang Đã hủy: hoàn trả kho sản phẩm cũ (CHỈ CHO SẢN PHẨM)
-    if is_cancelled(new_status):
-        if old_is_product and old_product:
-            old_qty = int(old_product.so_luong or 0 or 0)
-            setattr(old_product, 'so_luong', old_qty + int(old_quantity or 0))
-            setattr(old_product, 'trang_thai', 'Còn hàng' if (old_qty + int(old_quantity or 0)) > 0 else 'Hết hàng')
-            db.commit()
-        return {"success": True}
-    
-    # 2) Nếu từ Đã hủy chuyển về trạng thái hoạt động: cần trừ kho theo số lượng mới (CHỈ CHO SẢN PHẨM)
-    if is_cancelled(old_status) and not is_cancelled(new_status):
-        if new_is_product and new_product:
-            new_stock = int(new_product.so_luong or 0 or 0)
-            # Trừ toàn bộ số lượng mới
-            new_stock = max(new_stock - int(new_quantity or 0), 0)
-            setattr(new_product, 'so_luong', new_stock)
-            setattr(new_product, 'trang_thai', 'Còn hàng' if new_stock > 0 else 'Hết hàng')
-            db.commit()
-        return {"success": True}
-    
-    # 3) Cả hai đều không bị hủy: xử lý kho (CHỈ CHO SẢN PHẨM)
-    if new_quantity is not None:
-        # Hoàn trả kho cũ nếu là sản phẩm
-        if old_is_product and old_product and (not new_is_product or not new_product or old_product.id or None != new_product.id or None):
-            old_qty = int(old_product.so_luong or 0 or 0)
-            setattr(old_product, 'so_luong', old_qty + int(old_quantity or 0))
-            setattr(old_product, 'trang_thai', 'Còn hàng' if (old_qty + int(old_quantity or 0)) > 0 else 'Hết hàng')
-        
-        # Trừ kho mới nếu là sản phẩm
-        if new_is_product and new_product:
-            new_stock = int(new_product.so_luong or 0 or 0)
-            if old_is_product and old_product and new_product.id or None == old_product.id or None:
-                # Cùng sản phẩm: tính chênh lệch
-                quantity_diff = int(new_quantity or 0) - int(old_quantity or 0)
-                new_stock = max(new_stock - max(quantity_diff, 0), 0)
-            else:
-                # Sản phẩm khác: trừ toàn bộ số lượng mới
-                new_stock = max(new_stock - int(new_quantity or 0), 0)
-            setattr(new_product, 'so_luong', new_stock)
-            setattr(new_product, 'trang_thai', 'Còn hàng' if new_stock > 0 else 'Hết hàng')
-        
-        db.flush()  # Flush để đảm bảo update được thực hiện
+    db.flush()
     
     # Lấy username từ token
     username = get_username_from_request(request)
@@ -376,6 +326,7 @@ def update_order(order_id: int, payload: OrderUpdate, request: Request, db: Sess
         log_error("UPDATE_ORDER_DIARY", f"Lỗi khi ghi vào General Diary: {str(diary_error)}", error=diary_error)
         db.commit()  # Vẫn commit việc update đơn hàng
     
+    bump_data_version()
     return {"success": True}
 
 
@@ -395,26 +346,10 @@ def delete_order(order_id: int, request: Request, db: Session = Depends(get_db))
         order_sp_banggia = o.sp_banggia
         order_so_luong = o.so_luong
         
-        # CHỈ hoàn trả số lượng sản phẩm trước khi xóa đơn hàng (không hoàn trả cho hành động)
-        if order_sp_banggia and order_so_luong:
-            product = db.query(Product).filter(Product.ma_sp == order_sp_banggia).first()
-            if product:
-                # Chỉ hoàn trả nếu đây là sản phẩm (có trong bảng products)
-                current_qty = int(product.so_luong or 0)
-                order_qty = int(order_so_luong or 0)
-                new_qty = current_qty + order_qty
-                product.so_luong = new_qty
-                product.trang_thai = 'Còn hàng' if new_qty > 0 else 'Hết hàng'
-                
-                # Cập nhật warehouse nếu có
-                warehouse = db.query(Warehouse).filter(Warehouse.ma_sp == order_sp_banggia).first()
-                if warehouse:
-                    current_wh_qty = warehouse.so_luong or 0
-                    new_wh_qty = current_wh_qty + order_qty
-                    warehouse.so_luong = new_wh_qty
-                    warehouse.trang_thai = 'Còn hàng' if new_wh_qty > 0 else 'Hết hàng'
-                
-                db.flush()
+        # CHỈ hoàn trả số lượng sản phẩm trước khi xóa đơn hàng (không hoàn trả cho hành động,
+        # đơn đã hủy thì kho đã được hoàn trả lúc hủy). Mã không có trong products sẽ không khớp dòng nào.
+        if order_sp_banggia and order_so_luong and not is_cancelled(o.ma_trang_thai or normalize_order_status(o.trang_thai)):
+            increment_stock(db, {order_sp_banggia: int(order_so_luong or 0)})
         
         # Ghi vào general_diary trước khi xóa
         try:
@@ -438,6 +373,7 @@ def delete_order(order_id: int, request: Request, db: Session = Depends(get_db))
         db.commit()
         
         log_success("DELETE_ORDER", f"Đã xóa đơn hàng: {order_info}")
+        bump_data_version()
         return {"success": True}
         
     except HTTPException:
@@ -471,6 +407,7 @@ def add_order_item(payload: dict = Body(...), db: Session = Depends(get_db)):
     db.add(it)
     db.commit()
     db.refresh(it)
+    bump_data_version()
     return {"success": True, "id": it.id}
 
 
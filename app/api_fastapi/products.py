@@ -9,6 +9,7 @@ from ..logger import log_info, log_success, log_error, log_warning
 from ..services.products import save_uploaded_file, validate_product_fields
 from ..services.general_diary import create_general_diary_entry
 from ..services.auth_helper import get_username_from_request
+from ..services.report_cache import bump_data_version
 import os
 from typing import Optional
 
@@ -133,6 +134,7 @@ async def create_product(
             # Không rollback vì product đã được tạo thành công
         
         log_success("CREATE_PRODUCT", f"Tạo sản phẩm thành công: {code} - {name} (ID: {p.id})")
+        bump_data_version()
         return {"success": True, "id": p.id}
     except HTTPException:
         raise
@@ -210,6 +212,7 @@ async def update_product(
     db.refresh(p)
     
     log_success("UPDATE_PRODUCT", f"Cập nhật sản phẩm thành công: {p.ma_sp} - {p.ten_sp} (ID: {product_id})")
+    bump_data_version()
     return {"success": True, "id": p.id}
 
 
@@ -252,6 +255,7 @@ def delete_product(product_id: int, request: Request, db: Session = Depends(get_
         log_error("DELETE_PRODUCT_DIARY", f"Lỗi khi ghi vào General Diary: {str(diary_error)}", error=diary_error)
         db.commit()  # Vẫn commit việc xóa sản phẩm
     
+    bump_data_version()
     return {"success": True}
 
 
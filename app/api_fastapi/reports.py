@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, and_, or_, false, cast, Date
 from ..database import get_db
-from ..models import Invoice, InvoiceItem, Product
-from datetime import datetime, date
+from ..models import Invoice, Product, DailySales, ProductForecast, CustomerBalance
+from datetime import datetime, date, timedelta
+from typing import Optional
+from ..services.report_cache import cached_report, report_cache_stats
+from ..services.forecasting import refresh_product_forecasts
+from ..logger import log_error, log_success
 
 router = APIRouter(prefix="/reports", tags=["reports"]) 
 
@@ -11,144 +15,458 @@ router = APIRouter(prefix="/reports", tags=["reports"])
 def revenue_report(
     from_date: str = Query(None, description="Từ ngày (YYYY-MM-DD)"),
     to_date: str = Query(None, description="Đến ngày (YYYY-MM-DD)"),
+    skip: int = Query(0, ge=0, description="Bỏ qua N sản phẩm đầu (phân trang)"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Số sản phẩm tối đa mỗi trang"),
+    top: Optional[int] = Query(None, ge=1, le=1000, description="Chỉ lấy N sản phẩm có doanh thu cao nhất"),
     db: Session = Depends(get_db)
 ):
     """
     Báo cáo doanh thu - chỉ tính các hóa đơn đã thanh toán
+
+    Đọc từ bảng daily_sales (chỉ chứa hóa đơn đã thanh toán); gom nhóm theo sản phẩm,
+    tổng và tỷ lệ đều tính bằng GROUP BY / window function trong database.
     """
-    # Query chỉ lấy các hóa đơn đã thanh toán
-    query = db.query(Invoice, InvoiceItem).join(
-        InvoiceItem, Invoice.id == InvoiceItem.invoice_id
-    ).filter(
-        Invoice.trang_thai.ilike('%đã thanh toán%')
-    )
+    params = dict(from_date=from_date, to_date=to_date, skip=skip, limit=limit, top=top)
+    return cached_report("reports.revenue", params, lambda: _revenue_report(db, **params))
+
+
+def _revenue_report(db: Session, from_date: Optional[str], to_date: Optional[str],
+                    skip: int, limit: Optional[int], top: Optional[int]) -> dict:
+    filters = []
     
     # Lọc theo ngày nếu có
     if from_date:
         try:
             from_date_obj = datetime.strptime(from_date, '%Y-%m-%d').date()
-            query = query.filter(Invoice.ngay_hd >= from_date_obj)
+            filters.append(DailySales.ngay >= from_date_obj)
         except ValueError:
             pass
     
     if to_date:
         try:
             to_date_obj = datetime.strptime(to_date, '%Y-%m-%d').date()
-            query = query.filter(Invoice.ngay_hd <= to_date_obj)
+            filters.append(DailySales.ngay <= to_date_obj)
         except ValueError:
             pass
     
-    # Lấy tất cả invoice items đã thanh toán
-    paid_items = query.all()
+    # Tổng doanh thu và số lượng đã bán (một dòng)
+    totals = db.query(
+        func.coalesce(func.sum(DailySales.doanh_thu), 0.0).label('total_revenue'),
+        func.coalesce(func.sum(DailySales.so_luong), 0).label('total_quantity_sold'),
+        func.count(func.distinct(DailySales.ma_sp)).label('total_items'),
+    ).filter(*filters).one()
+    total_revenue = float(totals.total_revenue or 0)
+    
+    # Doanh thu theo sản phẩm; tỷ lệ = doanh thu sản phẩm / tổng doanh thu * 100 (window function)
+    product_code = DailySales.ma_sp
+    doanh_thu = func.coalesce(func.sum(DailySales.doanh_thu), 0.0)
+    ty_le = 100.0 * doanh_thu / func.nullif(func.sum(doanh_thu).over(), 0)
+    query = db.query(
+        product_code.label('ma_sp'),
+        func.coalesce(func.max(DailySales.ten_sp), 'N/A').label('ten_sp'),
+        func.coalesce(func.sum(DailySales.so_luong), 0).label('so_luong_ban'),
+        func.coalesce(func.max(DailySales.don_gia), 0.0).label('gia_ban'),
+        doanh_thu.label('doanh_thu'),
+        func.coalesce(ty_le, 0.0).label('ty_le'),
+    ).filter(*filters).group_by(product_code).order_by(
+        # Sắp xếp theo doanh thu giảm dần, mã sản phẩm để phân trang ổn định
+        doanh_thu.desc(), product_code
+    )
     
-    # Tính tổng doanh thu và số lượng
-    total_revenue = 0.0
-    total_quantity_sold = 0
-    product_revenue = {}  # {product_code: {ten_sp, so_luong_ban, gia_ban, doanh_thu}}
+    # top giới hạn phạm vi xếp hạng, skip/limit phân trang bên trong phạm vi đó
+    if top is not None:
+        remaining = max(top - skip, 0)
+        limit = min(limit, remaining) if limit is not None else remaining
+    if skip:
+        query = query.offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
     
-    for invoice, item in paid_items:
-        total_revenue += float(item.total_price or 0)
-        total_quantity_sold += int(item.so_luong or 0)
-        
-        # Nhóm theo sản phẩm
-        product_code = item.product_code or 'N/A'
-        if product_code not in product_revenue:
-            product_revenue[product_code] = {
-                'ma_sp': product_code,
-                'ten_sp': item.product_name or 'N/A',
-                'so_luong_ban': 0,
-                'gia_ban': float(item.don_gia or 0),
-                'doanh_thu': 0.0
-            }
-        
-        product_revenue[product_code]['so_luong_ban'] += int(item.so_luong or 0)
-        product_revenue[product_code]['doanh_thu'] += float(item.total_price or 0)
+    items = [{
+        'ma_sp': row.ma_sp,
+        'ten_sp': row.ten_sp,
+        'so_luong_ban': int(row.so_luong_ban or 0),
+        'gia_ban': float(row.gia_ban or 0),
+        'doanh_thu': float(row.doanh_thu or 0),
+        'ty_le': round(float(row.ty_le or 0), 2)  # Làm tròn đến 2 chữ số thập phân
+    } for row in query.all()]
     
     # Tính tổng số lượng còn lại và tổng sản phẩm
     total_quantity_remaining = db.query(func.sum(Product.so_luong)).scalar() or 0
     total_products = db.query(func.count(Product.id)).scalar() or 0
     
-    # Tính tỷ lệ cho mỗi sản phẩm
-    # Tỷ lệ = (doanh thu sản phẩm / tổng doanh thu) * 100
-    items = []
-    for product_code, data in product_revenue.items():
-        if total_revenue > 0:
-            ty_le = (data['doanh_thu'] / total_revenue) * 100
-        else:
-            ty_le = 0.0
-        items.append({
-            **data,
-            'ty_le': round(ty_le, 2)  # Làm tròn đến 2 chữ số thập phân
-        })
-    
-    # Sắp xếp theo doanh thu giảm dần
-    items.sort(key=lambda x: x['doanh_thu'], reverse=True)
-    
     return {
         "summary": {
             "total_revenue": round(total_revenue, 2),
-            "total_quantity_sold": total_quantity_sold,
+            "total_quantity_sold": int(totals.total_quantity_sold or 0),
             "total_quantity_remaining": int(total_quantity_remaining),
-            "total_products": total_products
+            "total_products": total_products,
+            "total_items": int(totals.total_items or 0)
         },
         "items": items
     }
 
-@router.get("/debt")
-def debt_report(db: Session = Depends(get_db)):
+
+TIMESERIES_GRANULARITIES = ('day', 'week', 'month')
+TIMESERIES_DEFAULT_BUCKETS = {'day': 30, 'week': 12, 'month': 12}  # Số kỳ mặc định (tính cả kỳ chứa to_date) khi không truyền from_date
+TIMESERIES_MAX_BUCKETS = 1000
+
+
+def _bucket_start(day: date, granularity: str) -> date:
+    """Ngày đầu của kỳ chứa `day` (tuần bắt đầu từ thứ Hai, giống date_trunc của PostgreSQL)."""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _next_bucket(day: date, granularity: str) -> date:
+    if granularity == 'week':
+        return day + timedelta(days=7)
+    if granularity == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def _default_start(end: date, granularity: str) -> date:
+    """Ngày đầu của kỳ sao cho từ đó đến `end` có đúng TIMESERIES_DEFAULT_BUCKETS kỳ trọn vẹn."""
+    start = _bucket_start(end, granularity)
+    for _ in range(TIMESERIES_DEFAULT_BUCKETS[granularity] - 1):
+        start = _bucket_start(start - timedelta(days=1), granularity)
+    return start
+
+
+@router.get("/revenue/timeseries")
+def revenue_timeseries(
+    granularity: str = Query('day', description="Độ chia thời gian: day, week, month"),
+    from_date: str = Query(None, description="Từ ngày (YYYY-MM-DD)"),
+    to_date: str = Query(None, description="Đến ngày (YYYY-MM-DD), mặc định hôm nay"),
+    breakdown: Optional[str] = Query(None, description="Tách theo: product_group hoặc payment_method"),
+    db: Session = Depends(get_db)
+):
     """
-    Báo cáo công nợ - tính các hóa đơn chưa thanh toán
+    Doanh thu theo thời gian (hóa đơn đã thanh toán), mọi kỳ trong một câu truy vấn
+
+    Đọc bảng daily_sales, gom theo date_trunc(kỳ) và tùy chọn theo nhóm sản phẩm hoặc
+    hình thức thanh toán; các kỳ không có doanh thu được điền 0.
     """
-    # Query lấy các hóa đơn chưa thanh toán (không phải "Đã thanh toán")
-    unpaid_invoices = db.query(Invoice).filter(
-        ~Invoice.trang_thai.ilike('%đã thanh toán%')
-    ).all()
+    if granularity not in TIMESERIES_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Độ chia thời gian không hợp lệ: {granularity}")
+    if breakdown not in (None, 'product_group', 'payment_method'):
+        raise HTTPException(status_code=400, detail=f"Không hỗ trợ tách theo: {breakdown}")
+    try:
+        end = datetime.strptime(to_date, '%Y-%m-%d').date() if to_date else date.today()
+        start = (datetime.strptime(from_date, '%Y-%m-%d').date() if from_date
+                 else _default_start(end, granularity))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ngày không hợp lệ, định dạng YYYY-MM-DD")
+    if start > end:
+        raise HTTPException(status_code=400, detail="from_date phải trước hoặc bằng to_date")
     
-    # Tính tổng công nợ
-    total_debt = sum(float(inv.tong_tien or 0) for inv in unpaid_invoices)
+    params = dict(granularity=granularity, start=start, end=end, breakdown=breakdown)
+    return cached_report("reports.revenue_timeseries", params, lambda: _revenue_timeseries(db, **params))
+
+
+def _revenue_timeseries(db: Session, granularity: str, start: date, end: date, breakdown: Optional[str]) -> dict:
+    # Danh sách kỳ liên tục từ start đến end để điền 0 cho kỳ không có dữ liệu
+    buckets = []
+    current = _bucket_start(start, granularity)
+    while current <= end:
+        buckets.append(current)
+        if len(buckets) > TIMESERIES_MAX_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"Khoảng thời gian quá dài (tối đa {TIMESERIES_MAX_BUCKETS} kỳ)")
+        current = _next_bucket(current, granularity)
+    
+    bucket = cast(func.date_trunc(granularity, DailySales.ngay), Date).label('bucket')
+    columns = [bucket]
+    group_by = [bucket]
+    if breakdown == 'product_group':
+        series_key = func.coalesce(Product.nhom_sp, 'Chưa phân nhóm').label('series')
+    elif breakdown == 'payment_method':
+        series_key = func.coalesce(func.nullif(DailySales.hinh_thuc_tt, ''), 'Không rõ').label('series')
+    else:
+        series_key = None
+    if series_key is not None:
+        columns.append(series_key)
+        group_by.append(series_key)
+    
+    query = db.query(
+        *columns,
+        func.coalesce(func.sum(DailySales.doanh_thu), 0.0).label('doanh_thu'),
+        func.coalesce(func.sum(DailySales.so_luong), 0).label('so_luong'),
+    ).filter(DailySales.ngay >= start, DailySales.ngay <= end)
+    if breakdown == 'product_group':
+        query = query.outerjoin(Product, Product.ma_sp == DailySales.ma_sp)
+    rows = query.group_by(*group_by).all()
+    
+    index = {b: i for i, b in enumerate(buckets)}
+    total_revenue = [0.0] * len(buckets)
+    total_quantity = [0] * len(buckets)
+    series = {}
+    for row in rows:
+        i = index.get(row.bucket)
+        if i is None:
+            continue
+        revenue, quantity = float(row.doanh_thu or 0), int(row.so_luong or 0)
+        total_revenue[i] += revenue
+        total_quantity[i] += quantity
+        if series_key is not None:
+            s = series.setdefault(row.series, {'doanh_thu': [0.0] * len(buckets), 'so_luong': [0] * len(buckets)})
+            s['doanh_thu'][i] += revenue
+            s['so_luong'][i] += quantity
     
-    # Tính công nợ quá hạn (giả sử quá 30 ngày là quá hạn)
+    return {
+        "granularity": granularity,
+        "from_date": start.isoformat(),
+        "to_date": end.isoformat(),
+        "breakdown": breakdown,
+        "buckets": [b.isoformat() for b in buckets],
+        "doanh_thu": [round(v, 2) for v in total_revenue],
+        "so_luong": total_quantity,
+        "series": sorted(
+            [{
+                "key": key,
+                "doanh_thu": [round(v, 2) for v in data['doanh_thu']],
+                "so_luong": data['so_luong'],
+                "tong_doanh_thu": round(sum(data['doanh_thu']), 2),
+            } for key, data in series.items()],
+            key=lambda x: x['tong_doanh_thu'], reverse=True
+        )
+    }
+
+
+# Nhóm tuổi nợ theo số ngày kể từ ngày hóa đơn: (nhãn, từ ngày, đến ngày); None = không giới hạn
+DEBT_AGING_BUCKETS = [
+    ('0-30', 0, 30),
+    ('31-60', 31, 60),
+    ('61-90', 61, 90),
+    ('90+', 91, None),
+]
+OVERDUE_DAYS = 30  # Quá 30 ngày là quá hạn
+
+DEBT_SORT_COLUMNS = {
+    'so_tien_no': Invoice.tong_tien,
+    'ngay_tao': Invoice.ngay_hd,
+    'so_ngay_no': Invoice.ngay_hd,  # Sắp xếp theo tuổi nợ = ngược chiều ngày hóa đơn
+    'khach_hang': Invoice.nguoi_mua,
+    'so_hoa_don': Invoice.so_hd,
+}
+
+
+def _aging_condition(today: date, min_days: int, max_days: Optional[int]):
+    """Điều kiện theo ngày hóa đơn cho nhóm tuổi nợ (so sánh trên cột ngay_hd để dùng được index)."""
+    conds = []
+    if min_days > 0:  # Nhóm đầu tiên nhận cả hóa đơn ghi ngày trong tương lai
+        conds.append(Invoice.ngay_hd <= today - timedelta(days=min_days))
+    if max_days is not None:
+        conds.append(Invoice.ngay_hd >= today - timedelta(days=max_days))
+    return and_(*conds)
+
+
+def _aging_columns(today: date):
+    """Tổng tiền nợ theo từng nhóm tuổi nợ (SUM ... FILTER) để gom trong cùng một câu truy vấn."""
+    return [
+        func.coalesce(func.sum(Invoice.tong_tien).filter(_aging_condition(today, lo, hi)), 0.0).label(f'bucket_{i}')
+        for i, (_, lo, hi) in enumerate(DEBT_AGING_BUCKETS)
+    ]
+
+
+def _aging_dict(row) -> dict:
+    return {label: round(float(getattr(row, f'bucket_{i}') or 0), 2) for i, (label, _, _) in enumerate(DEBT_AGING_BUCKETS)}
+
+
+def debt_aging_label(days: int) -> str:
+    for label, lo, hi in DEBT_AGING_BUCKETS:
+        if days >= lo and (hi is None or days <= hi):
+            return label
+    return DEBT_AGING_BUCKETS[0][0]
+
+
+@router.get("/debt")
+def debt_report(
+    skip: int = Query(0, ge=0, description="Bỏ qua N hóa đơn đầu (phân trang)"),
+    limit: int = Query(100, ge=1, le=1000, description="Số hóa đơn tối đa mỗi trang"),
+    sort_by: str = Query('so_tien_no', description="Sắp xếp theo: so_tien_no, ngay_tao, so_ngay_no, khach_hang, so_hoa_don"),
+    order: str = Query('desc', description="Chiều sắp xếp: asc hoặc desc"),
+    bucket: Optional[str] = Query(None, description="Chỉ lấy hóa đơn thuộc nhóm tuổi nợ: 0-30, 31-60, 61-90, 90+"),
+    khach_hang: Optional[str] = Query(None, description="Chỉ lấy hóa đơn của khách hàng này"),
+    customer_limit: int = Query(50, ge=1, le=1000, description="Số khách hàng tối đa trong bảng tổng theo khách"),
+    db: Session = Depends(get_db)
+):
+    """
+    Báo cáo công nợ - tính các hóa đơn chưa thanh toán
+
+    Tổng công nợ và số khách hàng nợ đọc từ bảng customer_balances; quá hạn, nhóm tuổi nợ
+    (0-30, 31-60, 61-90, 90+ ngày) và tổng theo khách hàng tính bằng SQL trên hóa đơn chưa thanh toán;
+    danh sách hóa đơn được phân trang và sắp xếp trong database.
+    """
+    params = dict(skip=skip, limit=limit, sort_by=sort_by, order=order, bucket=bucket,
+                  khach_hang=khach_hang, customer_limit=customer_limit)
+    return cached_report("reports.debt", params, lambda: _debt_report(db, **params))
+
+
+def _debt_report(db: Session, skip: int, limit: int, sort_by: str, order: str, bucket: Optional[str],
+                 khach_hang: Optional[str], customer_limit: int) -> dict:
     today = date.today()
-    overdue_debt = 0.0
-    overdue_count = 0
+    unpaid = Invoice.da_thanh_toan == false()
+    overdue = Invoice.ngay_hd < today - timedelta(days=OVERDUE_DAYS)
     
-    for inv in unpaid_invoices:
-        if inv.ngay_hd:
-            days_diff = (today - inv.ngay_hd).days
-            if days_diff > 30:
-                overdue_debt += float(inv.tong_tien or 0)
-                overdue_count += 1
+    # Tổng công nợ và số khách hàng nợ đọc từ bảng customer_balances
+    balance = db.query(
+        func.coalesce(func.sum(CustomerBalance.con_no), 0.0).label('total_debt'),
+        func.count(CustomerBalance.id).label('debt_customers'),
+    ).filter(CustomerBalance.con_no > 0).one()
+    total_debt = float(balance.total_debt or 0)
+    debt_customers = int(balance.debt_customers or 0)
     
-    # Đếm số khách hàng nợ (unique)
-    debt_customers = len(set(inv.nguoi_mua for inv in unpaid_invoices if inv.nguoi_mua))
+    # Quá hạn và nhóm tuổi nợ cần ngày hóa đơn: một lượt quét các hóa đơn chưa thanh toán
+    summary = db.query(
+        func.coalesce(func.sum(Invoice.tong_tien).filter(overdue), 0.0).label('overdue_debt'),
+        func.count(Invoice.id).filter(overdue).label('overdue_count'),
+        func.count(Invoice.id).label('invoice_count'),
+        *_aging_columns(today),
+    ).filter(unpaid).one()
     
     # Tính công nợ trung bình
     avg_debt = (total_debt / debt_customers) if debt_customers > 0 else 0
     
-    # Tạo danh sách chi tiết công nợ
+    # Tổng theo khách hàng, nợ nhiều nhất trước
+    customer_total = func.coalesce(func.sum(Invoice.tong_tien), 0.0)
+    customer_rows = db.query(
+        Invoice.nguoi_mua,
+        customer_total.label('total_debt'),
+        func.count(Invoice.id).label('invoice_count'),
+        func.min(Invoice.ngay_hd).label('oldest_date'),
+        *_aging_columns(today),
+    ).filter(unpaid).group_by(Invoice.nguoi_mua).order_by(
+        customer_total.desc(), Invoice.nguoi_mua
+    ).limit(customer_limit).all()
+    
+    customers = [{
+        'khach_hang': row.nguoi_mua or 'N/A',
+        'tong_no': round(float(row.total_debt or 0), 2),
+        'so_hoa_don': int(row.invoice_count or 0),
+        'no_lau_nhat': (today - row.oldest_date).days if row.oldest_date else 0,
+        'nhom_tuoi_no': _aging_dict(row),
+    } for row in customer_rows]
+    
+    # Danh sách chi tiết công nợ: lọc, sắp xếp và phân trang trong database
+    query = db.query(
+        Invoice.nguoi_mua, Invoice.so_hd, Invoice.ngay_hd, Invoice.tong_tien
+    ).filter(unpaid)
+    if bucket:
+        bucket_range = next(((lo, hi) for label, lo, hi in DEBT_AGING_BUCKETS if label == bucket), None)
+        if bucket_range is None:
+            raise HTTPException(status_code=400, detail=f"Nhóm tuổi nợ không hợp lệ: {bucket}")
+        query = query.filter(_aging_condition(today, *bucket_range))
+    if khach_hang:
+        query = query.filter(Invoice.nguoi_mua == khach_hang)
+    
+    sort_column = DEBT_SORT_COLUMNS.get(sort_by)
+    if sort_column is None:
+        raise HTTPException(status_code=400, detail=f"Không hỗ trợ sắp xếp theo: {sort_by}")
+    descending = order.lower() != 'asc'
+    if sort_by == 'so_ngay_no':
+        descending = not descending
+    query = query.order_by(sort_column.desc() if descending else sort_column.asc(), Invoice.id)
+    total_items = query.order_by(None).count()
+    
     items = []
-    for inv in unpaid_invoices:
+    for inv in query.offset(skip).limit(limit).all():
         days_diff = (today - inv.ngay_hd).days if inv.ngay_hd else 0
-        status = 'overdue' if days_diff > 30 else 'normal'
+        status = 'overdue' if days_diff > OVERDUE_DAYS else 'normal'
         
         items.append({
             'khach_hang': inv.nguoi_mua or 'N/A',
             'so_hoa_don': inv.so_hd or 'N/A',
             'ngay_tao': inv.ngay_hd.isoformat() if inv.ngay_hd else '',
             'so_tien_no': float(inv.tong_tien or 0),
+            'so_ngay_no': days_diff,
+            'nhom_tuoi_no': debt_aging_label(days_diff),
             'trang_thai': status,
             'ghi_chu': f'Còn nợ {days_diff} ngày' if days_diff > 0 else 'Chưa thanh toán'
         })
     
-    # Sắp xếp theo số tiền nợ giảm dần
-    items.sort(key=lambda x: x['so_tien_no'], reverse=True)
-    
     return {
         "summary": {
             "total_debt": round(total_debt, 2),
-            "overdue_debt": round(overdue_debt, 2),
+            "overdue_debt": round(float(summary.overdue_debt or 0), 2),
+            "overdue_count": int(summary.overdue_count or 0),
             "debt_customers": debt_customers,
-            "avg_debt": round(avg_debt, 2)
+            "avg_debt": round(avg_debt, 2),
+            "invoice_count": int(summary.invoice_count or 0),
+            "aging": _aging_dict(summary),
+            "total_items": total_items
         },
+        "customers": customers,
         "items": items
     }
+
+
+@router.get("/cache-stats")
+def report_cache_statistics():
+    """Thống kê cache báo cáo: số lần hit/miss, số mục đang lưu, phiên bản dữ liệu"""
+    return report_cache_stats()
+
+
+FORECAST_SORT_COLUMNS = {
+    "reorder_point": ProductForecast.reorder_point,
+    "forecast_daily": ProductForecast.forecast_daily,
+    "safety_stock": ProductForecast.safety_stock,
+    "ma_sp": ProductForecast.ma_sp,
+}
+
+
+@router.get("/forecast")
+def demand_forecast(
+    ma_sp: Optional[str] = Query(None, description="Chỉ lấy dự báo của sản phẩm này"),
+    method: Optional[str] = Query(None, description="holt_winters, croston hoặc none"),
+    sort_by: str = Query("reorder_point", description="reorder_point, forecast_daily, safety_stock, ma_sp"),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """Dự báo nhu cầu, tồn kho an toàn và điểm đặt hàng theo sản phẩm (tính bởi job dự báo)"""
+    if sort_by not in FORECAST_SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort_by không hợp lệ: {sort_by}")
+    query = db.query(ProductForecast)
+    if ma_sp:
+        query = query.filter(ProductForecast.ma_sp == ma_sp)
+    if method:
+        query = query.filter(ProductForecast.method == method)
+    total = query.count()
+    order = FORECAST_SORT_COLUMNS[sort_by]
+    rows = query.order_by(order.asc() if sort_by == "ma_sp" else order.desc(), ProductForecast.ma_sp).offset(skip).limit(limit).all()
+    return {
+        "total": total,
+        "items": [
+            {
+                "ma_sp": r.ma_sp,
+                "method": r.method,
+                "forecast_daily": round(r.forecast_daily, 3),
+                "forecast_horizon": round(r.forecast_horizon, 2),
+                "demand_std": round(r.demand_std, 3),
+                "lead_time_demand": round(r.lead_time_demand, 2),
+                "safety_stock": round(r.safety_stock, 2),
+                "reorder_point": round(r.reorder_point, 2),
+                "history_days": r.history_days,
+                "computed_at": r.computed_at.isoformat() if r.computed_at else None,
+            }
+            for r in rows
+        ]
+    }
+
+
+@router.post("/forecast/refresh")
+def refresh_forecast(db: Session = Depends(get_db)):
+    """Tính lại ngay dự báo nhu cầu cho toàn bộ sản phẩm (không chờ job định kỳ)"""
+    try:
+        info = refresh_product_forecasts(db)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        log_error("FORECAST", "Lỗi khi tính dự báo nhu cầu", error=e)
+        raise HTTPException(status_code=500, detail=f"Lỗi khi tính dự báo nhu cầu: {str(e)}")
+    log_success("FORECAST", f"Đã dự báo {info['products']} sản phẩm")
+    return {**info, "computed_at": info["computed_at"].isoformat()}
@@ -29,4 +29,26 @@ class Config:
     
     # Environment
     ENV = os.getenv('FLASK_ENV', 'development')
-    DEBUG = False  # Tắt debug để không có SQL logging
\ No newline at end of file
+    DEBUG = False  # Tắt debug để không có SQL logging
+    
+    # Report cache (cache kết quả báo cáo trong bộ nhớ, vô hiệu khi dữ liệu thay đổi)
+    REPORT_CACHE_ENABLED = os.getenv('REPORT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    REPORT_CACHE_TTL = int(os.getenv('REPORT_CACHE_TTL', 300))  # Giây
+    REPORT_CACHE_MAX_ENTRIES = int(os.getenv('REPORT_CACHE_MAX_ENTRIES', 256))
+    REPORT_SINGLE_FLIGHT_TIMEOUT = float(os.getenv('REPORT_SINGLE_FLIGHT_TIMEOUT', 30))  # Giây chờ tối đa khi request trùng đang được tính
+    
+    # Export (số dòng đọc/ghi mỗi khối khi xuất CSV/XLSX dạng stream)
+    EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 1000))
+    
+    # Job nền (scheduler trong tiến trình)
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    REORDER_SNAPSHOT_INTERVAL = int(os.getenv('REORDER_SNAPSHOT_INTERVAL', 900))  # Giây giữa hai lần làm mới snapshot đề xuất đặt hàng
+    CUSTOMER_LINK_INTERVAL = int(os.getenv('CUSTOMER_LINK_INTERVAL', 3600))  # Giây giữa hai lần gắn tài khoản cho đơn hàng / hóa đơn chưa khớp
+    DISCOUNT_STATUS_INTERVAL = int(os.getenv('DISCOUNT_STATUS_INTERVAL', 60))  # Giây giữa hai lần cập nhật trạng thái mã giảm giá theo ngày
+    
+    # Dự báo nhu cầu (Holt-Winters / Croston, tính theo lô)
+    FORECAST_HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', 730))  # Số ngày lịch sử bán hàng dùng để dự báo
+    FORECAST_LEAD_TIME_DAYS = int(os.getenv('FORECAST_LEAD_TIME_DAYS', 7))  # Số ngày từ lúc đặt đến lúc nhận hàng
+    FORECAST_SERVICE_LEVEL = float(os.getenv('FORECAST_SERVICE_LEVEL', 0.95))  # Xác suất không hết hàng trong thời gian chờ
+    FORECAST_INTERVAL = int(os.getenv('FORECAST_INTERVAL', 86400))  # Giây giữa hai lần tính lại dự báo
+    CUSTOMER_SEGMENT_INTERVAL = int(os.getenv('CUSTOMER_SEGMENT_INTERVAL', 86400))  # Giây giữa hai lần tính lại phân khúc RFM
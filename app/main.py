@@ -5,6 +5,13 @@ from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from .database import Base, engine, SessionLocal
+from .migrations import run_migrations
+from .services.scheduler import register_job, start_scheduler, stop_scheduler
+from .services.reorder import reorder_snapshot_job
+from .services.forecasting import product_forecast_job
+from .services.customers import customer_link_job
+from .services.segmentation import customer_segment_job
+from .services.discounts import discount_status_job
 from .models import User
 from werkzeug.security import generate_password_hash
 from .config import Config
@@ -18,7 +25,8 @@ from .api_fastapi import (
     products, prices, orders, invoices, users,
     accounts, product_groups, warehouses,
     auth, general_diary, areas, shops,
-    customers_analytics, discount_codes, reports, schedules, chatbot
+    customers_analytics, discount_codes, reports, schedules, chatbot,
+    exports
 )
 
 # Create FastAPI app
@@ -193,6 +201,7 @@ app.include_router(discount_codes.router, prefix="/api/discount-codes", tags=["d
 app.include_router(reports.router, prefix="/api", tags=["reports"])  # minimal compatibility
 app.include_router(schedules.router, prefix="/api", tags=["schedules"])  # minimal compatibility
 app.include_router(chatbot.router, prefix="/api", tags=["chatbot"])
+app.include_router(exports.router, prefix="/api", tags=["exports"])
 
 @app.on_event("startup")
 async def startup_event():
@@ -203,6 +212,11 @@ async def startup_event():
         log_info("STARTUP", "🗄️ Đã kiểm tra và tạo các bảng database.")
     except Exception as _e:
         log_warning("STARTUP", f"Không thể tạo bảng tự động: {_e}")
+    # Thêm cột/index mới cho database đã tồn tại (create_all không ALTER bảng cũ)
+    try:
+        run_migrations(engine)
+    except Exception as _e:
+        log_warning("STARTUP", f"Không thể nâng cấp schema: {_e}")
     # Ensure default admin for free plan where pre-deploy is unavailable
     try:
         username = os.getenv("DEFAULT_ADMIN_USERNAME", "admin")
@@ -229,6 +243,15 @@ async def startup_event():
     except Exception as _e:
         # Don't block startup if creation fails; it will be visible in logs
         log_warning("STARTUP", f"Không thể tạo admin mặc định: {_e}")
+    # Job nền: dự báo nhu cầu, làm mới snapshot đề xuất đặt hàng cho chatbot, gắn tài khoản và phân khúc khách hàng,
+    # trạng thái mã giảm giá theo ngày
+    if Config.SCHEDULER_ENABLED:
+        register_job("product_forecast", Config.FORECAST_INTERVAL, product_forecast_job)
+        register_job("reorder_snapshot", Config.REORDER_SNAPSHOT_INTERVAL, reorder_snapshot_job)
+        register_job("customer_link", Config.CUSTOMER_LINK_INTERVAL, customer_link_job, run_at_start=False)
+        register_job("customer_segments", Config.CUSTOMER_SEGMENT_INTERVAL, customer_segment_job)
+        register_job("discount_status", Config.DISCOUNT_STATUS_INTERVAL, discount_status_job)
+        start_scheduler()
     log_success("STARTUP", "🚀 PhanMemKeToan Backend đã khởi động thành công!")
     log_info("STARTUP", f"📡 API đang chạy tại: http://localhost:{Config.BACKEND_PORT}")
     log_info("STARTUP", f"📚 API Docs: http://localhost:{Config.BACKEND_PORT}/docs")
@@ -239,6 +262,12 @@ async def startup_event():
     log_info("STARTUP", f"🗄️ Database: {db_info}")
 
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """Dừng các job nền"""
+    stop_scheduler()
+
+
 @app.get("/", tags=["root"])
 def read_root():
     """Root endpoint"""
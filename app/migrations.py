@@ -0,0 +1,117 @@
+"""
+Nâng cấp schema cho database đã tồn tại.
+
+Base.metadata.create_all chỉ tạo bảng mới, không thêm cột/index vào bảng cũ.
+Mỗi bước dưới đây chạy đúng một lần (ghi lại trong bảng schema_migrations),
+dùng câu lệnh idempotent (IF NOT EXISTS) nên chạy trên database mới tạo cũng an toàn.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from .logger import log_info, log_success
+
+
+def _order_status_code(conn: Connection):
+    """Thêm Order.ma_trang_thai + index, backfill từ trang_thai dạng chuỗi tự do."""
+    from .services.orders import normalize_order_status
+
+    conn.execute(text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS ma_trang_thai VARCHAR(20)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_ma_trang_thai ON orders (ma_trang_thai)"))
+    # Số giá trị trạng thái khác nhau rất ít: chuẩn hóa trong Python rồi cập nhật theo từng giá trị
+    statuses = conn.execute(text("SELECT DISTINCT trang_thai FROM orders WHERE ma_trang_thai IS NULL")).scalars().all()
+    for status in statuses:
+        conn.execute(
+            text("UPDATE orders SET ma_trang_thai = :code WHERE ma_trang_thai IS NULL AND trang_thai IS NOT DISTINCT FROM :status"),
+            {"code": normalize_order_status(status), "status": status},
+        )
+
+
+def _invoice_paid_flag(conn: Connection):
+    """Thêm Invoice.da_thanh_toan + index (da_thanh_toan, ngay_hd), backfill từ trang_thai."""
+    from .services.invoices import is_paid_status
+
+    conn.execute(text("ALTER TABLE invoices ADD COLUMN IF NOT EXISTS da_thanh_toan BOOLEAN NOT NULL DEFAULT FALSE"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoices_da_thanh_toan_ngay_hd ON invoices (da_thanh_toan, ngay_hd)"))
+    statuses = conn.execute(text("SELECT DISTINCT trang_thai FROM invoices WHERE trang_thai IS NOT NULL")).scalars().all()
+    for status in statuses:
+        if is_paid_status(status):
+            conn.execute(text("UPDATE invoices SET da_thanh_toan = TRUE WHERE trang_thai = :status"), {"status": status})
+
+
+def _customer_balances(conn: Connection):
+    """Backfill bảng customer_balances (bảng được tạo bởi create_all) từ toàn bộ hóa đơn."""
+    from sqlalchemy.orm import Session
+    from .services.invoices import rebuild_customer_balances
+
+    rebuild_customer_balances(Session(bind=conn))
+
+
+def _daily_sales(conn: Connection):
+    """Backfill bảng daily_sales (bảng được tạo bởi create_all) từ invoice_items đã thanh toán."""
+    from sqlalchemy.orm import Session
+    from .services.invoices import rebuild_daily_sales
+
+    rebuild_daily_sales(Session(bind=conn))
+
+
+def _invoice_date_index(conn: Connection):
+    """Index Invoice.ngay_hd cho các truy vấn theo khoảng ngày trên hóa đơn."""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoices_ngay_hd ON invoices (ngay_hd)"))
+
+
+def _customer_account_links(conn: Connection):
+    """Thêm Order.account_id / Invoice.account_id (+ index) và gắn tài khoản cho dữ liệu cũ."""
+    from sqlalchemy.orm import Session
+    from .services.customers import link_customer_accounts
+
+    for table in ("orders", "invoices"):
+        conn.execute(text(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS account_id INTEGER "
+            f"REFERENCES accounts (id) ON DELETE SET NULL"
+        ))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_account_id ON {table} (account_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_accounts_ma_khach_hang ON accounts (ma_khach_hang)"))
+    link_customer_accounts(Session(bind=conn))
+
+
+def _account_tiers(conn: Connection):
+    """Backfill bảng account_tiers (bảng được tạo bởi create_all) từ hóa đơn đã thanh toán đã gắn tài khoản."""
+    from sqlalchemy.orm import Session
+    from .services.customers import rebuild_account_tiers
+
+    rebuild_account_tiers(Session(bind=conn))
+
+
+def _order_date_index(conn: Connection):
+    """Index Order.ngay_tao cho tổng hợp khách hàng theo khoảng ngày."""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_ngay_tao ON orders (ngay_tao)"))
+
+
+MIGRATIONS = [
+    ("0001_order_status_code", _order_status_code),
+    ("0002_invoice_paid_flag", _invoice_paid_flag),
+    ("0003_customer_balances", _customer_balances),
+    ("0004_daily_sales", _daily_sales),
+    ("0005_invoice_date_index", _invoice_date_index),
+    ("0006_customer_account_links", _customer_account_links),
+    ("0007_account_tiers", _account_tiers),
+    ("0008_order_date_index", _order_date_index),
+]
+
+
+def run_migrations(engine: Engine):
+    """Chạy các bước nâng cấp chưa được áp dụng, mỗi bước trong một transaction riêng."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars().all())
+
+    for version, step in MIGRATIONS:
+        if version in applied:
+            continue
+        log_info("MIGRATION", f"Đang áp dụng {version}")
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:v)"), {"v": version})
+        log_success("MIGRATION", f"Đã áp dụng {version}")
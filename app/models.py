@@ -1,7 +1,7 @@
 """
 Database models for PhanMemKeToan application
 """
-from sqlalchemy import Column, Integer, String, Float, Date, Boolean, Text, DateTime, func, Numeric, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, Boolean, Text, DateTime, func, Numeric, ForeignKey, Index, UniqueConstraint, text
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -30,7 +30,7 @@ class Account(Base):
     
     id = Column(Integer, primary_key=True)
     ten_tk = Column(String(100), nullable=False, index=True) # Tên khách hàng
-    ma_khach_hang = Column(String(20))  # Mã khách hàng
+    ma_khach_hang = Column(String(20), index=True)  # Mã khách hàng
     ngay_sinh = Column(Date)  # Ngày sinh khách hàng
     email = Column(String(120))
     so_dt = Column(String(20))
@@ -111,11 +111,17 @@ class Invoice(Base):
     
     id = Column(Integer, primary_key=True)
     so_hd = Column(String(50), unique=True, nullable=False, index=True)
-    ngay_hd = Column(Date, nullable=False)
+    ngay_hd = Column(Date, nullable=False, index=True)
     nguoi_mua = Column(String(100), nullable=False)
     tong_tien = Column(Float, nullable=False)
     trang_thai = Column(String(50), default='pending')
     hinh_thuc_tt = Column(String(50))  # Hình thức thanh toán: Tiền mặt, MoMo, Banking
+    da_thanh_toan = Column(Boolean, nullable=False, default=False, server_default=text('false'))  # Đồng bộ từ trang_thai khi tạo/sửa
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='SET NULL'), index=True)  # Khách hàng suy ra từ nguoi_mua
+    
+    __table_args__ = (
+        Index('ix_invoices_da_thanh_toan_ngay_hd', 'da_thanh_toan', 'ngay_hd'),
+    )
     
     # Relationship to invoice items
     items = relationship("InvoiceItem", back_populates="invoice", cascade="all, delete-orphan")
@@ -124,6 +130,148 @@ class Invoice(Base):
         return f"<Invoice(so_hd='{self.so_hd}')>"
 
 
+class InvoiceSequence(Base):
+    """Per-day invoice number counter (cấp số hóa đơn nguyên tử cho nhiều máy POS)"""
+    __tablename__ = 'invoice_sequences'
+    
+    ngay = Column(Date, primary_key=True)
+    so_cuoi = Column(Integer, nullable=False, default=0)  # Số thứ tự đã cấp gần nhất trong ngày
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<InvoiceSequence(ngay='{self.ngay}', so_cuoi={self.so_cuoi})>"
+
+
+class CustomerBalance(Base):
+    """Customer balance (công nợ) maintained by delta inside invoice transactions"""
+    __tablename__ = 'customer_balances'
+    
+    id = Column(Integer, primary_key=True)
+    nguoi_mua = Column(String(100), unique=True, nullable=False, index=True)  # Khớp với Invoice.nguoi_mua
+    tong_phat_sinh = Column(Float, nullable=False, default=0.0)  # Tổng tiền đã xuất hóa đơn
+    da_thanh_toan = Column(Float, nullable=False, default=0.0)  # Tổng tiền đã thanh toán
+    con_no = Column(Float, nullable=False, default=0.0, index=True)  # Còn nợ = tong_phat_sinh - da_thanh_toan
+    so_hd_chua_tt = Column(Integer, nullable=False, default=0)  # Số hóa đơn chưa thanh toán
+    ngay_thanh_toan_cuoi = Column(Date)  # Ngày thanh toán gần nhất
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<CustomerBalance(nguoi_mua='{self.nguoi_mua}', con_no={self.con_no})>"
+
+
+class AccountTier(Base):
+    """Lifetime spend and membership tier per account (paid invoices), maintained by delta"""
+    __tablename__ = 'account_tiers'
+    
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='CASCADE'), primary_key=True)
+    lifetime_spend = Column(Float, nullable=False, default=0.0, index=True)  # Tổng tiền hóa đơn đã thanh toán
+    total_quantity = Column(Integer, nullable=False, default=0)  # Tổng số lượng sản phẩm đã mua
+    invoice_count = Column(Integer, nullable=False, default=0)  # Số hóa đơn đã thanh toán
+    tier_level = Column(Integer, nullable=False, default=1)  # Hạng 1..5 (Đồng..Kim cương)
+    credit_limit = Column(Integer, nullable=False, default=0)  # Hạn mức theo hạng
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<AccountTier(account_id={self.account_id}, tier_level={self.tier_level})>"
+
+
+class DailySales(Base):
+    """Daily sales rollup (sản phẩm × ngày × hình thức thanh toán) of paid invoices, maintained by delta"""
+    __tablename__ = 'daily_sales'
+    
+    id = Column(Integer, primary_key=True)
+    ngay = Column(Date, nullable=False)  # Ngày hóa đơn
+    ma_sp = Column(String(20), nullable=False)  # Khớp với InvoiceItem.product_code
+    hinh_thuc_tt = Column(String(50), nullable=False, default='', server_default='')  # '' khi hóa đơn không ghi hình thức
+    ten_sp = Column(String(100))
+    so_luong = Column(Integer, nullable=False, default=0)  # Tổng số lượng bán
+    doanh_thu = Column(Float, nullable=False, default=0.0)  # Tổng thành tiền
+    don_gia = Column(Float)  # Đơn giá gần nhất
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    
+    __table_args__ = (
+        UniqueConstraint('ngay', 'ma_sp', 'hinh_thuc_tt', name='uq_daily_sales_ngay_ma_sp_hinh_thuc_tt'),
+        Index('ix_daily_sales_ma_sp_ngay', 'ma_sp', 'ngay'),
+    )
+    
+    def __repr__(self):
+        return f"<DailySales(ngay='{self.ngay}', ma_sp='{self.ma_sp}', so_luong={self.so_luong})>"
+
+
+class ReorderSnapshot(Base):
+    """Reorder / low-stock snapshot per product, rewritten by the periodic refresh job and read by the chatbot"""
+    __tablename__ = 'reorder_snapshots'
+
+    id = Column(Integer, primary_key=True)
+    ma_sp = Column(String(20), nullable=False, unique=True)
+    ten_sp = Column(String(100))
+    vi_tri = Column(Integer, nullable=False)  # Thứ tự sản phẩm (theo Product.id)
+    current_stock = Column(Integer, nullable=False, default=0)
+    gia_nhap = Column(Float, nullable=False, default=0.0)
+    sales_rate = Column(Float, nullable=False, default=0.0)  # Số lượng bán trung bình mỗi ngày
+    days_until_out = Column(Integer)  # NULL khi chưa có doanh số (N/A)
+    recommended_quantity = Column(Integer, nullable=False, default=0)
+    high_priority = Column(Boolean, nullable=False, default=False)
+    is_best_seller = Column(Boolean, nullable=False, default=False)
+    is_low_stock = Column(Boolean, nullable=False, default=False)  # Tồn kho ≤ ngưỡng cảnh báo lúc làm mới
+    candidate_rank = Column(Integer)  # Thứ tự đề xuất đặt hàng, NULL nếu không cần đặt
+    refreshed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_reorder_snapshots_candidate_rank', 'candidate_rank'),
+        Index('ix_reorder_snapshots_is_low_stock_vi_tri', 'is_low_stock', 'vi_tri'),
+    )
+
+    def __repr__(self):
+        return f"<ReorderSnapshot(ma_sp='{self.ma_sp}', candidate_rank={self.candidate_rank})>"
+
+
+class ProductForecast(Base):
+    """Demand forecast per product (Holt-Winters / Croston), recomputed in batch from daily sales history"""
+    __tablename__ = 'product_forecasts'
+
+    id = Column(Integer, primary_key=True)
+    ma_sp = Column(String(20), nullable=False, unique=True)
+    method = Column(String(20), nullable=False)  # holt_winters, croston, none (chưa có doanh số)
+    forecast_daily = Column(Float, nullable=False, default=0.0)  # Nhu cầu dự báo trung bình mỗi ngày
+    forecast_horizon = Column(Float, nullable=False, default=0.0)  # Tổng nhu cầu dự báo trong kỳ dự báo
+    demand_std = Column(Float, nullable=False, default=0.0)  # Độ lệch chuẩn sai số dự báo một ngày
+    lead_time_demand = Column(Float, nullable=False, default=0.0)  # Nhu cầu trong thời gian chờ hàng
+    safety_stock = Column(Float, nullable=False, default=0.0)
+    reorder_point = Column(Float, nullable=False, default=0.0)  # Tồn kho ≤ mức này thì cần đặt hàng
+    history_days = Column(Integer, nullable=False, default=0)
+    computed_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<ProductForecast(ma_sp='{self.ma_sp}', method='{self.method}', reorder_point={self.reorder_point})>"
+
+
+class CustomerSegment(Base):
+    """RFM scores and segment per customer (paid invoices), recomputed in batch"""
+    __tablename__ = 'customer_segments'
+
+    id = Column(Integer, primary_key=True)
+    nguoi_mua = Column(String(100), nullable=False, unique=True)  # Khớp với Invoice.nguoi_mua
+    account_id = Column(Integer, index=True)  # Tài khoản đã gắn với hóa đơn (nếu có)
+    last_purchase = Column(Date)  # Ngày hóa đơn đã thanh toán gần nhất
+    recency_days = Column(Integer, nullable=False, default=0)
+    frequency = Column(Integer, nullable=False, default=0)  # Số hóa đơn đã thanh toán
+    monetary = Column(Float, nullable=False, default=0.0)  # Tổng tiền đã thanh toán
+    r_score = Column(Integer, nullable=False)  # 1..5, mua càng gần điểm càng cao
+    f_score = Column(Integer, nullable=False)
+    m_score = Column(Integer, nullable=False)
+    rfm_score = Column(String(3), nullable=False)  # Ví dụ '545'
+    segment = Column(String(30), nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_customer_segments_segment_monetary', 'segment', 'monetary'),
+    )
+
+    def __repr__(self):
+        return f"<CustomerSegment(nguoi_mua='{self.nguoi_mua}', segment='{self.segment}')>"
+
+
 class InvoiceItem(Base):
     """Invoice item model for invoice details"""
     __tablename__ = 'invoice_items'
@@ -153,12 +301,14 @@ class Order(Base):
     ma_don_hang = Column(String(50), unique=True, nullable=False, index=True)
     thong_tin_kh = Column(String(255))
     sp_banggia = Column(String(100))  # Mã sản phẩm hoặc mã bảng giá
-    ngay_tao = Column(Date, nullable=False)
+    ngay_tao = Column(Date, nullable=False, index=True)
     so_luong = Column(Integer, default=1)
     tong_tien = Column(Float, default=0.0)
     ma_co_quan_thue = Column(String(50))
     # hinh_thuc_tt = Column(String(50))  # Removed - no longer used
-    trang_thai = Column(String(50), default='pending')
+    trang_thai = Column(String(50), default='pending')  # Chỉ dùng để hiển thị
+    ma_trang_thai = Column(String(20), default='cho_xu_ly', index=True)  # cho_xu_ly, dang_xu_ly, hoan_thanh, da_huy, khac
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete='SET NULL'), index=True)  # Khách hàng suy ra từ thong_tin_kh
     
     def __repr__(self):
         return f"<Order(ma_don_hang='{self.ma_don_hang}')>"
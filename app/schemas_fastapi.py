@@ -270,6 +270,8 @@ class OrderOut(BaseModel):
     so_luong: Optional[int]
     tong_tien: Optional[float]
     trang_thai: Optional[str]
+    ma_trang_thai: Optional[str] = None
+    account_id: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -284,6 +286,7 @@ class OrderCreate(BaseModel):
     so_luong: Optional[int] = 1
     tong_tien: Optional[float] = 0
     trang_thai: Optional[str] = None
+    account_id: Optional[int] = None  # Không gửi thì suy ra từ thong_tin_kh
 
 
 class OrderUpdate(BaseModel):
@@ -295,6 +298,7 @@ class OrderUpdate(BaseModel):
     so_luong: Optional[int] = None
     tong_tien: Optional[float] = None
     trang_thai: Optional[str] = None
+    account_id: Optional[int] = None
 
 
 class OrderItemCreate(BaseModel):
@@ -314,6 +318,8 @@ class InvoiceOut(BaseModel):
     tong_tien: Optional[float]
     trang_thai: Optional[str]
     hinh_thuc_tt: Optional[str] = None
+    da_thanh_toan: Optional[bool] = None
+    account_id: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -343,12 +349,13 @@ class InvoiceItemOut(BaseModel):
 
 
 class InvoiceCreate(BaseModel):
-    so_hd: str
+    so_hd: Optional[str] = None  # Không gửi thì cấp số tiếp theo của ngày khi tạo
     ngay_hd: date
     nguoi_mua: str
     tong_tien: float
     trang_thai: Optional[str] = 'Đã thanh toán'
     hinh_thuc_tt: Optional[str] = None
+    account_id: Optional[int] = None  # Không gửi thì suy ra từ nguoi_mua
     items: Optional[list[InvoiceItemCreate]] = []  # List of invoice items
 
 
@@ -359,6 +366,7 @@ class InvoiceUpdate(BaseModel):
     tong_tien: Optional[float] = None
     trang_thai: Optional[str] = None
     hinh_thuc_tt: Optional[str] = None
+    account_id: Optional[int] = None
 
 
 # Area schemas
@@ -1,188 +1,503 @@
 # Backend/app/services/customers.py
+from bisect import bisect_right
+from datetime import date, datetime
+from difflib import SequenceMatcher, get_close_matches
+from fastapi import HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from ..models import Account, Order, Invoice, InvoiceItem
+from sqlalchemy import func, select, update, insert, delete, case, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from ..models import Account, AccountTier, Order, Invoice, InvoiceItem, CustomerBalance
+from .normalize import normalize_text
+from .invoices import invoice_sales_lines
+from .report_cache import bump_data_version
+from ..logger import log_info
+
+WALK_IN_CUSTOMER = 'Khách vãng lai'
+FUZZY_NAME_CUTOFF = 0.8  # Độ giống tối thiểu để gợi ý tài khoản cho tên khách hàng chưa khớp
+FUZZY_SUGGESTION_LIMIT = 200  # Số tên chưa khớp tối đa được gợi ý trong một lần gắn tài khoản
 
 def safe_name(name: str | None) -> str:
-    return (name or '').strip() or 'Khách vãng lai'
+    return (name or '').strip() or WALK_IN_CUSTOMER
 
-def calc_customer_tier(total_amount: float) -> dict:
-    """Tính phân hạng tier cho khách hàng dựa trên tổng chi tiêu."""
-    labels = [
-        {'name': 'Đồng', 'color': '#cd7f32'},
-        {'name': 'Bạc', 'color': '#bcc6cc'},
-        {'name': 'Vàng', 'color': '#ffd700'},
-        {'name': 'Bạch kim', 'color': '#e5e4e2'},
-        {'name': 'Kim cương', 'color': '#00e5ee'},
-    ]
+TIER_LABELS = [
+    {'name': 'Đồng', 'color': '#cd7f32'},
+    {'name': 'Bạc', 'color': '#bcc6cc'},
+    {'name': 'Vàng', 'color': '#ffd700'},
+    {'name': 'Bạch kim', 'color': '#e5e4e2'},
+    {'name': 'Kim cương', 'color': '#00e5ee'},
+]
+
+
+def _tier_thresholds() -> list[int]:
+    """Mức chi tiêu tối thiểu của từng hạng: 0, 30 triệu, rồi mỗi hạng sau = hạng trước + 10 triệu + 50%."""
     thresholds = [0, 30000000]
-    for i in range(2, len(labels)):
+    for i in range(2, len(TIER_LABELS)):
         prev = thresholds[i-1]
         thresholds.append(prev + 10_000_000 + int(prev * 0.5))
-    for i in reversed(range(len(thresholds))):
-        if total_amount >= thresholds[i]:
-            return { 'tierName': labels[i]['name'], 'tierColor': labels[i]['color'], 'tierLevel': i+1, 'tierMinAmount': thresholds[i] }
-    return { 'tierName': labels[0]['name'], 'tierColor': labels[0]['color'], 'tierLevel': 1, 'tierMinAmount': thresholds[0] }
-
-def customer_aggregates(db: Session):
-    """Trả về tổng hợp theo khách hàng: orders count, total quantity, total amount, debt..."""
-    order_rows = (
-        db.query(
-            Order.thong_tin_kh.label('customer_name'),
+    return thresholds
+
+
+def _tier_credit_limits() -> list[int]:
+    """Hạn mức theo hạng: khoảng cách tới hạng tiếp theo; hạng cao nhất gấp đôi mức tối thiểu."""
+    limits = [10_000_000 + int(minimum * 0.5) for minimum in TIER_THRESHOLDS[:-1]]
+    limits.append(TIER_THRESHOLDS[-1] * 2)
+    return limits
+
+
+TIER_THRESHOLDS = _tier_thresholds()
+TIER_CREDIT_LIMITS = _tier_credit_limits()
+
+
+def tier_level(total_amount: float) -> int:
+    """Hạng (1..5) theo tổng chi tiêu, tìm nhị phân trên TIER_THRESHOLDS."""
+    return max(bisect_right(TIER_THRESHOLDS, total_amount or 0), 1)
+
+
+def tier_info(level: int) -> dict:
+    label = TIER_LABELS[level - 1]
+    return {'tierName': label['name'], 'tierColor': label['color'], 'tierLevel': level, 'tierMinAmount': TIER_THRESHOLDS[level - 1]}
+
+
+def calc_customer_tier(total_amount: float) -> dict:
+    """Tính phân hạng tier cho khách hàng dựa trên tổng chi tiêu."""
+    return tier_info(tier_level(total_amount))
+
+
+def tier_level_sql(spend):
+    """Biểu thức SQL tính hạng từ tổng chi tiêu (cùng ngưỡng với tier_level)."""
+    return case(
+        *[(spend >= TIER_THRESHOLDS[i], i + 1) for i in reversed(range(1, len(TIER_THRESHOLDS)))],
+        else_=1,
+    )
+
+
+def tier_credit_limit_sql(spend):
+    """Biểu thức SQL tính hạn mức từ tổng chi tiêu (cùng ngưỡng với tier_level)."""
+    return case(
+        *[(spend >= TIER_THRESHOLDS[i], TIER_CREDIT_LIMITS[i]) for i in reversed(range(1, len(TIER_THRESHOLDS)))],
+        else_=TIER_CREDIT_LIMITS[0],
+    )
+
+def apply_account_tier(db: Session, inv: Invoice, sign: int = 1, lines: list[tuple] | None = None):
+    """Cộng (sign=1) hoặc gỡ (sign=-1) một hóa đơn đã thanh toán vào account_tiers của khách hàng.
+
+    `lines` dạng invoice_sales_lines (chỉ dùng so_luong); bỏ trống thì đọc từ invoice_items.
+    Hạng và hạn mức được tính lại ngay trong câu INSERT ... ON CONFLICT DO UPDATE từ tổng chi tiêu mới.
+    Caller chịu trách nhiệm commit.
+    """
+    if not inv.da_thanh_toan or not inv.account_id:
+        return
+    if lines is None:
+        lines = invoice_sales_lines(db, inv.id)
+    spend = float(inv.tong_tien or 0) * sign
+    quantity = sum(int(line[2] or 0) for line in lines) * sign
+
+    stmt = pg_insert(AccountTier).values(
+        account_id=inv.account_id,
+        lifetime_spend=spend,
+        total_quantity=quantity,
+        invoice_count=sign,
+        tier_level=tier_level(spend),
+        credit_limit=TIER_CREDIT_LIMITS[tier_level(spend) - 1],
+    )
+    new_spend = AccountTier.lifetime_spend + stmt.excluded.lifetime_spend
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[AccountTier.account_id],
+        set_={
+            "lifetime_spend": new_spend,
+            "total_quantity": AccountTier.total_quantity + stmt.excluded.total_quantity,
+            "invoice_count": AccountTier.invoice_count + stmt.excluded.invoice_count,
+            "tier_level": tier_level_sql(new_spend),
+            "credit_limit": tier_credit_limit_sql(new_spend),
+            "updated_at": func.now(),
+        },
+    ))
+
+
+def rebuild_account_tiers(db: Session, account_ids: list[int] | None = None) -> int:
+    """Tính lại account_tiers từ hóa đơn đã thanh toán bằng một câu INSERT ... SELECT (backfill).
+
+    `account_ids` giới hạn việc tính lại cho một số tài khoản (vd. vừa được gắn hóa đơn cũ).
+    """
+    item_qty = (
+        select(InvoiceItem.invoice_id, func.sum(InvoiceItem.so_luong).label('so_luong'))
+        .group_by(InvoiceItem.invoice_id)
+        .subquery()
+    )
+    spend = func.coalesce(func.sum(Invoice.tong_tien), 0.0)
+    source = (
+        select(
+            Invoice.account_id,
+            spend,
+            func.coalesce(func.sum(item_qty.c.so_luong), 0),
+            func.count(Invoice.id),
+            tier_level_sql(spend),
+            tier_credit_limit_sql(spend),
+        )
+        .outerjoin(item_qty, item_qty.c.invoice_id == Invoice.id)
+        .where(Invoice.da_thanh_toan == true(), Invoice.account_id.isnot(None))
+        .group_by(Invoice.account_id)
+    )
+    clear = delete(AccountTier)
+    if account_ids is not None:
+        if not account_ids:
+            return 0
+        source = source.where(Invoice.account_id.in_(account_ids))
+        clear = clear.where(AccountTier.account_id.in_(account_ids))
+    db.execute(clear.execution_options(synchronize_session=False))
+    result = db.execute(
+        insert(AccountTier).from_select(
+            ["account_id", "lifetime_spend", "total_quantity", "invoice_count", "tier_level", "credit_limit"],
+            source,
+        )
+    )
+    return result.rowcount or 0
+
+
+def _customer_key_sql(column):
+    """Tên khách hàng dùng để gom nhóm, giống safe_name(): rỗng / NULL là khách vãng lai."""
+    return func.coalesce(func.nullif(func.trim(column), ''), WALK_IN_CUSTOMER)
+
+
+AGGREGATE_SORT_KEYS = ('amount', 'debt', 'order_count', 'quantity')
+
+
+def _parse_date(value: str | None, field: str) -> date | None:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{field} không hợp lệ (YYYY-MM-DD): {value}")
+
+
+def customer_aggregates(
+    db: Session,
+    from_date: str | None = None,
+    to_date: str | None = None,
+    tier: int | None = None,
+    sort_by: str = 'amount',
+    order: str = 'desc',
+    skip: int = 0,
+    limit: int | None = 50,
+    top: int | None = None,
+) -> dict:
+    """Tổng hợp theo khách hàng: số đơn, tổng số lượng, tổng tiền, công nợ, hạng.
+
+    Gom nhóm, lọc (khoảng ngày đơn hàng, hạng), sắp xếp và phân trang đều chạy trong database;
+    tổng số khách hàng khớp bộ lọc lấy bằng window function trong cùng câu truy vấn.
+    Tên khách hàng được chuẩn hóa như safe_name() ở cả hai phía của phép join.
+    Đã thanh toán lấy từ customer_balances, hoặc từ hóa đơn đã thanh toán trong khoảng ngày nếu có lọc ngày.
+    """
+    if sort_by not in AGGREGATE_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"Không hỗ trợ sắp xếp theo: {sort_by}")
+    start, end = _parse_date(from_date, 'from_date'), _parse_date(to_date, 'to_date')
+
+    order_filters = []
+    customer_key = _customer_key_sql(Order.thong_tin_kh)
+    if start:
+        order_filters.append(Order.ngay_tao >= start)
+    if end:
+        order_filters.append(Order.ngay_tao <= end)
+    orders = (
+        select(
+            customer_key.label('customer_name'),
             func.count(Order.id).label('order_count'),
             func.coalesce(func.sum(Order.so_luong), 0).label('total_quantity'),
             func.coalesce(func.sum(Order.tong_tien), 0.0).label('total_amount'),
-        ).group_by(Order.thong_tin_kh)
-         .all()
+            func.max(Order.account_id).label('account_id'),
+        )
+        .where(*order_filters)
+        .group_by(customer_key)
+        .subquery()
     )
-    paid_rows = (
+
+    if start or end:
+        invoice_filters = [Invoice.da_thanh_toan == true()]
+        if start:
+            invoice_filters.append(Invoice.ngay_hd >= start)
+        if end:
+            invoice_filters.append(Invoice.ngay_hd <= end)
+        paid_key = _customer_key_sql(Invoice.nguoi_mua)
+        paid = (
+            select(paid_key.label('customer_name'), func.sum(Invoice.tong_tien).label('paid'))
+            .where(*invoice_filters)
+            .group_by(paid_key)
+            .subquery()
+        )
+    else:
+        paid_key = _customer_key_sql(CustomerBalance.nguoi_mua)
+        paid = (
+            select(paid_key.label('customer_name'), func.sum(CustomerBalance.da_thanh_toan).label('paid'))
+            .group_by(paid_key)
+            .subquery()
+        )
+
+    paid_amount = func.coalesce(paid.c.paid, 0.0)
+    debt = case((orders.c.total_amount > paid_amount, orders.c.total_amount - paid_amount), else_=0.0)
+    level = func.coalesce(AccountTier.tier_level, 1)
+    sort_columns = {
+        'amount': orders.c.total_amount,
+        'debt': debt,
+        'order_count': orders.c.order_count,
+        'quantity': orders.c.total_quantity,
+    }
+    sort_column = sort_columns[sort_by]
+
+    query = (
         db.query(
-            Invoice.nguoi_mua.label('customer_name'),
-            func.coalesce(func.sum(Invoice.tong_tien), 0.0).label('paid_amount')
-        ).filter(Invoice.trang_thai.ilike('%đã thanh toán%'))
-         .group_by(Invoice.nguoi_mua)
-         .all()
+            orders.c.customer_name,
+            orders.c.account_id,
+            orders.c.order_count,
+            orders.c.total_quantity,
+            orders.c.total_amount,
+            debt.label('total_debt'),
+            level.label('tier_level'),
+            func.count().over().label('total'),
+        )
+        .outerjoin(paid, paid.c.customer_name == orders.c.customer_name)
+        .outerjoin(AccountTier, AccountTier.account_id == orders.c.account_id)
+        .order_by(sort_column.asc() if order.lower() == 'asc' else sort_column.desc(), orders.c.customer_name)
     )
-    paid_map = { safe_name(r.customer_name): float(r.paid_amount or 0) for r in paid_rows }
-    results = []
-    for r in order_rows:
-        name = safe_name(r.customer_name)
-        total_amount = float(r.total_amount or 0)
-        paid = paid_map.get(name, 0.0)
-        debt = max(total_amount - paid, 0.0)
-        results.append({
-            'customerName': name,
+    if tier is not None:
+        query = query.filter(level == tier)
+
+    # top giới hạn phạm vi xếp hạng, skip/limit phân trang bên trong phạm vi đó
+    if top is not None:
+        remaining = max(top - skip, 0)
+        limit = min(limit, remaining) if limit is not None else remaining
+    if skip:
+        query = query.offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = query.all()
+
+    if rows:
+        total = int(rows[0].total)
+    else:
+        total = query.limit(None).offset(None).order_by(None).count() if skip else 0
+    if top is not None:
+        total = min(total, top)
+
+    items = []
+    for r in rows:
+        info = tier_info(int(r.tier_level))
+        items.append({
+            'customerName': safe_name(r.customer_name),
+            'customerId': r.account_id,
             'orderCount': int(r.order_count or 0),
             'totalQuantity': int(r.total_quantity or 0),
-            'totalAmount': total_amount,
-            'totalDebt': debt,
+            'totalAmount': float(r.total_amount or 0),
+            'totalDebt': float(r.total_debt or 0),
+            'tierLevel': info['tierLevel'],
+            'tierName': info['tierName'],
+            'tierColor': info['tierColor'],
         })
-    return results
+    return {"total": total, "items": items}
+
+class CustomerResolver:
+    """Ánh xạ thông tin khách hàng dạng chữ (Order.thong_tin_kh, Invoice.nguoi_mua) sang Account.id.
+
+    Thứ tự khớp: đúng tên, đúng mã khách hàng, tên đã chuẩn hóa (bỏ dấu, chữ thường),
+    rồi mã khách hàng xuất hiện trong chuỗi ('Nguyễn Văn A - KH001').
+    Nhiều tài khoản trùng tên thì lấy tài khoản có id nhỏ nhất.
+
+    Tên gần giống không bao giờ được gắn tự động: tên người / công ty tiếng Việt thường chỉ
+    khác nhau một âm tiết ('Nguyễn Văn An' / 'Nguyễn Văn Anh'), nên suggest() chỉ trả về gợi ý.
+    """
+
+    def __init__(self, accounts):
+        self.by_name: dict = {}
+        self.by_code: dict = {}
+        self.by_normalized: dict = {}
+        self.names: dict = {}
+        for account_id, ten_tk, ma_khach_hang in sorted(accounts, key=lambda a: a[0]):
+            name = (ten_tk or '').strip()
+            code = normalize_text(ma_khach_hang)
+            if name:
+                self.names.setdefault(account_id, name)
+                self.by_name.setdefault(name, account_id)
+                self.by_normalized.setdefault(normalize_text(name), account_id)
+            if code:
+                self.by_code.setdefault(code, account_id)
+        self._normalized_names = list(self.by_normalized)
+
+    def resolve(self, text: str | None) -> tuple[int | None, str | None]:
+        """(account_id, cách khớp) hoặc (None, None) nếu không khớp chắc chắn tài khoản nào."""
+        raw = (text or '').strip()
+        if not raw or raw == WALK_IN_CUSTOMER:
+            return None, None
+        if raw in self.by_name:
+            return self.by_name[raw], 'exact'
+        normalized = normalize_text(raw)
+        if normalized in self.by_code:
+            return self.by_code[normalized], 'code'
+        if normalized in self.by_normalized:
+            return self.by_normalized[normalized], 'normalized'
+        for token in normalized.replace('-', ' ').replace('(', ' ').replace(')', ' ').split():
+            if token in self.by_code:
+                return self.by_code[token], 'code'
+        return None, None
+
+    def suggest(self, text: str | None, n: int = 3) -> list[dict]:
+        """Các tài khoản có tên gần giống `text` (để người dùng xác nhận), giống nhất trước."""
+        normalized = normalize_text(text)
+        if not normalized:
+            return []
+        matches = get_close_matches(normalized, self._normalized_names, n=n, cutoff=FUZZY_NAME_CUTOFF)
+        suggestions = []
+        for match in matches:
+            account_id = self.by_normalized[match]
+            suggestions.append({
+                'accountId': account_id,
+                'name': self.names.get(account_id),
+                'score': round(SequenceMatcher(None, normalized, match).ratio(), 3),
+            })
+        return suggestions
+
+
+def resolve_account_id(db: Session, text: str | None) -> int | None:
+    """Tài khoản khớp đúng tên hoặc đúng mã khách hàng (dùng khi ghi đơn hàng / hóa đơn).
+
+    Các dòng không khớp được link_customer_accounts() xử lý sau (tên chuẩn hóa, mã trong chuỗi).
+    """
+    raw = (text or '').strip()
+    if not raw or raw == WALK_IN_CUSTOMER:
+        return None
+    account_id = db.query(func.min(Account.id)).filter(Account.ten_tk == raw).scalar()
+    if account_id is None:
+        account_id = db.query(func.min(Account.id)).filter(Account.ma_khach_hang == raw).scalar()
+    return account_id
+
+
+def customer_account_id(db: Session, account_id: int | None, text: str | None) -> int | None:
+    """account_id được gửi kèm (phải tồn tại) hoặc tài khoản suy ra từ tên khách hàng."""
+    if account_id is not None:
+        if not db.query(Account.id).filter(Account.id == account_id).first():
+            raise HTTPException(status_code=400, detail=f"Không tìm thấy khách hàng id={account_id}")
+        return account_id
+    return resolve_account_id(db, text)
+
+
+def link_customer_accounts(db: Session, suggest: bool = False) -> dict:
+    """Gán account_id cho đơn hàng / hóa đơn chưa có, rồi tính lại account_tiers của các tài khoản vừa gắn (caller commit).
+
+    Mỗi chuỗi khách hàng khác nhau chỉ được khớp một lần; các dòng cùng tài khoản được cập nhật
+    bằng một câu UPDATE ... WHERE text IN (...). Chỉ gắn các khớp chắc chắn (CustomerResolver.resolve);
+    với `suggest=True`, các tên chưa khớp kèm tài khoản gần giống được trả về trong "suggestions".
+    """
+    resolver = CustomerResolver(db.execute(select(Account.id, Account.ten_tk, Account.ma_khach_hang)).all())
+    result = {}
+    for table, column in (("orders", Order.thong_tin_kh), ("invoices", Invoice.nguoi_mua)):
+        model = column.class_
+        texts = db.execute(
+            select(column).where(model.account_id.is_(None), column.isnot(None)).distinct()
+        ).scalars().all()
+        texts_by_account: dict = {}
+        methods: dict = {}
+        unmatched = []
+        for text in texts:
+            account_id, method = resolver.resolve(text)
+            if account_id is not None:
+                texts_by_account.setdefault(account_id, []).append(text)
+                methods[method] = methods.get(method, 0) + 1
+            else:
+                unmatched.append(text)
+        linked = 0
+        for account_id, matched in texts_by_account.items():
+            linked += db.execute(
+                update(model)
+                .where(model.account_id.is_(None), column.in_(matched))
+                .values(account_id=account_id)
+                .execution_options(synchronize_session=False)
+            ).rowcount or 0
+        result[table] = {"linked_rows": linked, "unmatched_names": len(unmatched), "matched_by": methods}
+        if suggest:
+            suggestions = []
+            for text in unmatched:
+                if len(suggestions) >= FUZZY_SUGGESTION_LIMIT:
+                    break
+                candidates = resolver.suggest(text)
+                if candidates:
+                    suggestions.append({"name": text, "candidates": candidates})
+            result[table]["suggestions"] = suggestions
+        if table == "invoices" and texts_by_account:
+            # Hóa đơn cũ vừa được gắn: tính lại hạng của các tài khoản đó
+            rebuild_account_tiers(db, list(texts_by_account))
+    return result
+
+
+def customer_link_job(db: Session):
+    """Job định kỳ của scheduler: gắn tài khoản cho đơn hàng / hóa đơn mới chưa khớp (vd. tài khoản tạo sau)."""
+    result = link_customer_accounts(db)
+    db.commit()
+    linked = result["orders"]["linked_rows"] + result["invoices"]["linked_rows"]
+    if linked:
+        bump_data_version()
+        log_info("CUSTOMER_LINK", f"Đã gắn tài khoản cho {linked} đơn hàng / hóa đơn")
+
 
 def customer_leaderboard(db: Session, limit: int = 100):
     """Leaderboard by total amount spent from paid invoices, combined with customer info from Account.
-    Chỉ hiển thị khách hàng có tài khoản trong Account (loại bỏ khách vãng lai)."""
-    # Lấy tất cả khách hàng từ Account trước
-    accounts = db.query(Account).all()
-    account_map = {acc.ten_tk: acc for acc in accounts}
+    Chỉ hiển thị khách hàng có tài khoản trong Account (hóa đơn đã gắn account_id, loại bỏ khách vãng lai).
     
-    # Chỉ lấy các tên khách hàng có trong Account
-    valid_customer_names = set(account_map.keys())
-    
-    # Lấy dữ liệu từ các hóa đơn đã thanh toán, chỉ lấy khách hàng có trong Account
-    paid_invoices = (
-        db.query(
-            Invoice.nguoi_mua.label('customer_name'),
-            func.coalesce(func.sum(Invoice.tong_tien), 0.0).label('total_amount'),
-            func.coalesce(func.sum(InvoiceItem.so_luong), 0).label('total_quantity'),
-            func.count(Invoice.id).label('invoice_count'),
-        )
-        .outerjoin(InvoiceItem, Invoice.id == InvoiceItem.invoice_id)
-        .filter(Invoice.trang_thai.ilike('%đã thanh toán%'))
-        .filter(Invoice.nguoi_mua.in_(valid_customer_names))  # Chỉ lấy khách hàng có trong Account
-        .group_by(Invoice.nguoi_mua)
-        .order_by(func.coalesce(func.sum(Invoice.tong_tien), 0.0).desc())
+    Đọc bảng account_tiers (cập nhật theo từng hóa đơn đã thanh toán) theo index lifetime_spend."""
+    rows = (
+        db.query(AccountTier, Account)
+        .join(Account, Account.id == AccountTier.account_id)
+        .filter(AccountTier.invoice_count > 0)
+        .order_by(AccountTier.lifetime_spend.desc(), AccountTier.account_id)
         .limit(limit)
         .all()
     )
     
     results = []
-    for inv in paid_invoices:
-        customer_name = safe_name(inv.customer_name)
-        
-        # Bỏ qua nếu là "Khách vãng lai" hoặc không có trong Account
-        if customer_name == 'Khách vãng lai' or customer_name not in account_map:
-            continue
-        
-        account = account_map.get(customer_name)
-        if not account:  # Đảm bảo account tồn tại
-            continue
-        
-        total_spent = float(inv.total_amount or 0)
-        
-        # Tính hạn mức thành viên dựa trên tier
-        tier_info = calc_customer_tier(total_spent)
-        tier_level = tier_info.get('tierLevel', 1)
-        tier_min = tier_info.get('tierMinAmount', 0)
-        
-        # Tính hạn mức: tier tiếp theo - tier hiện tại
-        if tier_level < 5:  # Chưa phải kim cương
-            next_tier_min = tier_min + 10_000_000 + int(tier_min * 0.5)
-            credit_limit = next_tier_min - tier_min
-        else:  # Kim cương - hạn mức cao
-            credit_limit = tier_min * 2
-        
+    for tier, account in rows:
+        info = tier_info(tier.tier_level)
         results.append({
-            'customerName': customer_name,
+            'customerName': safe_name(account.ten_tk),
             'customerId': account.id,
-            'customerCode': account.ma_khach_hang if account else None,
-            'email': account.email if account else None,
-            'phone': account.so_dt if account else None,
-            'totalAmount': total_spent,
-            'totalQuantity': int(inv.total_quantity or 0),
-            'invoiceCount': int(inv.invoice_count or 0),
-            'creditLimit': credit_limit,
-            'tierName': tier_info.get('tierName', 'Đồng'),
-            'tierColor': tier_info.get('tierColor', '#cd7f32'),
-            'tierLevel': tier_level,
+            'customerCode': account.ma_khach_hang,
+            'email': account.email,
+            'phone': account.so_dt,
+            'totalAmount': float(tier.lifetime_spend or 0),
+            'totalQuantity': int(tier.total_quantity or 0),
+            'invoiceCount': int(tier.invoice_count or 0),
+            'creditLimit': tier.credit_limit,
+            'tierName': info['tierName'],
+            'tierColor': info['tierColor'],
+            'tierLevel': tier.tier_level,
         })
     
     return results
 
 def customer_debts_from_invoices(db: Session):
-    """Lấy công nợ từ các hóa đơn chưa thanh toán, kết hợp với thông tin khách hàng từ Account."""
-    # Lấy các hóa đơn chưa thanh toán
-    unpaid_invoices = (
-        db.query(
-            Invoice.nguoi_mua.label('customer_name'),
-            func.count(Invoice.id).label('invoice_count'),
-            func.coalesce(func.sum(Invoice.tong_tien), 0.0).label('total_debt'),
-            func.coalesce(func.sum(InvoiceItem.so_luong), 0).label('total_quantity'),
-        )
-        .outerjoin(InvoiceItem, Invoice.id == InvoiceItem.invoice_id)
-        .filter(~Invoice.trang_thai.ilike('%đã thanh toán%'))
-        .group_by(Invoice.nguoi_mua)
+    """Lấy công nợ từ bảng customer_balances (cập nhật theo từng hóa đơn), kết hợp với thông tin khách hàng từ Account."""
+    rows = (
+        db.query(CustomerBalance, Account)
+        .outerjoin(Account, Account.ten_tk == CustomerBalance.nguoi_mua)
+        .filter(CustomerBalance.con_no > 0)
+        .order_by(CustomerBalance.con_no.desc())
         .all()
     )
     
-    # Lấy tất cả khách hàng từ Account
-    accounts = db.query(Account).all()
-    account_map = {acc.ten_tk: acc for acc in accounts}
-    
-    # Tính tổng chi tiêu từ các hóa đơn đã thanh toán để tính hạn mức
-    paid_invoices = (
-        db.query(
-            Invoice.nguoi_mua.label('customer_name'),
-            func.coalesce(func.sum(Invoice.tong_tien), 0.0).label('total_spent')
-        )
-        .filter(Invoice.trang_thai.ilike('%đã thanh toán%'))
-        .group_by(Invoice.nguoi_mua)
-        .all()
-    )
-    spent_map = {safe_name(r.customer_name): float(r.total_spent or 0) for r in paid_invoices}
-    
     results = []
-    for inv in unpaid_invoices:
-        customer_name = safe_name(inv.customer_name)
-        account = account_map.get(customer_name)
-        total_debt = float(inv.total_debt or 0)
-        
-        # Chỉ thêm khách hàng có công nợ > 0
-        if total_debt <= 0:
+    seen = set()
+    for balance, account in rows:
+        # Nhiều Account trùng tên: chỉ lấy dòng đầu tiên cho mỗi khách hàng
+        if balance.id in seen:
             continue
-        
+        seen.add(balance.id)
         results.append({
-            'customerName': customer_name,
+            'customerName': safe_name(balance.nguoi_mua),
             'customerId': account.id if account else None,
             'customerCode': account.ma_khach_hang if account else None,
             'email': account.email if account else None,
             'phone': account.so_dt if account else None,
             'address': account.dia_chi if account else None,
-            'invoiceCount': int(inv.invoice_count or 0),
-            'totalDebt': total_debt,
+            'invoiceCount': int(balance.so_hd_chua_tt or 0),
+            'totalDebt': float(balance.con_no or 0),
+            'lastPaymentDate': balance.ngay_thanh_toan_cuoi.isoformat() if balance.ngay_thanh_toan_cuoi else None,
         })
     
-    # Sắp xếp theo công nợ giảm dần
-    results.sort(key=lambda x: x['totalDebt'], reverse=True)
-    
     return results
@@ -1,7 +1,9 @@
 # Backend/app/services/discounts.py
 from datetime import datetime
 from sqlalchemy.orm import Session
+from sqlalchemy import update
 from ..models import DiscountCode
+from ..logger import log_info
 
 def is_expired(code: DiscountCode) -> bool:
     return code.end_date and code.end_date < datetime.now()
@@ -28,3 +30,31 @@ def compute_discount_amount(code: DiscountCode, order_value: float) -> float:
     if code.discount_type == 'percentage':
         return order_value * (code.discount_value / 100)
     return min(float(code.discount_value), float(order_value))
+
+def sweep_discount_statuses(db: Session, now: datetime | None = None) -> dict:
+    """Cập nhật trạng thái mã giảm giá theo ngày bằng hai câu UPDATE hàng loạt (caller commit).
+
+    - Hết hạn (end_date < now) mà chưa 'expired' -> 'expired'
+    - 'inactive' đã tới start_date và chưa hết hạn -> 'active'
+    """
+    now = now or datetime.now()
+    expired = db.execute(
+        update(DiscountCode)
+        .where(DiscountCode.end_date < now, DiscountCode.status != 'expired')
+        .values(status='expired', updated_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount or 0
+    activated = db.execute(
+        update(DiscountCode)
+        .where(DiscountCode.status == 'inactive', DiscountCode.start_date <= now, DiscountCode.end_date >= now)
+        .values(status='active', updated_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount or 0
+    return {"expired": expired, "activated": activated}
+
+def discount_status_job(db: Session):
+    """Job định kỳ của scheduler: hết hạn / kích hoạt mã giảm giá theo ngày."""
+    result = sweep_discount_statuses(db)
+    db.commit()
+    if result["expired"] or result["activated"]:
+        log_info("DISCOUNT_CODES", f"Đã hết hạn {result['expired']} mã, kích hoạt {result['activated']} mã giảm giá")
@@ -0,0 +1,260 @@
+# Backend/app/services/forecasting.py
+"""
+Dự báo nhu cầu theo từng sản phẩm, tính theo lô (batch) cho toàn bộ catalog bằng NumPy.
+
+Lịch sử bán hằng ngày (daily_sales = invoice_items đã thanh toán gom theo ngày) được nạp vào
+ma trận (số ngày × số sản phẩm). Mỗi bước thời gian cập nhật đồng thời mọi sản phẩm, nên chi phí
+tỉ lệ với số ngày lịch sử chứ không phải số vòng lặp Python trên từng sản phẩm.
+
+- Sản phẩm bán đều: Holt-Winters (xu hướng tắt dần + mùa vụ theo tuần).
+- Sản phẩm bán rải rác (ADI > 1.32): Croston (hiệu chỉnh SBA).
+
+Hệ số làm trơn alpha được chọn riêng cho từng sản phẩm trong một lưới nhỏ theo sai số một bước.
+Kết quả (nhu cầu dự báo, tồn kho an toàn, điểm đặt hàng) ghi vào bảng product_forecasts.
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta
+from statistics import NormalDist
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy import select, func, delete, insert
+from ..models import Product, DailySales, ProductForecast
+from ..config import Config
+from ..logger import log_success
+
+SEASON_LENGTH = 7  # Mùa vụ theo tuần
+FORECAST_HORIZON_DAYS = 30  # Kỳ dự báo
+HW_ALPHAS = (0.05, 0.1, 0.3)  # Lưới hệ số làm trơn mức (level)
+HW_BETA = 0.02  # Hệ số làm trơn xu hướng
+HW_GAMMA = 0.1  # Hệ số làm trơn mùa vụ
+HW_PHI = 0.95  # Hệ số tắt dần xu hướng
+CROSTON_ALPHAS = (0.05, 0.1, 0.2)
+INTERMITTENT_ADI = 1.32  # Khoảng cách trung bình giữa hai ngày có bán > ngưỡng này thì dùng Croston
+LOAD_CHUNK_ROWS = 50000
+
+METHOD_HOLT_WINTERS = 'holt_winters'
+METHOD_CROSTON = 'croston'
+METHOD_NONE = 'none'
+
+
+def holt_winters(Y: np.ndarray, horizon: int) -> tuple[np.ndarray, np.ndarray]:
+    """Holt-Winters cộng tính cho mọi cột của Y (ngày × sản phẩm).
+
+    Trả về (dự báo horizon ngày tới, shape horizon × sản phẩm; độ lệch chuẩn sai số một bước).
+    """
+    T, n = Y.shape
+    m = SEASON_LENGTH
+    alphas = np.asarray(HW_ALPHAS)[:, None]
+    k = len(HW_ALPHAS)
+    seasonal = T >= 2 * m
+
+    if seasonal:
+        first = Y[:m].astype(np.float64)
+        level0 = first.mean(axis=0)
+        trend0 = (Y[m:2 * m].mean(axis=0) - level0) / m
+        season = np.repeat((first - level0)[:, None, :], k, axis=1)  # m × k × n
+        start = m
+    else:
+        level0 = Y[0].astype(np.float64)
+        trend0 = np.zeros(n)
+        season = np.zeros((m, k, n))
+        start = 1
+    gamma = HW_GAMMA if seasonal else 0.0
+
+    level = np.repeat(level0[None, :], k, axis=0)
+    trend = np.repeat(trend0[None, :], k, axis=0)
+    sse = np.zeros((k, n))
+    for t in range(start, T):
+        y = Y[t].astype(np.float64)
+        s = season[t % m]
+        damped = HW_PHI * trend
+        err = y - (level + damped + s)
+        sse += err * err
+        new_level = alphas * (y - s) + (1 - alphas) * (level + damped)
+        trend = HW_BETA * (new_level - level) + (1 - HW_BETA) * damped
+        season[t % m] = gamma * (y - new_level) + (1 - gamma) * s
+        level = new_level
+
+    # Chọn alpha có tổng bình phương sai số nhỏ nhất cho từng sản phẩm
+    best = np.argmin(sse, axis=0)
+    cols = np.arange(n)
+    level, trend, sse = level[best, cols], trend[best, cols], sse[best, cols]
+    season = season[:, best, cols]
+
+    steps = np.arange(1, horizon + 1)
+    damping = np.cumsum(HW_PHI ** steps)[:, None]
+    forecast = level + damping * trend + season[(T + steps - 1) % m]
+    sigma = np.sqrt(sse / max(T - start, 1))
+    return np.clip(forecast, 0, None), sigma
+
+
+def croston(Y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Croston (SBA) cho mọi cột của Y: làm trơn riêng lượng bán mỗi lần có bán và khoảng cách giữa hai lần bán.
+
+    Trả về (nhu cầu dự báo mỗi ngày; độ lệch chuẩn sai số một bước), mỗi mảng một phần tử cho một sản phẩm.
+    """
+    T, n = Y.shape
+    alphas = np.asarray(CROSTON_ALPHAS)[:, None]
+    k = len(CROSTON_ALPHAS)
+    bias = 1 - alphas / 2
+
+    size = np.zeros((k, n))  # Lượng bán mỗi lần có bán
+    interval = np.ones((k, n))  # Số ngày giữa hai lần bán
+    since = np.zeros(n)  # Số ngày từ lần bán trước
+    started = np.zeros(n, dtype=bool)
+    sse = np.zeros((k, n))
+    errors = np.zeros(n)
+    for t in range(T):
+        y = Y[t].astype(np.float64)
+        err = y - bias * size / interval
+        sse += np.where(started, err * err, 0.0)
+        errors += started
+        since += 1
+        sold = y > 0
+        first = sold & ~started
+        size = np.where(first, y, np.where(sold, alphas * y + (1 - alphas) * size, size))
+        interval = np.where(first, since, np.where(sold, alphas * since + (1 - alphas) * interval, interval))
+        since = np.where(sold, 0.0, since)
+        started |= sold
+
+    best = np.argmin(sse, axis=0)
+    cols = np.arange(n)
+    rate = (bias * size / interval)[best, cols]
+    sigma = np.sqrt(sse[best, cols] / np.maximum(errors, 1))
+    return rate, sigma
+
+
+def forecast_demand(Y: np.ndarray, lead_time: int, service_level: float,
+                    horizon: int = FORECAST_HORIZON_DAYS) -> dict:
+    """Dự báo cho mọi cột của Y (ngày × sản phẩm) và tính tồn kho an toàn / điểm đặt hàng.
+
+    Trả về dict các mảng (một phần tử cho một sản phẩm): method, forecast_daily, forecast_horizon,
+    demand_std, lead_time_demand, safety_stock, reorder_point.
+    """
+    T, n = Y.shape
+    horizon = max(horizon, lead_time)
+    sold_days = np.count_nonzero(Y, axis=0)
+    first_sale = np.argmax(Y > 0, axis=0)
+    adi = np.where(sold_days > 0, (T - first_sale) / np.maximum(sold_days, 1), np.inf)
+
+    method = np.full(n, METHOD_NONE, dtype=object)
+    method[sold_days > 0] = METHOD_HOLT_WINTERS
+    method[(sold_days > 0) & (adi > INTERMITTENT_ADI)] = METHOD_CROSTON
+
+    path = np.zeros((horizon, n))  # Dự báo từng ngày trong kỳ
+    sigma = np.zeros(n)
+    hw = np.flatnonzero(method == METHOD_HOLT_WINTERS)
+    if len(hw):
+        path[:, hw], sigma[hw] = holt_winters(Y[:, hw], horizon)
+    cr = np.flatnonzero(method == METHOD_CROSTON)
+    if len(cr):
+        rate, sigma[cr] = croston(Y[:, cr])
+        path[:, cr] = rate
+
+    lead_time_demand = path[:lead_time].sum(axis=0)
+    safety_stock = NormalDist().inv_cdf(service_level) * sigma * np.sqrt(lead_time)
+    return {
+        "method": method,
+        "forecast_daily": path.mean(axis=0),
+        "forecast_horizon": path.sum(axis=0),
+        "demand_std": sigma,
+        "lead_time_demand": lead_time_demand,
+        "safety_stock": safety_stock,
+        "reorder_point": lead_time_demand + safety_stock,
+    }
+
+
+def load_demand_matrix(db: Session, codes: list, start: date, end: date) -> np.ndarray:
+    """Số lượng bán mỗi ngày của các sản phẩm `codes` từ start đến end: ma trận (ngày × sản phẩm).
+
+    Đọc daily_sales gom theo (ngày, mã sản phẩm) theo từng khối để không tạo hàng triệu object cùng lúc.
+    """
+    index = {code: i for i, code in enumerate(codes)}
+    Y = np.zeros(((end - start).days + 1, len(codes)), dtype=np.float32)
+    stmt = select(DailySales.ngay, DailySales.ma_sp, func.sum(DailySales.so_luong)).where(
+        DailySales.ngay >= start,
+        DailySales.ngay <= end,
+    ).group_by(DailySales.ngay, DailySales.ma_sp)
+    result = db.execute(stmt.execution_options(yield_per=LOAD_CHUNK_ROWS))
+    for chunk in result.partitions():
+        rows = [(r[0], index.get(r[1]), r[2]) for r in chunk]
+        rows = [r for r in rows if r[1] is not None]
+        if not rows:
+            continue
+        days = np.fromiter(((r[0] - start).days for r in rows), dtype=np.int64, count=len(rows))
+        cols = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+        qty = np.fromiter((r[2] or 0 for r in rows), dtype=np.float32, count=len(rows))
+        np.add.at(Y, (days, cols), qty)
+    return Y
+
+
+_refresh_lock = threading.Lock()
+
+
+def refresh_product_forecasts(db: Session, today: date | None = None) -> dict:
+    """Tính lại dự báo cho toàn bộ sản phẩm và ghi đè product_forecasts (caller commit).
+
+    Lịch sử lấy đến hết hôm qua (ngày hôm nay chưa bán xong sẽ kéo dự báo xuống).
+    """
+    with _refresh_lock:
+        started = time.perf_counter()
+        end = (today or date.today()) - timedelta(days=1)
+        start = end - timedelta(days=Config.FORECAST_HISTORY_DAYS - 1)
+        codes = list(dict.fromkeys(db.execute(select(Product.ma_sp).order_by(Product.id)).scalars()))
+        Y = load_demand_matrix(db, codes, start, end)
+        loaded = time.perf_counter()
+        result = forecast_demand(Y, Config.FORECAST_LEAD_TIME_DAYS, Config.FORECAST_SERVICE_LEVEL)
+        computed_at = datetime.now()
+
+        history_days = Y.shape[0] - np.argmax(Y > 0, axis=0)
+        rows = [
+            {
+                "ma_sp": code,
+                "method": result["method"][i],
+                "forecast_daily": float(result["forecast_daily"][i]),
+                "forecast_horizon": float(result["forecast_horizon"][i]),
+                "demand_std": float(result["demand_std"][i]),
+                "lead_time_demand": float(result["lead_time_demand"][i]),
+                "safety_stock": float(result["safety_stock"][i]),
+                "reorder_point": float(result["reorder_point"][i]),
+                "history_days": int(history_days[i]) if result["method"][i] != METHOD_NONE else 0,
+                "computed_at": computed_at,
+            }
+            for i, code in enumerate(codes)
+        ]
+        db.execute(delete(ProductForecast))
+        if rows:
+            db.execute(insert(ProductForecast), rows)
+        db.flush()
+
+    methods = result["method"]
+    return {
+        "products": len(codes),
+        "holt_winters": int(np.count_nonzero(methods == METHOD_HOLT_WINTERS)),
+        "croston": int(np.count_nonzero(methods == METHOD_CROSTON)),
+        "no_sales": int(np.count_nonzero(methods == METHOD_NONE)),
+        "history_from": start.isoformat(),
+        "history_to": end.isoformat(),
+        "load_seconds": round(loaded - started, 3),
+        "compute_seconds": round(time.perf_counter() - loaded, 3),
+        "computed_at": computed_at,
+    }
+
+
+def load_forecasts(db: Session) -> dict:
+    """Dự báo của các sản phẩm có doanh số: {ma_sp: (forecast_daily, safety_stock, reorder_point)}."""
+    rows = db.query(
+        ProductForecast.ma_sp, ProductForecast.forecast_daily,
+        ProductForecast.safety_stock, ProductForecast.reorder_point,
+    ).filter(ProductForecast.method != METHOD_NONE)
+    return {r.ma_sp: (r.forecast_daily, r.safety_stock, r.reorder_point) for r in rows}
+
+
+def product_forecast_job(db: Session):
+    """Job định kỳ của scheduler: tính lại product_forecasts."""
+    info = refresh_product_forecasts(db)
+    db.commit()
+    log_success("FORECAST", f"Đã dự báo {info['products']} sản phẩm "
+                            f"(Holt-Winters {info['holt_winters']}, Croston {info['croston']}) "
+                            f"trong {info['load_seconds'] + info['compute_seconds']:.1f} giây")
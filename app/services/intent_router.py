@@ -0,0 +1,110 @@
+# Backend/app/services/intent_router.py
+"""
+Nhận diện intent cho chatbot: so khớp cụm từ khóa trên các token đã chuẩn hóa (bỏ dấu, chữ thường).
+
+Từ khóa được biên dịch một lần thành trie theo token; mỗi tin nhắn được tách token rồi dò trie
+từ từng vị trí, nên chi phí tỉ lệ với độ dài tin nhắn. Token gõ sai nhẹ ('xuaat', 'tonkho')
+được ánh xạ về token gần nhất trong bộ từ vựng (difflib), kết quả ánh xạ được cache.
+
+Mỗi cụm khớp cộng điểm cho intent của nó (cụm dài hơn nặng hơn, khớp gần đúng nhẹ hơn);
+intent có điểm cao nhất được chọn, hòa điểm thì theo thứ tự khai báo.
+"""
+import re
+from itertools import islice
+from difflib import get_close_matches
+from functools import lru_cache
+from .normalize import normalize_text
+
+INTENT_REORDER = 'reorder'
+INTENT_LOW_STOCK = 'low_stock'
+INTENT_BEST_SELLERS = 'best_sellers'
+INTENT_OVERVIEW = 'overview'
+INTENT_REVENUE = 'revenue'
+INTENT_HELP = 'help'
+
+# Thứ tự khai báo là thứ tự ưu tiên khi hòa điểm (giống thứ tự kiểm tra cũ)
+INTENT_KEYWORDS = [
+    (INTENT_REORDER, ["đề xuất", "đặt hàng", "reorder", "suggest"]),
+    (INTENT_LOW_STOCK, ["tồn kho", "inventory", "stock", "sắp hết", "hết hàng"]),
+    (INTENT_BEST_SELLERS, ["bán chạy", "best selling", "top", "nhiều nhất"]),
+    (INTENT_OVERVIEW, ["phân tích", "analysis", "thống kê", "statistics"]),
+    (INTENT_REVENUE, ["doanh thu", "revenue", "báo cáo", "report"]),
+]
+
+FUZZY_MIN_LENGTH = 4  # Chỉ sửa lỗi gõ giữa các token dài (âm tiết tiếng Việt không dấu ngắn dễ trùng nhau)
+FUZZY_CUTOFF = 0.8
+FUZZY_WEIGHT = 0.8  # Điểm của cụm có token khớp gần đúng
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_END = object()  # Khóa đánh dấu nút kết thúc cụm trong trie
+
+
+def tokenize(message: str | None) -> list[str]:
+    return _TOKEN.findall(normalize_text(message))
+
+
+class IntentRouter:
+    """Trie theo token của mọi cụm từ khóa; route() trả về intent có điểm cao nhất."""
+
+    def __init__(self, intents: list[tuple[str, list[str]]], default: str = INTENT_HELP):
+        self.default = default
+        self.priority = {intent: i for i, (intent, _) in enumerate(intents)}
+        self.trie: dict = {}
+        self.vocabulary: set = set()
+        for intent, phrases in intents:
+            for phrase in phrases:
+                tokens = tokenize(phrase)
+                self._add(tokens, intent)
+                if len(tokens) > 1:
+                    self._add([''.join(tokens)], intent)  # Cụm viết liền: 'tonkho', 'dexuat'
+        self._canonical = lru_cache(maxsize=4096)(self._closest_token)
+
+    def _add(self, tokens: list[str], intent: str):
+        node = self.trie
+        for token in tokens:
+            self.vocabulary.add(token)
+            node = node.setdefault(token, {})
+        node[_END] = (intent, len(tokens))
+
+    def _closest_token(self, token: str) -> tuple[str, bool]:
+        """(token trong từ vựng, có phải khớp chính xác không); token lạ được giữ nguyên."""
+        if token in self.vocabulary or len(token) < FUZZY_MIN_LENGTH:
+            return token, True
+        candidates = [word for word in self.vocabulary if len(word) >= FUZZY_MIN_LENGTH]
+        match = get_close_matches(token, candidates, n=1, cutoff=FUZZY_CUTOFF)
+        return (match[0], False) if match else (token, True)
+
+    def scores(self, message: str) -> dict:
+        """Điểm của từng intent có ít nhất một cụm khớp trong message."""
+        tokens = [self._canonical(t) for t in tokenize(message)]
+        scores: dict = {}
+        for start in range(len(tokens)):
+            node, exact = self.trie, True
+            for token, token_exact in islice(tokens, start, None):
+                node = node.get(token)
+                if node is None:
+                    break
+                exact = exact and token_exact
+                if _END in node:
+                    intent, length = node[_END]
+                    scores[intent] = scores.get(intent, 0.0) + length * (1.0 if exact else FUZZY_WEIGHT)
+        return scores
+
+    def route(self, message: str) -> str:
+        scores = self.scores(message)
+        if not scores:
+            return self.default
+        return max(scores, key=lambda intent: (scores[intent], -self.priority[intent]))
+
+
+_router = IntentRouter(INTENT_KEYWORDS)
+
+
+@lru_cache(maxsize=2048)
+def _route_normalized(message: str) -> str:
+    return _router.route(message)
+
+
+def route_intent(message: str | None) -> str:
+    """Intent của tin nhắn; kết quả được cache theo tin nhắn đã chuẩn hóa."""
+    return _route_normalized(' '.join(tokenize(message)))
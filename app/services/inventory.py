@@ -0,0 +1,110 @@
+# Backend/app/services/inventory.py
+"""
+Service tồn kho dùng chung cho đơn hàng, hóa đơn (POS) và xóa/hủy đơn.
+
+Mọi thay đổi số lượng đều là câu UPDATE nguyên tử trên database
+(so_luong = so_luong - :q WHERE so_luong >= :q RETURNING ...), không đọc
+rồi ghi lại trong Python, nên nhiều máy POS chạy song song không làm mất
+cập nhật và không bao giờ âm kho.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import update, case, func
+from fastapi import HTTPException
+from ..models import Product, Warehouse
+
+
+def sum_quantities(pairs) -> dict:
+    """Gộp số lượng theo mã sản phẩm (một sản phẩm có thể xuất hiện nhiều dòng trong giỏ hàng)."""
+    totals = {}
+    for key, qty in pairs:
+        if key is None:
+            continue
+        totals[key] = totals.get(key, 0) + int(qty or 0)
+    return totals
+
+
+def _apply_delta(db: Session, model, quantities: dict, sign: int, guarded: bool) -> dict:
+    """Cộng/trừ so_luong cho nhiều dòng theo ma_sp trong một câu UPDATE ... RETURNING.
+
+    Với guarded=True chỉ những dòng còn đủ hàng mới được trừ; trả về {ma_sp: số lượng mới}
+    của các dòng đã cập nhật.
+    """
+    delta = case(quantities, value=model.ma_sp, else_=0)
+    current = func.coalesce(model.so_luong, 0)
+    new_qty = current + sign * delta
+    stmt = update(model).where(model.ma_sp.in_(list(quantities.keys())))
+    if guarded:
+        stmt = stmt.where(current >= delta)
+    stmt = (
+        stmt.values(
+            so_luong=new_qty,
+            trang_thai=case((new_qty > 0, 'Còn hàng'), else_='Hết hàng'),
+        )
+        .returning(model.ma_sp, model.so_luong)
+        .execution_options(synchronize_session='fetch')
+    )
+    return {row.ma_sp: int(row.so_luong or 0) for row in db.execute(stmt)}
+
+
+def _short_codes(db: Session, model, quantities: dict, updated: dict) -> list:
+    """Các mã có trong bảng nhưng không được trừ kho, tức là không đủ hàng."""
+    missing = [code for code in quantities if code not in updated]
+    if not missing:
+        return []
+    existing = {r.ma_sp for r in db.query(model.ma_sp).filter(model.ma_sp.in_(missing)).all()}
+    return [code for code in missing if code in existing]
+
+
+def _raise_insufficient(db: Session, model, quantities: dict, codes):
+    """Chỉ chạy khi trừ kho thất bại: đọc số lượng hiện có để báo lỗi chi tiết."""
+    rows = db.query(model.ma_sp, model.so_luong).filter(model.ma_sp.in_(list(codes))).all()
+    available = {r.ma_sp: int(r.so_luong or 0) for r in rows}
+    details = ", ".join(
+        f"{code} (hiện có: {available.get(code, 0)}, yêu cầu: {quantities[code]})" for code in codes
+    )
+    raise HTTPException(status_code=400, detail=f"Số lượng sản phẩm không đủ! {details}")
+
+
+def decrement_stock(db: Session, quantities: dict) -> dict:
+    """Trừ kho nguyên tử cho products và warehouses theo {ma_sp: số lượng}.
+
+    Mã không có trong bảng được bỏ qua (không quản lý tồn kho). Ném HTTPException 400 nếu
+    bất kỳ sản phẩm nào không đủ hàng; caller cần rollback transaction để hoàn tác các dòng
+    đã trừ. Trả về {ma_sp: tồn kho mới} của products.
+    """
+    quantities = {code: int(q) for code, q in quantities.items() if code and int(q or 0) > 0}
+    if not quantities:
+        return {}
+
+    # Dòng không được cập nhật có thể do không đủ hàng hoặc do mã không có trong bảng;
+    # mã không quản lý tồn kho được bỏ qua như trước, chỉ báo lỗi khi thực sự thiếu hàng
+    product_qty = _apply_delta(db, Product, quantities, -1, guarded=True)
+    short = _short_codes(db, Product, quantities, product_qty)
+    if short:
+        _raise_insufficient(db, Product, quantities, short)
+
+    warehouse_qty = _apply_delta(db, Warehouse, quantities, -1, guarded=True)
+    short = _short_codes(db, Warehouse, quantities, warehouse_qty)
+    if short:
+        _raise_insufficient(db, Warehouse, quantities, short)
+
+    return product_qty
+
+
+def increment_stock(db: Session, quantities: dict) -> dict:
+    """Hoàn trả kho nguyên tử cho products và warehouses theo {ma_sp: số lượng}."""
+    quantities = {code: int(q) for code, q in quantities.items() if code and int(q or 0) > 0}
+    if not quantities:
+        return {}
+    product_qty = _apply_delta(db, Product, quantities, 1, guarded=False)
+    _apply_delta(db, Warehouse, quantities, 1, guarded=False)
+    return product_qty
+
+
+def adjust_stock(db: Session, deltas: dict) -> dict:
+    """Áp dụng chênh lệch tồn kho {ma_sp: số lượng cần xuất thêm (+) hoặc hoàn trả (-)}."""
+    out = {code: d for code, d in deltas.items() if d > 0}
+    back = {code: -d for code, d in deltas.items() if d < 0}
+    result = increment_stock(db, back)
+    result.update(decrement_stock(db, out))
+    return result
@@ -1,42 +1,286 @@
 # Backend/app/services/invoices.py
+import re
 from sqlalchemy.orm import Session
-from ..models import Invoice, Account, Product
-from datetime import datetime
+from sqlalchemy import update, insert, delete, select, case, func, true, false
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from ..models import Invoice, InvoiceItem, InvoiceSequence, CustomerBalance, DailySales, Account, Product
+from .normalize import normalize_text
+from datetime import datetime, date
 
-def update_debt_for_customer(customer_name: str, db: Session):
-    """Cập nhật bảng công nợ cho khách hàng."""
+
+def is_paid_status(trang_thai: str | None) -> bool:
+    """Hóa đơn đã thanh toán khi trạng thái chứa 'đã thanh toán' (không phân biệt hoa thường/dấu)."""
+    return 'da thanh toan' in normalize_text(trang_thai)
+
+
+def invoice_number_prefix(day: date) -> str:
+    return f"HĐ-{day.strftime('%d%m%y')}-"
+
+
+def format_invoice_number(day: date, number: int) -> str:
+    """Số hóa đơn dạng HĐ-ddmmyy-XXX (tối thiểu 3 chữ số, vượt 999 thì tự dài thêm)."""
+    return f"{invoice_number_prefix(day)}{number:03d}"
+
+
+_INVOICE_NUMBER = re.compile(r"^HĐ-(\d{6})-(\d+)$")
+
+
+def parse_invoice_number(so_hd: str | None) -> tuple[date, int] | None:
+    """(ngày, số thứ tự) nếu so_hd đúng dạng HĐ-ddmmyy-XXX do bộ đếm cấp, ngược lại None."""
+    match = _INVOICE_NUMBER.match((so_hd or "").strip())
+    if not match:
+        return None
     try:
-        invoices = db.query(Invoice).filter(Invoice.nguoi_mua == customer_name).all()
-        if not invoices:
-            return
-        total_debt = sum(float(invoice.tong_tien or 0) for invoice in invoices)
-        paid_amount = sum(
-            float(invoice.tong_tien or 0)
-            for invoice in invoices
-            if str(invoice.trang_thai or "") == "Đã thanh toán"
+        day = datetime.strptime(match.group(1), '%d%m%y').date()
+    except ValueError:
+        return None
+    return day, int(match.group(2))
+
+
+def _max_existing_number(db: Session, day: date) -> int:
+    """Số thứ tự lớn nhất đã dùng trong ngày trước khi có bộ đếm (chỉ chạy một lần mỗi ngày)."""
+    prefix = invoice_number_prefix(day)
+    max_number = 0
+    for (so_hd,) in db.query(Invoice.so_hd).filter(Invoice.so_hd.like(f"{prefix}%")):
+        suffix = (so_hd or "")[len(prefix):]
+        if suffix.isdigit():
+            max_number = max(max_number, int(suffix))
+    return max_number
+
+
+def peek_next_invoice_number(db: Session, day: date | None = None) -> int:
+    """Số hóa đơn tiếp theo của ngày, chỉ đọc (không cấp số nên không giữ chỗ)."""
+    day = day or date.today()
+    last = db.query(InvoiceSequence.so_cuoi).filter(InvoiceSequence.ngay == day).scalar()
+    if last is None:
+        last = _max_existing_number(db, day)
+    return last + 1
+
+
+def allocate_invoice_numbers(db: Session, count: int = 1, day: date | None = None) -> tuple[int, int]:
+    """Cấp nguyên tử `count` số hóa đơn liên tiếp của ngày, trả về (số đầu, số cuối).
+
+    Thường chỉ là một câu UPDATE ... RETURNING trên bộ đếm của ngày; lần cấp đầu tiên
+    trong ngày sẽ INSERT ... ON CONFLICT để hai máy POS cùng lúc không cấp trùng số.
+    Caller chịu trách nhiệm commit.
+    """
+    day = day or date.today()
+    last = db.execute(
+        update(InvoiceSequence)
+        .where(InvoiceSequence.ngay == day)
+        .values(so_cuoi=InvoiceSequence.so_cuoi + count)
+        .returning(InvoiceSequence.so_cuoi)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if last is None:
+        seed = _max_existing_number(db, day)
+        stmt = pg_insert(InvoiceSequence).values(ngay=day, so_cuoi=seed + count)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[InvoiceSequence.ngay],
+            set_={"so_cuoi": InvoiceSequence.so_cuoi + count},
+        ).returning(InvoiceSequence.so_cuoi)
+        last = db.execute(stmt).scalar()
+    return last - count + 1, last
+
+
+def reserve_invoice_number(db: Session, so_hd: str | None):
+    """Đẩy bộ đếm của ngày lên ít nhất bằng số trong so_hd do client tự gửi (dạng HĐ-ddmmyy-XXX).
+
+    Client cũ xem trước số qua GET /next-number rồi gửi kèm hóa đơn; nếu bộ đếm không theo kịp,
+    lần cấp tự động / POST /number-block tiếp theo sẽ cấp lại số đã dùng. Caller chịu trách nhiệm commit.
+    """
+    parsed = parse_invoice_number(so_hd)
+    if parsed is None:
+        return
+    day, number = parsed
+    updated = db.execute(
+        update(InvoiceSequence)
+        .where(InvoiceSequence.ngay == day)
+        .values(so_cuoi=func.greatest(InvoiceSequence.so_cuoi, number))
+        .returning(InvoiceSequence.so_cuoi)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if updated is None:
+        stmt = pg_insert(InvoiceSequence).values(ngay=day, so_cuoi=max(_max_existing_number(db, day), number))
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[InvoiceSequence.ngay],
+            set_={"so_cuoi": func.greatest(InvoiceSequence.so_cuoi, stmt.excluded.so_cuoi)},
+        ))
+
+
+def apply_customer_balance(
+    db: Session,
+    nguoi_mua: str,
+    tong_tien: float,
+    da_thanh_toan: bool,
+    sign: int = 1,
+    paid_on: date | None = None,
+    invoice_id: int | None = None,
+):
+    """Cộng (sign=1) hoặc gỡ (sign=-1) đóng góp của một hóa đơn vào công nợ khách hàng.
+
+    Một câu INSERT ... ON CONFLICT DO UPDATE cộng dồn chênh lệch, chạy trong transaction
+    của hóa đơn nên không cần đọc lại toàn bộ hóa đơn của khách. Khi gỡ một hóa đơn đã thanh toán
+    (invoice_id), ngày thanh toán cuối được tính lại từ các hóa đơn đã thanh toán còn lại.
+    Caller chịu trách nhiệm commit.
+    """
+    if not nguoi_mua:
+        return
+    billed = float(tong_tien or 0) * sign
+    paid = billed if da_thanh_toan else 0.0
+    unpaid_count = 0 if da_thanh_toan else sign
+    last_paid = paid_on if (da_thanh_toan and sign > 0) else None
+
+    stmt = pg_insert(CustomerBalance).values(
+        nguoi_mua=nguoi_mua,
+        tong_phat_sinh=billed,
+        da_thanh_toan=paid,
+        con_no=billed - paid,
+        so_hd_chua_tt=unpaid_count,
+        ngay_thanh_toan_cuoi=last_paid,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CustomerBalance.nguoi_mua],
+        set_={
+            "tong_phat_sinh": CustomerBalance.tong_phat_sinh + stmt.excluded.tong_phat_sinh,
+            "da_thanh_toan": CustomerBalance.da_thanh_toan + stmt.excluded.da_thanh_toan,
+            "con_no": CustomerBalance.con_no + stmt.excluded.con_no,
+            "so_hd_chua_tt": CustomerBalance.so_hd_chua_tt + stmt.excluded.so_hd_chua_tt,
+            "ngay_thanh_toan_cuoi": func.greatest(CustomerBalance.ngay_thanh_toan_cuoi, stmt.excluded.ngay_thanh_toan_cuoi),
+            "updated_at": func.now(),
+        },
+    )
+    db.execute(stmt)
+
+    # greatest chỉ tiến lên được: gỡ hóa đơn đã thanh toán thì lấy lại max(ngay_hd) của phần còn lại
+    if sign < 0 and da_thanh_toan:
+        remaining = select(func.max(Invoice.ngay_hd)).where(
+            Invoice.nguoi_mua == nguoi_mua,
+            Invoice.da_thanh_toan == true(),
+        )
+        if invoice_id is not None:
+            remaining = remaining.where(Invoice.id != invoice_id)
+        db.execute(
+            update(CustomerBalance)
+            .where(CustomerBalance.nguoi_mua == nguoi_mua)
+            .values(ngay_thanh_toan_cuoi=remaining.scalar_subquery())
+            .execution_options(synchronize_session=False)
+        )
+
+
+def rebuild_customer_balances(db: Session) -> int:
+    """Tính lại toàn bộ bảng công nợ từ invoices bằng một câu INSERT ... SELECT (dùng để backfill)."""
+    paid_amount = case((Invoice.da_thanh_toan == true(), Invoice.tong_tien), else_=0.0)
+    unpaid_amount = case((Invoice.da_thanh_toan == true(), 0.0), else_=Invoice.tong_tien)
+    source = (
+        select(
+            Invoice.nguoi_mua,
+            func.coalesce(func.sum(Invoice.tong_tien), 0.0),
+            func.coalesce(func.sum(paid_amount), 0.0),
+            func.coalesce(func.sum(unpaid_amount), 0.0),
+            func.count(Invoice.id).filter(Invoice.da_thanh_toan == false()),
+            func.max(Invoice.ngay_hd).filter(Invoice.da_thanh_toan == true()),
+        )
+        .where(Invoice.nguoi_mua.isnot(None))
+        .group_by(Invoice.nguoi_mua)
+    )
+    db.execute(delete(CustomerBalance))
+    result = db.execute(
+        insert(CustomerBalance).from_select(
+            ["nguoi_mua", "tong_phat_sinh", "da_thanh_toan", "con_no", "so_hd_chua_tt", "ngay_thanh_toan_cuoi"],
+            source,
+        )
+    )
+    return result.rowcount or 0
+
+
+def invoice_sales_lines(db: Session, invoice_id: int) -> list[tuple]:
+    """Các dòng (ma_sp, ten_sp, so_luong, doanh_thu, don_gia) của một hóa đơn, gộp theo mã sản phẩm."""
+    return [
+        tuple(row) for row in db.query(
+            InvoiceItem.product_code,
+            func.max(InvoiceItem.product_name),
+            func.coalesce(func.sum(InvoiceItem.so_luong), 0),
+            func.coalesce(func.sum(InvoiceItem.total_price), 0.0),
+            func.max(InvoiceItem.don_gia),
+        ).filter(InvoiceItem.invoice_id == invoice_id).group_by(InvoiceItem.product_code)
+    ]
+
+
+def apply_daily_sales(db: Session, inv: Invoice, sign: int = 1, lines: list[tuple] | None = None):
+    """Cộng (sign=1) hoặc gỡ (sign=-1) các dòng của một hóa đơn đã thanh toán vào bảng daily_sales.
+
+    `lines` dạng (ma_sp, ten_sp, so_luong, doanh_thu, don_gia); bỏ trống thì đọc từ invoice_items.
+    Một câu INSERT ... ON CONFLICT DO UPDATE cho cả hóa đơn, chạy trong transaction của hóa đơn.
+    Caller chịu trách nhiệm commit.
+    """
+    if not inv.da_thanh_toan or not inv.ngay_hd:
+        return
+    if lines is None:
+        lines = invoice_sales_lines(db, inv.id)
+
+    hinh_thuc_tt = inv.hinh_thuc_tt or ''
+    rows = {}
+    for ma_sp, ten_sp, so_luong, doanh_thu, don_gia in lines:
+        if not ma_sp:
+            continue
+        row = rows.setdefault(ma_sp, {
+            "ngay": inv.ngay_hd, "ma_sp": ma_sp, "hinh_thuc_tt": hinh_thuc_tt,
+            "ten_sp": ten_sp, "so_luong": 0, "doanh_thu": 0.0, "don_gia": don_gia,
+        })
+        row["so_luong"] += int(so_luong or 0) * sign
+        row["doanh_thu"] += float(doanh_thu or 0) * sign
+    if not rows:
+        return
+
+    stmt = pg_insert(DailySales).values(list(rows.values()))
+    set_ = {
+        "so_luong": DailySales.so_luong + stmt.excluded.so_luong,
+        "doanh_thu": DailySales.doanh_thu + stmt.excluded.doanh_thu,
+        "updated_at": func.now(),
+    }
+    if sign > 0:
+        set_.update(ten_sp=stmt.excluded.ten_sp, don_gia=stmt.excluded.don_gia)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[DailySales.ngay, DailySales.ma_sp, DailySales.hinh_thuc_tt],
+        set_=set_,
+    ))
+
+    if sign < 0:
+        # Dọn các dòng đã về 0 để báo cáo không hiện sản phẩm không còn doanh số
+        db.execute(
+            delete(DailySales)
+            .where(DailySales.ngay == inv.ngay_hd)
+            .where(DailySales.hinh_thuc_tt == hinh_thuc_tt)
+            .where(DailySales.ma_sp.in_(list(rows.keys())))
+            .where(DailySales.so_luong <= 0)
+            .where(DailySales.doanh_thu <= 0)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def rebuild_daily_sales(db: Session) -> int:
+    """Tính lại toàn bộ bảng daily_sales từ invoice_items đã thanh toán bằng một câu INSERT ... SELECT."""
+    hinh_thuc_tt = func.coalesce(Invoice.hinh_thuc_tt, '')
+    source = (
+        select(
+            Invoice.ngay_hd,
+            InvoiceItem.product_code,
+            hinh_thuc_tt,
+            func.max(InvoiceItem.product_name),
+            func.coalesce(func.sum(InvoiceItem.so_luong), 0),
+            func.coalesce(func.sum(InvoiceItem.total_price), 0.0),
+            func.max(InvoiceItem.don_gia),
+        )
+        .join(Invoice, Invoice.id == InvoiceItem.invoice_id)
+        .where(Invoice.da_thanh_toan == true())
+        .group_by(Invoice.ngay_hd, InvoiceItem.product_code, hinh_thuc_tt)
+    )
+    db.execute(delete(DailySales))
+    result = db.execute(
+        insert(DailySales).from_select(
+            ["ngay", "ma_sp", "hinh_thuc_tt", "ten_sp", "so_luong", "doanh_thu", "don_gia"],
+            source,
         )
-        remaining_debt = total_debt - paid_amount
-        # The following lines were related to Debt model and are removed as per the edit hint.
-        # debt_record = db.query(Debt).filter(Debt.customer_name == customer_name).first()
-        # if debt_record:
-        #     debt_record.total_debt = total_debt
-        #     debt_record.paid_amount = paid_amount
-        #     debt_record.remaining_debt = remaining_debt
-        #     debt_record.status = "Hết nợ" if remaining_debt <= 0 else "Còn nợ"
-        #     if paid_amount > 0:
-        #         debt_record.last_payment_date = datetime.now()
-        # else:
-        #     debt_record = Debt(
-        #         customer_name=customer_name,
-        #         total_debt=total_debt,
-        #         paid_amount=paid_amount,
-        #         remaining_debt=remaining_debt,
-        #         status="Hết nợ" if remaining_debt <= 0 else "Còn nợ",
-        #         created_at=datetime.now(),
-        #     )
-        #     db.add(debt_record)
-        db.commit()
-        print(f"✓ Đã cập nhật công nợ cho {customer_name}: Tổng={total_debt:,.0f}, Đã trả={paid_amount:,.0f}, Còn nợ={remaining_debt:,.0f}")
-    except Exception as e:
-        print(f"× Lỗi cập nhật công nợ cho {customer_name}: {e}")
-        db.rollback()
+    )
+    return result.rowcount or 0
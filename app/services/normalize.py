@@ -0,0 +1,21 @@
+# Backend/app/services/normalize.py
+"""
+Chuẩn hóa chuỗi tiếng Việt (bỏ dấu, chữ thường) để so khớp không phân biệt dấu
+"""
+import re
+import unicodedata
+
+_SPACES = re.compile(r"\s+")
+
+
+def strip_accents(value: str | None) -> str:
+    """Bỏ dấu tiếng Việt: 'Đã hủy' -> 'Da huy'."""
+    s = (value or '').replace('đ', 'd').replace('Đ', 'D')
+    s = unicodedata.normalize('NFD', s)
+    return ''.join(ch for ch in s if unicodedata.category(ch) != 'Mn')
+
+
+def normalize_text(value: str | None) -> str:
+    """Chữ thường, bỏ dấu, gộp khoảng trắng và '_' thành một dấu cách."""
+    s = strip_accents(value).lower().replace('_', ' ')
+    return _SPACES.sub(' ', s).strip()
@@ -1,7 +1,31 @@
 # Backend/app/services/orders.py
 from sqlalchemy.orm import Session
 from ..models import Order, Product, Account
-from fastapi import HTTPException
+from .normalize import normalize_text
+
+# Mã trạng thái chuẩn của đơn hàng (Order.ma_trang_thai); Order.trang_thai chỉ dùng để hiển thị
+ORDER_STATUS_PENDING = 'cho_xu_ly'
+ORDER_STATUS_PROCESSING = 'dang_xu_ly'
+ORDER_STATUS_COMPLETED = 'hoan_thanh'
+ORDER_STATUS_CANCELLED = 'da_huy'
+ORDER_STATUS_OTHER = 'khac'
+
+_CANCELLED_TEXTS = {'da huy', 'huy', 'canceled', 'cancelled'}
+
+
+def normalize_order_status(status: str | None) -> str:
+    """Suy ra mã trạng thái chuẩn từ chuỗi trạng thái tự do ('Hoàn thành', 'hoan_thanh', 'Đã hủy'...)."""
+    s = normalize_text(status)
+    if s in _CANCELLED_TEXTS:
+        return ORDER_STATUS_CANCELLED
+    if 'hoan thanh' in s or s == 'completed':
+        return ORDER_STATUS_COMPLETED
+    if 'dang xu ly' in s or s == 'processing':
+        return ORDER_STATUS_PROCESSING
+    if not s or 'cho xu ly' in s or s == 'pending':
+        return ORDER_STATUS_PENDING
+    return ORDER_STATUS_OTHER
+
 
 def create_order_service(payload, db: Session):
     is_product = False
@@ -33,10 +57,7 @@ def create_order_service(payload, db: Session):
                 # Fallback: tính từ giá mặc định nếu có
                 unit_price = float(payload.tong_tien or 0) / max(int(payload.so_luong or 1), 1)
                 computed_total = unit_price * int(payload.so_luong or 0)
-    if is_product and product and payload.so_luong:
-        current_qty = int(getattr(product, 'so_luong', 0) or 0)
-        if current_qty < payload.so_luong:
-            raise HTTPException(status_code=400, detail=f"Số lượng sản phẩm {payload.sp_banggia} không đủ! Hiện có: {current_qty}, yêu cầu: {payload.so_luong}")
+    # Kiểm tra tồn kho được thực hiện nguyên tử khi trừ kho (services/inventory.py)
     return {
         'is_product': is_product,
         'is_action': is_action,
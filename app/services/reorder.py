@@ -0,0 +1,279 @@
+# Backend/app/services/reorder.py
+"""
+Engine đề xuất đặt hàng vectorized (NumPy) cho chatbot.
+
+Cả catalog được nạp bằng 3 truy vấn (sản phẩm, kho, doanh số 7/30 ngày gom nhóm từ daily_sales)
+vào các mảng NumPy; tốc độ bán, số ngày còn hàng, số lượng đề xuất và mức ưu tiên được tính
+một lần trên cả mảng thay vì khoảng 4 truy vấn cho mỗi sản phẩm.
+
+Sản phẩm đã có dự báo nhu cầu (product_forecasts) dùng nhu cầu dự báo và tồn kho an toàn thay cho
+tốc độ bán trung bình và hệ số dự phòng cố định.
+
+Kết quả được ghi định kỳ vào bảng reorder_snapshots (refresh_reorder_snapshot) để chatbot
+trả lời bằng một truy vấn đọc thay vì tính lại mỗi tin nhắn.
+"""
+import threading
+from datetime import date, datetime, timedelta
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy import func, delete, insert
+from ..models import Product, Warehouse, DailySales, ReorderSnapshot
+from ..logger import log_info
+from .forecasting import load_forecasts
+
+NO_SALES_DAYS = 999  # Giá trị "số ngày còn hàng" khi chưa có doanh số
+LOW_STOCK_THRESHOLD = 20  # Ngưỡng cảnh báo tồn kho thấp
+REORDER_HORIZON_DAYS = 30  # Đề xuất đủ hàng cho 30 ngày
+REORDER_BUFFER = 1.2  # + 20% dự phòng (sản phẩm chưa có dự báo)
+BEST_SELLER_LIMIT = 20  # Số sản phẩm bán chạy (30 ngày) được ưu tiên khi đề xuất
+
+
+class ReorderTable:
+    """Bảng đề xuất đặt hàng cho toàn bộ sản phẩm; mỗi cột là một mảng NumPy (một phần tử cho mỗi sản phẩm)."""
+
+    def __init__(self, codes, names, stock, gia_nhap, sold_7, sold_30, best_seller_codes,
+                 forecast_daily=None, safety_stock=None, reorder_point=None):
+        """forecast_daily/safety_stock/reorder_point: dự báo theo sản phẩm, NaN nếu sản phẩm chưa có dự báo."""
+        self.codes = np.asarray(codes, dtype=object)
+        self.names = np.asarray(names, dtype=object)
+        self.stock = np.asarray(stock, dtype=np.int64)
+        self.gia_nhap = np.asarray(gia_nhap, dtype=np.float64)
+        self.index = {code: i for i, code in enumerate(codes)}
+
+        n = len(codes)
+        forecast_daily = np.full(n, np.nan) if forecast_daily is None else np.asarray(forecast_daily, dtype=np.float64)
+        self.has_forecast = ~np.isnan(forecast_daily)
+        self.safety_stock = np.zeros(n) if safety_stock is None else np.asarray(safety_stock, dtype=np.float64)
+        self.reorder_point = np.zeros(n) if reorder_point is None else np.asarray(reorder_point, dtype=np.float64)
+
+        # Tốc độ bán mỗi ngày (làm tròn 2 chữ số như trước): nhu cầu dự báo nếu có,
+        # ngược lại tốc độ bán trung bình, ưu tiên 7 ngày gần nhất
+        rate_7 = np.round(np.asarray(sold_7, dtype=np.float64) / 7, 2)
+        rate_30 = np.round(np.asarray(sold_30, dtype=np.float64) / 30, 2)
+        self.sales_rate = np.where(
+            self.has_forecast,
+            np.round(np.nan_to_num(forecast_daily), 2),
+            np.where(rate_7 > 0, rate_7, rate_30),
+        )
+        selling = self.sales_rate > 0
+
+        # Số ngày dự kiến hết hàng
+        safe_rate = np.where(selling, self.sales_rate, 1.0)
+        self.days_until_out = np.where(selling, np.trunc(self.stock / safe_rate), NO_SALES_DAYS).astype(np.int64)
+        self.has_eta = self.days_until_out < NO_SALES_DAYS
+
+        # Số lượng đề xuất: đủ cho 30 ngày + tồn kho an toàn (chưa có dự báo: + 20%);
+        # chưa có doanh số thì bằng tồn kho hiện tại (tối thiểu 50)
+        self.recommended = np.where(
+            selling,
+            np.where(
+                self.has_forecast,
+                np.ceil(self.sales_rate * REORDER_HORIZON_DAYS + self.safety_stock),
+                np.trunc(self.sales_rate * REORDER_HORIZON_DAYS * REORDER_BUFFER),
+            ),
+            np.maximum(self.stock, 50),
+        ).astype(np.int64)
+
+        # Ưu tiên cao: sắp hết trong 7 ngày, tồn ≤ 10, hoặc đã chạm điểm đặt hàng theo dự báo
+        self.high_priority = (self.days_until_out <= 7) | (self.stock <= 10) | (
+            self.has_forecast & selling & (self.stock <= self.reorder_point)
+        )
+        self.is_best_seller = np.isin(self.codes, list(best_seller_codes)) if best_seller_codes else np.zeros(len(codes), dtype=bool)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def suggestion(self, i: int) -> dict:
+        """Đề xuất cho sản phẩm ở vị trí i (cùng định dạng với calculate_reorder_suggestion)."""
+        return {
+            "ma_sp": self.codes[i],
+            "product_name": self.names[i],
+            "current_stock": int(self.stock[i]),
+            "sales_rate": float(self.sales_rate[i]),
+            "days_until_out": int(self.days_until_out[i]) if self.has_eta[i] else "N/A",
+            "recommended_quantity": int(self.recommended[i]),
+            "priority": "high" if self.high_priority[i] else "normal",
+            "gia_nhap": float(self.gia_nhap[i]),
+        }
+
+    def candidate_order(self):
+        """Vị trí các sản phẩm cần đặt hàng, đã sắp xếp theo mức cần thiết.
+
+        Cần đặt: sắp hết (≤ 30 ngày), bán chạy mà tồn thấp (≤ 50), hoặc đã hết hàng.
+        Sắp xếp: bán chạy + ưu tiên cao trước, rồi ưu tiên cao, rồi số ngày còn hàng tăng dần.
+        """
+        mask = (self.has_eta & (self.days_until_out <= 30)) | (self.is_best_seller & (self.stock <= 50)) | (self.stock <= 0)
+        idx = np.flatnonzero(mask)
+        order = np.lexsort((
+            np.where(self.has_eta[idx], self.days_until_out[idx], NO_SALES_DAYS),
+            ~self.high_priority[idx],
+            ~(self.is_best_seller[idx] & self.high_priority[idx]),
+        ))
+        return idx[order]
+
+    def reorder_candidates(self, limit: int = 5) -> list[dict]:
+        """Các đề xuất đặt hàng đầu tiên theo candidate_order()."""
+        result = []
+        for i in self.candidate_order()[:limit]:
+            item = self.suggestion(i)
+            item["is_best_seller"] = bool(self.is_best_seller[i])
+            result.append(item)
+        return result
+
+    def low_stock_mask(self, threshold: int = LOW_STOCK_THRESHOLD):
+        return self.stock <= threshold
+
+    def low_stock(self, threshold: int = LOW_STOCK_THRESHOLD, limit: int = 5) -> list[dict]:
+        """Sản phẩm có tồn kho ≤ threshold, theo thứ tự sản phẩm."""
+        return [self.suggestion(i) for i in np.flatnonzero(self.low_stock_mask(threshold))[:limit]]
+
+
+def load_sales_by_product(db: Session, today: date | None = None) -> list:
+    """Doanh số 7 và 30 ngày gần nhất của mọi sản phẩm trong một truy vấn gom nhóm trên daily_sales."""
+    today = today or date.today()
+    start_7 = today - timedelta(days=7)
+    start_30 = today - timedelta(days=30)
+    return db.query(
+        DailySales.ma_sp,
+        func.max(DailySales.ten_sp).label('ten_sp'),
+        func.coalesce(func.sum(DailySales.so_luong).filter(DailySales.ngay >= start_7), 0).label('sold_7'),
+        func.coalesce(func.sum(DailySales.so_luong), 0).label('sold_30'),
+        func.coalesce(func.sum(DailySales.doanh_thu), 0.0).label('revenue_30'),
+    ).filter(
+        DailySales.ngay >= start_30,
+        DailySales.ngay <= today,
+    ).group_by(DailySales.ma_sp).all()
+
+
+def load_warehouse_stock(db: Session) -> dict:
+    """Tồn kho và giá nhập theo mã sản phẩm (mỗi mã có tối đa một dòng kho): {ma_sp: (so_luong, gia_nhap)}."""
+    rows = db.query(Warehouse.ma_sp, Warehouse.so_luong, Warehouse.gia_nhap)
+    return {r.ma_sp: (r.so_luong, r.gia_nhap) for r in rows}
+
+
+def load_reorder_table(db: Session, today: date | None = None, sales: list | None = None,
+                       warehouses: dict | None = None) -> ReorderTable:
+    """Nạp toàn bộ sản phẩm, kho, doanh số và dự báo rồi tính bảng đề xuất (4 truy vấn, không phụ thuộc số sản phẩm).
+
+    `sales`/`warehouses` cho phép dùng lại kết quả load_sales_by_product/load_warehouse_stock đã có.
+    """
+    if sales is None:
+        sales = load_sales_by_product(db, today)
+    if warehouses is None:
+        warehouses = load_warehouse_stock(db)
+    sales_map = {r.ma_sp: r for r in sales}
+    forecasts = load_forecasts(db)
+    products = db.query(Product.ma_sp, Product.ten_sp, Product.so_luong, Product.gia_von).order_by(Product.id).all()
+
+    codes, names, stock, gia_nhap, sold_7, sold_30 = [], [], [], [], [], []
+    forecast_daily, safety_stock, reorder_point = [], [], []
+    for p in products:
+        wh = warehouses.get(p.ma_sp)
+        codes.append(p.ma_sp)
+        names.append(p.ten_sp)
+        # Tồn kho và giá nhập lấy từ kho nếu sản phẩm có trong kho, ngược lại lấy từ sản phẩm
+        stock.append((wh[0] if wh else p.so_luong) or 0)
+        gia_nhap.append((wh[1] if wh else p.gia_von) or 0)
+        s = sales_map.get(p.ma_sp)
+        sold_7.append(int(s.sold_7) if s else 0)
+        sold_30.append(int(s.sold_30) if s else 0)
+        fc = forecasts.get(p.ma_sp, (np.nan, 0.0, 0.0))
+        forecast_daily.append(fc[0])
+        safety_stock.append(fc[1])
+        reorder_point.append(fc[2])
+
+    best = sorted((r for r in sales if r.sold_30 > 0), key=lambda r: r.sold_30, reverse=True)[:BEST_SELLER_LIMIT]
+    return ReorderTable(codes, names, stock, gia_nhap, sold_7, sold_30, {r.ma_sp for r in best},
+                        forecast_daily, safety_stock, reorder_point)
+
+
+_refresh_lock = threading.Lock()
+_snapshot_version = 0  # Tăng mỗi lần làm mới (khóa cache câu trả lời chatbot đọc từ snapshot)
+
+
+def get_snapshot_version() -> int:
+    return _snapshot_version
+
+
+def bump_snapshot_version():
+    """Gọi sau khi commit snapshot mới: câu trả lời chatbot cache theo phiên bản cũ hết hiệu lực.
+
+    Tăng trước khi commit thì request chen vào giữa sẽ đọc snapshot cũ và cache nó dưới phiên bản mới.
+    """
+    global _snapshot_version
+    with _refresh_lock:
+        _snapshot_version += 1
+
+
+def refresh_reorder_snapshot(db: Session, today: date | None = None) -> dict:
+    """Tính lại bảng đề xuất và ghi đè toàn bộ reorder_snapshots (caller commit).
+
+    Lock tránh job định kỳ và endpoint làm mới ghi chồng lên nhau trong cùng tiến trình.
+    Sau khi commit, caller gọi bump_snapshot_version().
+    """
+    with _refresh_lock:
+        table = load_reorder_table(db, today)
+        rank = np.full(len(table), -1, dtype=np.int64)
+        candidates = table.candidate_order()
+        rank[candidates] = np.arange(1, len(candidates) + 1)
+        low_stock = table.low_stock_mask()
+        refreshed_at = datetime.now()
+
+        rows = [
+            {
+                "ma_sp": table.codes[i],
+                "ten_sp": table.names[i],
+                "vi_tri": i,
+                "current_stock": int(table.stock[i]),
+                "gia_nhap": float(table.gia_nhap[i]),
+                "sales_rate": float(table.sales_rate[i]),
+                "days_until_out": int(table.days_until_out[i]) if table.has_eta[i] else None,
+                "recommended_quantity": int(table.recommended[i]),
+                "high_priority": bool(table.high_priority[i]),
+                "is_best_seller": bool(table.is_best_seller[i]),
+                "is_low_stock": bool(low_stock[i]),
+                "candidate_rank": int(rank[i]) if rank[i] > 0 else None,
+                "refreshed_at": refreshed_at,
+            }
+            for i in range(len(table))
+        ]
+        db.execute(delete(ReorderSnapshot))
+        if rows:
+            db.execute(insert(ReorderSnapshot), rows)
+        db.flush()
+    return {
+        "products": len(rows),
+        "candidates": len(candidates),
+        "low_stock": int(low_stock.sum()),
+        "refreshed_at": refreshed_at,
+    }
+
+
+def reorder_snapshot_job(db: Session):
+    """Job định kỳ của scheduler: làm mới reorder_snapshots."""
+    info = refresh_reorder_snapshot(db)
+    db.commit()
+    bump_snapshot_version()
+    log_info("REORDER_SNAPSHOT", f"Đã làm mới snapshot: {info['products']} sản phẩm, {info['candidates']} cần đặt hàng")
+
+
+def snapshot_suggestion(row: ReorderSnapshot) -> dict:
+    """Đề xuất từ một dòng snapshot (cùng định dạng với ReorderTable.suggestion)."""
+    return {
+        "ma_sp": row.ma_sp,
+        "product_name": row.ten_sp,
+        "current_stock": row.current_stock,
+        "sales_rate": row.sales_rate,
+        "days_until_out": row.days_until_out if row.days_until_out is not None else "N/A",
+        "recommended_quantity": row.recommended_quantity,
+        "priority": "high" if row.high_priority else "normal",
+        "gia_nhap": row.gia_nhap,
+    }
+
+
+def snapshot_age(refreshed_at: datetime) -> dict:
+    """Thời điểm làm mới và tuổi (giây) của snapshot."""
+    return {
+        "refreshed_at": refreshed_at.isoformat(),
+        "age_seconds": max(0, int((datetime.now() - refreshed_at).total_seconds())),
+    }
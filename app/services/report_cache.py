@@ -0,0 +1,145 @@
+# Backend/app/services/report_cache.py
+"""
+Cache kết quả báo cáo trong bộ nhớ, gắn với phiên bản dữ liệu (data version).
+
+Mỗi lần ghi hóa đơn, đơn hàng, sản phẩm, khách hàng thì endpoint gọi bump_data_version();
+báo cáo đã cache chỉ được dùng lại khi phiên bản dữ liệu chưa đổi. TTL là lưới an toàn
+cho các thay đổi không đi qua API (script import, sửa tay trong database).
+
+Khi nhiều request giống nhau đến cùng lúc mà cache chưa có, single_flight() cho một request
+tính, các request còn lại chờ (có giới hạn thời gian) và nhận chung kết quả.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable
+from fastapi import HTTPException
+from ..config import Config
+
+_lock = threading.Lock()
+_entries: OrderedDict = OrderedDict()  # key -> (data_version, thời điểm lưu, kết quả)
+_data_version = 0
+_inflight: dict = {}  # key -> _InFlight của lần tính đang chạy
+_stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0, "coalesced": 0, "timeouts": 0}
+
+
+class _InFlight:
+    """Một lần tính đang chạy; các request trùng key chờ event rồi đọc result/error."""
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def get_data_version() -> int:
+    return _data_version
+
+
+def bump_data_version() -> int:
+    """Đánh dấu dữ liệu nghiệp vụ đã thay đổi: mọi báo cáo đã cache trở thành cũ."""
+    global _data_version
+    with _lock:
+        _data_version += 1
+        _stats["invalidations"] += 1
+        _entries.clear()
+        return _data_version
+
+
+def _make_key(name: str, params: dict) -> tuple:
+    # Kèm ngày hiện tại vì nhiều báo cáo tính theo "hôm nay" (tuổi nợ, 30 ngày gần nhất)
+    return (name, date.today().isoformat(), tuple(sorted((k, repr(v)) for k, v in params.items())))
+
+
+def single_flight(key: tuple, compute: Callable[[], Any], timeout: float | None = None) -> Any:
+    """Gộp các lần gọi trùng `key` đang chạy song song thành một lần compute().
+
+    Request đầu tiên tính, các request đến sau chờ tối đa `timeout` giây (mặc định
+    REPORT_SINGLE_FLIGHT_TIMEOUT) rồi nhận cùng kết quả hoặc cùng lỗi; quá thời gian thì 503.
+    """
+    with _lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _InFlight()
+        else:
+            _stats["coalesced"] += 1
+
+    if leader:
+        try:
+            call.result = compute()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with _lock:
+                _inflight.pop(key, None)
+            call.event.set()
+
+    if not call.event.wait(Config.REPORT_SINGLE_FLIGHT_TIMEOUT if timeout is None else timeout):
+        with _lock:
+            _stats["timeouts"] += 1
+        raise HTTPException(status_code=503, detail="Báo cáo đang được tính, vui lòng thử lại sau ít giây")
+    if call.error is not None:
+        raise call.error
+    return call.result
+
+
+def cached_report(name: str, params: dict, compute: Callable[[], Any]) -> Any:
+    """Trả về kết quả đã cache của báo cáo `name` với tham số `params`, hoặc tính mới bằng compute().
+
+    Các request trùng key đến khi chưa có cache dùng chung một lần tính (single_flight).
+    """
+    key = _make_key(name, params)
+    now = time.monotonic()
+    with _lock:
+        version = _data_version
+        if Config.REPORT_CACHE_ENABLED:
+            entry = _entries.get(key)
+            if entry is not None and entry[0] == version and now - entry[1] < Config.REPORT_CACHE_TTL:
+                _entries.move_to_end(key)
+                _stats["hits"] += 1
+                return entry[2]
+            _stats["misses"] += 1
+
+    if not Config.REPORT_CACHE_ENABLED:
+        return single_flight((key, version), compute)
+
+    def compute_and_store():
+        result = compute()
+        with _lock:
+            # Chỉ lưu nếu dữ liệu không đổi trong lúc tính, tránh cache kết quả đã cũ
+            if version == _data_version:
+                _entries[key] = (version, now, result)
+                _entries.move_to_end(key)
+                while len(_entries) > Config.REPORT_CACHE_MAX_ENTRIES:
+                    _entries.popitem(last=False)
+                    _stats["evictions"] += 1
+        return result
+
+    # Key gồm cả phiên bản dữ liệu: request đến sau một lần ghi không nhận kết quả tính trên dữ liệu cũ
+    return single_flight((key, version), compute_and_store)
+
+
+def clear_report_cache():
+    with _lock:
+        _entries.clear()
+
+
+def report_cache_stats() -> dict:
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_rate": round(_stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(_entries),
+            "in_flight": len(_inflight),
+            "max_entries": Config.REPORT_CACHE_MAX_ENTRIES,
+            "ttl_seconds": Config.REPORT_CACHE_TTL,
+            "single_flight_timeout": Config.REPORT_SINGLE_FLIGHT_TIMEOUT,
+            "data_version": _data_version,
+            "enabled": Config.REPORT_CACHE_ENABLED,
+        }
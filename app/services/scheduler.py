@@ -0,0 +1,63 @@
+# Backend/app/services/scheduler.py
+"""
+Chạy các job định kỳ trong tiến trình backend (mỗi job một thread nền).
+
+Job nhận một Session riêng, tự commit; lỗi của một lần chạy chỉ được ghi log,
+lần chạy sau vẫn diễn ra bình thường.
+"""
+import threading
+from typing import Callable
+from sqlalchemy.orm import Session
+from ..database import SessionLocal
+from ..logger import log_info, log_error, log_warning
+
+_jobs: dict = {}  # tên job -> (chu kỳ giây, hàm job)
+_threads: list = []
+_stop = threading.Event()
+
+
+def register_job(name: str, interval_seconds: float, func: Callable[[Session], object], run_at_start: bool = True):
+    """Đăng ký job chạy mỗi `interval_seconds` giây; gọi trước start_scheduler()."""
+    _jobs[name] = (interval_seconds, func, run_at_start)
+
+
+def run_job(name: str, func: Callable[[Session], object]):
+    """Chạy một lần job với session riêng, rollback nếu lỗi."""
+    db = SessionLocal()
+    try:
+        func(db)
+    except Exception as e:
+        db.rollback()
+        log_error("SCHEDULER", f"Job {name} lỗi", error=e)
+    finally:
+        db.close()
+
+
+def _loop(name: str, interval: float, func: Callable[[Session], object], run_at_start: bool):
+    if not run_at_start and _stop.wait(interval):
+        return
+    while not _stop.is_set():
+        run_job(name, func)
+        if _stop.wait(interval):
+            break
+
+
+def start_scheduler():
+    """Khởi động thread cho mọi job đã đăng ký (gọi từ startup event)."""
+    if _threads:
+        log_warning("SCHEDULER", "Scheduler đã chạy, bỏ qua")
+        return
+    _stop.clear()
+    for name, (interval, func, run_at_start) in _jobs.items():
+        thread = threading.Thread(target=_loop, args=(name, interval, func, run_at_start), name=f"job-{name}", daemon=True)
+        thread.start()
+        _threads.append(thread)
+        log_info("SCHEDULER", f"Đã bật job {name} (mỗi {interval:g} giây)")
+
+
+def stop_scheduler(timeout: float = 5.0):
+    """Dừng các job (gọi từ shutdown event); job đang chạy được chờ tối đa `timeout` giây."""
+    _stop.set()
+    for thread in _threads:
+        thread.join(timeout)
+    _threads.clear()
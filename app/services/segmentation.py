@@ -0,0 +1,161 @@
+# Backend/app/services/segmentation.py
+"""
+Phân khúc khách hàng theo RFM (Recency, Frequency, Monetary), tính theo lô cho toàn bộ khách hàng.
+
+Hóa đơn đã thanh toán được gom theo khách hàng ngay trong database (một lượt quét invoices)
+và đọc về theo từng khối, nên không có lúc nào giữ hàng triệu hóa đơn trong bộ nhớ.
+Điểm R/F/M (1..5) chia theo ngũ phân vị bằng NumPy trên toàn bộ khách hàng cùng lúc;
+tổ hợp điểm quyết định phân khúc. Kết quả ghi đè bảng customer_segments.
+"""
+import threading
+import time
+from datetime import date, datetime
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy import select, func, delete, insert, true
+from ..models import Invoice, CustomerSegment
+from .customers import WALK_IN_CUSTOMER
+from ..logger import log_success
+
+SCORE_BINS = 5
+LOAD_CHUNK_ROWS = 50000
+
+# (mã, tên hiển thị); thứ tự là thứ tự ưu tiên khi một khách hàng thỏa nhiều điều kiện
+SEGMENTS = [
+    ('champions', 'Khách hàng tốt nhất'),
+    ('loyal', 'Trung thành'),
+    ('new', 'Khách hàng mới'),
+    ('potential', 'Tiềm năng'),
+    ('at_risk', 'Có nguy cơ rời bỏ'),
+    ('lost', 'Đã rời bỏ'),
+    ('hibernating', 'Ngủ đông'),
+    ('need_attention', 'Cần chú ý'),
+]
+SEGMENT_NAMES = dict(SEGMENTS)
+
+
+def quantile_scores(values: np.ndarray, bins: int = SCORE_BINS) -> np.ndarray:
+    """Điểm 1..bins theo phân vị của `values`.
+
+    Giá trị bằng nhau luôn cùng điểm; giá trị nằm đúng ngưỡng thuộc nhóm thấp hơn, nên khi nhiều
+    khách hàng chỉ có một hóa đơn thì họ cùng nhận điểm F thấp nhất.
+    """
+    if values.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    edges = np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1])
+    return np.searchsorted(edges, values, side='left') + 1
+
+
+def segment_codes(r: np.ndarray, f: np.ndarray, m: np.ndarray) -> np.ndarray:
+    """Mã phân khúc cho từng khách hàng từ điểm R, F, M."""
+    conditions = [
+        (r >= 4) & (f >= 4) & (m >= 4),
+        (r >= 3) & (f >= 4),
+        (r >= 4) & (f <= 1),
+        (r >= 4) & (f <= 3),
+        (r <= 2) & (f >= 3),
+        (r <= 1) & (f <= 2),
+        (r <= 2) & (f <= 2),
+    ]
+    codes = [code for code, _ in SEGMENTS]
+    return np.select(conditions, codes[:-1], default=codes[-1])
+
+
+def load_customer_history(db: Session) -> dict:
+    """Ngày mua gần nhất, số hóa đơn và tổng tiền đã thanh toán của từng khách hàng.
+
+    GROUP BY chạy trong database; kết quả (một dòng mỗi khách hàng) được đọc theo từng khối.
+    """
+    stmt = select(
+        Invoice.nguoi_mua,
+        func.max(Invoice.account_id),
+        func.max(Invoice.ngay_hd),
+        func.count(Invoice.id),
+        func.coalesce(func.sum(Invoice.tong_tien), 0.0),
+    ).where(
+        Invoice.da_thanh_toan == true(),
+        Invoice.nguoi_mua.isnot(None),
+        Invoice.nguoi_mua != '',
+        Invoice.nguoi_mua != WALK_IN_CUSTOMER,
+    ).group_by(Invoice.nguoi_mua)
+
+    names, account_ids, last_days, frequency, monetary = [], [], [], [], []
+    result = db.execute(stmt.execution_options(yield_per=LOAD_CHUNK_ROWS))
+    for chunk in result.partitions():
+        names.extend(r[0] for r in chunk)
+        account_ids.extend(r[1] for r in chunk)
+        last_days.append(np.fromiter((r[2].toordinal() if r[2] else 0 for r in chunk), dtype=np.int64, count=len(chunk)))
+        frequency.append(np.fromiter((r[3] for r in chunk), dtype=np.int64, count=len(chunk)))
+        monetary.append(np.fromiter((r[4] or 0 for r in chunk), dtype=np.float64, count=len(chunk)))
+
+    def concat(parts, dtype):
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+    return {
+        "names": names,
+        "account_ids": account_ids,
+        "last_purchase": concat(last_days, np.int64),
+        "frequency": concat(frequency, np.int64),
+        "monetary": concat(monetary, np.float64),
+    }
+
+
+_refresh_lock = threading.Lock()
+
+
+def refresh_customer_segments(db: Session, today: date | None = None) -> dict:
+    """Tính lại RFM cho toàn bộ khách hàng và ghi đè customer_segments (caller commit)."""
+    with _refresh_lock:
+        started = time.perf_counter()
+        today = today or date.today()
+        history = load_customer_history(db)
+        loaded = time.perf_counter()
+
+        last_purchase = history["last_purchase"]
+        recency = np.where(last_purchase > 0, today.toordinal() - last_purchase, 0).clip(min=0)
+        r_score = SCORE_BINS + 1 - quantile_scores(recency)  # Mua càng gần, điểm R càng cao
+        f_score = quantile_scores(history["frequency"])
+        m_score = quantile_scores(history["monetary"])
+        segments = segment_codes(r_score, f_score, m_score)
+        computed_at = datetime.now()
+
+        db.execute(delete(CustomerSegment))
+        batch = []
+        for i, name in enumerate(history["names"]):
+            batch.append({
+                "nguoi_mua": name,
+                "account_id": history["account_ids"][i],
+                "last_purchase": date.fromordinal(int(last_purchase[i])) if last_purchase[i] else None,
+                "recency_days": int(recency[i]),
+                "frequency": int(history["frequency"][i]),
+                "monetary": float(history["monetary"][i]),
+                "r_score": int(r_score[i]),
+                "f_score": int(f_score[i]),
+                "m_score": int(m_score[i]),
+                "rfm_score": f"{r_score[i]}{f_score[i]}{m_score[i]}",
+                "segment": str(segments[i]),
+                "computed_at": computed_at,
+            })
+            if len(batch) >= LOAD_CHUNK_ROWS:
+                db.execute(insert(CustomerSegment), batch)
+                batch = []
+        if batch:
+            db.execute(insert(CustomerSegment), batch)
+        db.flush()
+
+    codes, counts = np.unique(segments, return_counts=True)
+    return {
+        "customers": len(history["names"]),
+        "segments": {str(code): int(count) for code, count in zip(codes, counts)},
+        "load_seconds": round(loaded - started, 3),
+        "compute_seconds": round(time.perf_counter() - loaded, 3),
+        "computed_at": computed_at,
+    }
+
+
+def customer_segment_job(db: Session):
+    """Job định kỳ của scheduler: tính lại customer_segments."""
+    info = refresh_customer_segments(db)
+    db.commit()
+    log_success("CUSTOMER_SEGMENTS", f"Đã phân khúc {info['customers']} khách hàng "
+                                     f"trong {info['load_seconds'] + info['compute_seconds']:.1f} giây")
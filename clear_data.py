@@ -11,7 +11,8 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from app.database import SessionLocal
 from app.models import (
     User, InvoiceItem, Invoice, OrderItem, Order, Price, Product, ProductGroup,
-    Warehouse, Shop, Area, Account, GeneralDiary, DiscountCode, Schedule
+    Warehouse, Shop, Area, Account, GeneralDiary, DiscountCode, Schedule, CustomerBalance, DailySales,
+    AccountTier, ReorderSnapshot, ProductForecast, CustomerSegment
 )
 import codecs
 
@@ -50,6 +51,24 @@ def clear_data():
         db.query(Invoice).delete()
         print("  ✓ Đã xóa Invoice")
         
+        db.query(CustomerBalance).delete()
+        print("  ✓ Đã xóa CustomerBalance")
+        
+        db.query(DailySales).delete()
+        print("  ✓ Đã xóa DailySales")
+        
+        db.query(AccountTier).delete()
+        print("  ✓ Đã xóa AccountTier")
+        
+        db.query(ReorderSnapshot).delete()
+        print("  ✓ Đã xóa ReorderSnapshot")
+        
+        db.query(ProductForecast).delete()
+        print("  ✓ Đã xóa ProductForecast")
+        
+        db.query(CustomerSegment).delete()
+        print("  ✓ Đã xóa CustomerSegment")
+        
         db.query(OrderItem).delete()
         print("  ✓ Đã xóa OrderItem")
         
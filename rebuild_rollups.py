@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Script để tính lại các bảng tổng hợp (công nợ khách hàng, doanh số theo ngày, hạng khách hàng) từ dữ liệu hóa đơn
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import SessionLocal
+from app.services.invoices import rebuild_customer_balances, rebuild_daily_sales
+from app.services.customers import rebuild_account_tiers
+import codecs
+
+# Fix encoding for Windows console
+if sys.platform == 'win32':
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+def rebuild_rollups():
+    """Tính lại toàn bộ bảng tổng hợp từ hóa đơn"""
+    db = SessionLocal()
+    try:
+        print("=" * 60)
+        print("TÍNH LẠI BẢNG TỔNG HỢP")
+        print("=" * 60)
+
+        count = rebuild_customer_balances(db)
+        db.commit()
+        print(f"  ✓ customer_balances: {count} khách hàng")
+
+        count = rebuild_daily_sales(db)
+        db.commit()
+        print(f"  ✓ daily_sales: {count} dòng")
+
+        count = rebuild_account_tiers(db)
+        db.commit()
+        print(f"  ✓ account_tiers: {count} tài khoản")
+
+        print("\n✅ Đã tính lại bảng tổng hợp thành công.")
+
+    except Exception as e:
+        db.rollback()
+        print(f"\n❌ Lỗi khi tính lại bảng tổng hợp: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild_rollups()
@@ -23,6 +23,7 @@ from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 from app.database import engine, Base, SessionLocal
 from app.models import *  # Import tất cả models để đảm bảo được đăng ký
+from app.migrations import run_migrations
 from werkzeug.security import generate_password_hash
 
 def setup_database():
@@ -39,6 +40,9 @@ def setup_database():
         # Tạo tất cả bảng
         Base.metadata.create_all(bind=engine)
         
+        # Nâng cấp schema cho database đã có dữ liệu (thêm cột, index, backfill)
+        run_migrations(engine)
+        
         print(f"✅ Hoàn thành! Đã tạo {len(tables)} bảng.")
         print("🌐 Database đã sẵn sàng sử dụng.")
         